@@ -1,9 +1,66 @@
 import os
 import sys
+from typing import Dict, Optional
 
 import streamlit as st
 
-from hn_core.simulation.run import run
+from hn_core.simulation.jobs import JobManager, SimulationJob
+from hn_core.simulation.run import load_prompts
+
+
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    """Background simulations, shared by every session of the server"""
+    return JobManager(max_workers=int(os.getenv("HN_MAX_JOBS", "4")))
+
+
+@st.cache_resource(show_spinner="Loading personas...")
+def get_prompts(num_agents: int, archive_path: Optional[str]) -> Dict[str, str]:
+    """Persona prompts, loaded once per server instead of once per simulation"""
+    return load_prompts(num_agents=num_agents, archive_path=archive_path)
+
+
+def render_progress(job: SimulationJob, polling: bool = False):
+    """Per step charts of a job, updated as its time steps finish"""
+    progress = list(job.progress)
+    total_time_steps = job.params["total_time_steps"]
+    st.progress(
+        min(len(progress) / total_time_steps, 1.0),
+        text=f"{job.status}: {len(progress)}/{total_time_steps} time steps",
+    )
+    if progress:
+        col1, col2 = st.columns(2)
+        with col1:
+            st.caption("Upvotes and comments")
+            st.line_chart(progress, x="sim_step", y=["upvotes", "comments_count"])
+        with col2:
+            st.caption("Score")
+            st.line_chart(progress, x="sim_step", y="score")
+
+    if polling and job.finished:
+        # stop polling and render the final results
+        st.rerun()
+
+
+def render_job(job: SimulationJob):
+    st.subheader(job.params["title"])
+    if job.finished:
+        render_progress(job)
+    else:
+        st.fragment(render_progress, run_every=1)(job, polling=True)
+
+    if job.status == "failed":
+        st.error(f"An error occurred during simulation: {job.error}")
+    elif job.status == "done":
+        agent_profile, post_history = job.result
+
+        # Display post history
+        with st.expander("Final Post State"):
+            st.json(post_history)
+
+        # Display agent profiles
+        with st.expander("Agent Profiles"):
+            st.json(agent_profile)
 
 
 def main():
@@ -44,6 +101,14 @@ def main():
         step=0.1,
         help="Controls how quickly the probability of agent actions changes with respect to post scores. Higher values make agents more sensitive to score differences.",
     )
+    archive_path = st.sidebar.text_input(
+        "Archive Path",
+        os.getenv("HN_ARCHIVE_PATH", ""),
+        help="SQLite archive created with hn_core.utils.archive. Leave empty to use the JSON files in data/.",
+    )
+
+    manager = get_job_manager()
+    jobs = st.session_state.setdefault("jobs", [])
 
     # Run simulation button
     if st.button("Run Simulation"):
@@ -52,31 +117,32 @@ def main():
             return
 
         try:
-            with st.spinner("Running simulation..."):
-                agent_profile, post_history = run(
-                    title=title,
-                    url=url,
-                    text=text,
-                    model=model,
-                    num_agents=num_agents if num_agents else None,
-                    total_time_steps=total_time_steps,
-                    batch_size=batch_size,
-                    k=k,
-                )
-
-                # Display results
-                st.header("Simulation Results")
-
-                # Display post history
-                st.subheader("Final Post State")
-                st.json(post_history)
-
-                # Display agent profiles
-                st.subheader("Agent Profiles")
-                st.json(agent_profile)
-
+            prompts = get_prompts(num_agents, archive_path or None)
         except Exception as e:
-            st.error(f"An error occurred during simulation: {str(e)}")
+            st.error(f"An error occurred while loading personas: {str(e)}")
+            return
+
+        job = manager.submit(
+            title=title,
+            url=url,
+            text=text,
+            model=model,
+            num_agents=num_agents,
+            total_time_steps=total_time_steps,
+            batch_size=batch_size,
+            k=k,
+            archive_path=archive_path or None,
+            prompts=prompts,
+        )
+        jobs.append(job.id)
+
+    if jobs:
+        # Display results, most recent simulation first
+        st.header("Simulation Results")
+        for job_id in reversed(jobs):
+            job = manager.get(job_id)
+            if job is not None:
+                render_job(job)
 
 
 if __name__ == "__main__":
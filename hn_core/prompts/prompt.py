@@ -26,18 +26,7 @@ First, let's review the user's information:
 <total_posts>{{POSTS_COUNT}}</total_posts>
 </activity_metrics>
 
-Now, you will be presented with a HackerNews post. Your task is to decide whether to upvote, comment, or take no action based on the user's profile and behavior patterns. Here are the details of the post:
-
-<post>
-<title>{post_title}</title>
-<url>{post_url}</url>
-<text>{post_text}</text>
-<upvotes>{post_upvotes}</upvotes>
-<comment_count>{post_comments_count}</comment_count>
-<comments>
-{post_comments}
-</comments>
-</post>
+Next, you will be presented with a HackerNews post. Your task is to decide whether to upvote, comment, or take no action based on the user's profile and behavior patterns.
 
 Instructions:
 
@@ -63,6 +52,21 @@ Your answer should be in the following format:
 Remember to maintain consistency with the user's demonstrated knowledge, interests, and behavior patterns at all times. Do not inject your own knowledge or opinions that aren't supported by the user's profile and history.
 """
 
+post_prompt = """
+Here are the details of the post:
+
+<post>
+<title>{post_title}</title>
+<url>{post_url}</url>
+<text>{post_text}</text>
+<upvotes>{post_upvotes}</upvotes>
+<comment_count>{post_comments_count}</comment_count>
+<comments>
+{post_comments}
+</comments>
+</post>
+"""
+
 classify = """
 You are a moderator for HackerNews who is responsible for classifying user posts. Your task is to classify input post into one of four categories:
 
@@ -78,3 +82,44 @@ text: {text}
 
 You are allowed to choose more than one category per post except NA.
 """
+
+classify_batch = """
+You are a moderator for HackerNews who is responsible for classifying user posts. Your task is to classify each input post into the following categories:
+
+- gag: posts aimed purely for amusement and entertainment. These usually have jokes or humors in them.
+- politics: posts about political news, opinions and interpretations.
+- DEI: posts about diversity and inclusion.
+- tutorial: posts about tutorials on a subject.
+- NA: posts that are not applicable.
+
+Here are the posts:
+{posts}
+
+You are allowed to choose more than one category per post except NA.
+Return exactly one classification per post, using the index of the post.
+"""
+
+packed_prompt = """
+You are tasked with simulating the behavior of several HackerNews users at once. Each user is described between <user id="..."> and </user> tags, together with the instructions for simulating that user.
+
+Simulate every user independently: base each user's decision only on that user's own profile and history, never on the other users.
+
+{{USERS}}
+
+Return exactly one answer per user in `actions`, with the user's id in `agent_id`.
+"""
+
+decision_prompt = """
+For now only decide on the actions, the comment itself is written in a later step. Instead of the format above, answer in the following format:
+
+"upvote": <bool>, // Whether to upvote the post.
+"will_comment": <bool>, // Whether to comment on the post.
+"role": <str> // Your persona's professional role based on the expertise and interest.
+"""
+
+comment_prompt = """
+You have decided to comment on this post. Before writing the comment, analyze the post and the user's profile and history in `thoughts`. Instead of the format above, answer in the following format:
+
+"thoughts": <str>, // Your thoughts on the post and the user's profile and history.
+"comment": <str> // The comment to be made on the post.
+"""
@@ -0,0 +1,172 @@
+import json
+import os
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from openai import OpenAI
+
+from hn_core.provider.litellm import LLM, get_llm
+from hn_core.utils.logger import get_logger
+
+logger = get_logger("hn_batch")
+
+
+class BatchBackend:
+    """Runs chat completion requests as an offline batch job.
+
+    Requests and results use the OpenAI Batch JSONL format: one
+    `{"custom_id", "method", "url", "body"}` request per line, and one
+    `{"custom_id", "response": {"status_code", "body"}, "error"}` result per line.
+    Subclasses implement `submit` and `wait`.
+    """
+
+    def __init__(self, work_dir: Optional[str] = None):
+        """
+        Args:
+            work_dir (str): Directory for the request/result files. Defaults to a
+                            temporary directory.
+        """
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix="hn_batch_")
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    def submit(self, path: str) -> str:
+        """Submit the request file at `path` and return the job id"""
+        raise NotImplementedError
+
+    def wait(self, job_id: str) -> List[Dict]:
+        """Block until the job finished and return its result records"""
+        raise NotImplementedError
+
+    def write_requests(self, requests: List[Dict]) -> str:
+        path = os.path.join(self.work_dir, f"requests_{uuid.uuid4().hex}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for request in requests:
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+        return path
+
+    def run(self, requests: List[Dict]) -> Dict[str, Optional[Dict]]:
+        """Run `requests` as one job.
+
+        Returns:
+            dict: Response body per `custom_id`, None for requests that failed
+        """
+        if not requests:
+            return {}
+
+        path = self.write_requests(requests)
+        job_id = self.submit(path)
+        logger.info(f"Submitted batch job {job_id} with {len(requests)} requests")
+
+        results = {request["custom_id"]: None for request in requests}
+        for record in self.wait(job_id):
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                logger.warning(
+                    f"Batch request {record.get('custom_id')} failed: {record.get('error')}"
+                )
+                continue
+            results[record["custom_id"]] = response["body"]
+        return results
+
+
+class LocalBatchBackend(BatchBackend):
+    """File based stand-in for a provider batch API.
+
+    Jobs are processed synchronously on submit through `LLM.generate`, and results
+    are written next to the request file in the same format a provider returns.
+    """
+
+    def __init__(self, llm: Optional[LLM] = None, work_dir: Optional[str] = None):
+        super().__init__(work_dir)
+        self.llm = llm or get_llm()
+
+    def submit(self, path: str) -> str:
+        output_path = path.replace("requests_", "results_")
+        with (
+            open(path, "r", encoding="utf-8") as requests,
+            open(output_path, "w", encoding="utf-8") as results,
+        ):
+            for line in requests:
+                request = json.loads(line)
+                body = dict(request["body"])
+                record = {"id": uuid.uuid4().hex, "custom_id": request["custom_id"]}
+                try:
+                    res = self.llm.generate(
+                        model=body.pop("model"),
+                        messages=body.pop("messages"),
+                        response_format=body.pop("response_format", None),
+                        **body,
+                    )
+                    record["response"] = {"status_code": 200, "body": res.model_dump()}
+                    record["error"] = None
+                except Exception as e:
+                    record["response"] = None
+                    record["error"] = {"message": str(e)}
+                results.write(json.dumps(record, default=str) + "\n")
+        return output_path
+
+    def wait(self, job_id: str) -> List[Dict]:
+        with open(job_id, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Runs jobs through the OpenAI Batch API (`/v1/chat/completions`)"""
+
+    terminal_statuses = {"completed", "failed", "expired", "cancelled"}
+
+    def __init__(
+        self,
+        client=None,
+        poll_interval: float = 30.0,
+        completion_window: str = "24h",
+        work_dir: Optional[str] = None,
+    ):
+        super().__init__(work_dir)
+        self.client = client or OpenAI()
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+
+    def write_requests(self, requests: List[Dict]) -> str:
+        # the Batch API expects bare OpenAI model names, the caller's requests are
+        # left untouched
+        stripped = []
+        for request in requests:
+            model = request["body"]["model"]
+            if model.startswith("openai/"):
+                request = {
+                    **request,
+                    "body": {**request["body"], "model": model[len("openai/") :]},
+                }
+            stripped.append(request)
+        return super().write_requests(stripped)
+
+    def submit(self, path: str) -> str:
+        with open(path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def wait(self, job_id: str) -> List[Dict]:
+        while True:
+            batch = self.client.batches.retrieve(job_id)
+            if batch.status in self.terminal_statuses:
+                break
+            time.sleep(self.poll_interval)
+
+        if batch.status != "completed":
+            logger.error(f"Batch job {job_id} ended with status {batch.status}")
+
+        records = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = self.client.files.content(file_id).text
+            records.extend(json.loads(line) for line in content.splitlines() if line)
+        return records
@@ -0,0 +1,180 @@
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from hn_core.utils.logger import get_logger
+
+logger = get_logger("hn_deployments")
+
+
+class Deployment:
+    """One endpoint a logical model can be served from, e.g. an API key or a region"""
+
+    def __init__(
+        self,
+        model: str,
+        name: Optional[str] = None,
+        weight: float = 1.0,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        params: Optional[Dict] = None,
+    ):
+        """
+        Args:
+            model (str): litellm model name sent to this deployment, e.g.
+                         "azure/gpt-4o-mini-eu"
+            name (str): Unique name, used for rate limiting, metrics and logs
+            weight (float): Share of the traffic relative to the other deployments,
+                            usually proportional to its quota
+            api_key (str): API key of the deployment, the provider default when omitted
+            api_base (str): Endpoint of the deployment, the provider default when
+                            omitted
+            rpm (float): Requests per minute quota of the deployment
+            tpm (float): Tokens per minute quota of the deployment
+            params (dict): Additional litellm parameters, e.g. `api_version`
+        """
+        if weight <= 0:
+            raise ValueError(f"Weight of deployment {name or model} must be positive")
+        self.model = model
+        self.name = name or model
+        self.weight = weight
+        self.api_key = api_key
+        self.api_base = api_base
+        self.rpm = rpm
+        self.tpm = tpm
+        self.params = params or {}
+
+        # health, updated by `DeploymentPool`
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+    def completion_params(self) -> Dict:
+        """litellm parameters routing a request to this deployment"""
+        params = {**self.params, "model": self.model}
+        if self.api_key is not None:
+            params["api_key"] = self.api_key
+        if self.api_base is not None:
+            params["api_base"] = self.api_base
+        return params
+
+
+class DeploymentPool:
+    """Weighted load balancing with failover across the deployments of a model.
+
+    A single instance is shared by every `LLM` of the process. Requests for a model
+    with registered deployments are spread over the healthy ones by weight, so the
+    throughput is the sum of their quotas. A deployment that fails is put in a
+    cooldown growing exponentially with consecutive failures (or lasting as long as
+    the provider asks after a rate limit) and the request fails over to another one.
+    Models without deployments are sent to the provider as they are.
+    """
+
+    def __init__(self, cooldown: float = 5.0, max_cooldown: float = 300.0):
+        """
+        Args:
+            cooldown (float): Cooldown in seconds after the first failure
+            max_cooldown (float): Upper bound of the cooldown in seconds
+        """
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._deployments: Dict[str, List[Deployment]] = {}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def configure(self, model: str, deployments: List[Deployment]):
+        """Serve `model` from `deployments`, replacing earlier ones"""
+        names = [deployment.name for deployment in deployments]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Deployment names of {model} must be unique: {names}")
+        with self._lock:
+            if deployments:
+                self._deployments[model] = list(deployments)
+            else:
+                self._deployments.pop(model, None)
+
+    def load(self, path: str):
+        """Configure deployments from a JSON file.
+
+        The file maps model names to lists of `Deployment` parameters. Use
+        `api_key_env` instead of `api_key` to read a key from the environment:
+
+            {"gpt-4o-mini": [
+                {"name": "key1", "model": "gpt-4o-mini", "api_key_env": "OPENAI_API_KEY", "weight": 2},
+                {"name": "key2", "model": "gpt-4o-mini", "api_key_env": "OPENAI_API_KEY_2"}
+            ]}
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        for model, entries in config.items():
+            deployments = []
+            for entry in entries:
+                entry = dict(entry)
+                key_env = entry.pop("api_key_env", None)
+                if key_env is not None:
+                    entry["api_key"] = os.environ[key_env]
+                deployments.append(Deployment(**entry))
+            self.configure(model, deployments)
+            logger.info(f"Serving {model} from {len(deployments)} deployments")
+
+    def deployments(self, model: str) -> List[Deployment]:
+        return list(self._deployments.get(model, ()))
+
+    def __contains__(self, model: str) -> bool:
+        return model in self._deployments
+
+    def choose(self, model: str, exclude=()) -> Optional[Deployment]:
+        """Pick a deployment of `model` by weight, skipping the `exclude`d names.
+
+        Deployments in cooldown are only picked when no other one is left, then the
+        one recovering first is used. Returns None when every deployment is excluded.
+        """
+        with self._lock:
+            candidates = [
+                deployment
+                for deployment in self._deployments.get(model, ())
+                if deployment.name not in exclude
+            ]
+            if not candidates:
+                return None
+
+            now = time.monotonic()
+            healthy = [d for d in candidates if d.cooldown_until <= now]
+            if not healthy:
+                return min(candidates, key=lambda d: d.cooldown_until)
+
+            total = sum(d.weight for d in healthy)
+            point = self._random.uniform(0, total)
+            for deployment in healthy:
+                point -= deployment.weight
+                if point <= 0:
+                    return deployment
+            return healthy[-1]
+
+    def success(self, deployment: Deployment):
+        with self._lock:
+            deployment.failures = 0
+
+    def failure(self, deployment: Deployment, cooldown: Optional[float] = None):
+        """Put `deployment` in cooldown, for `cooldown` seconds when given"""
+        with self._lock:
+            deployment.failures += 1
+            if cooldown is None:
+                cooldown = min(
+                    self.cooldown * 2 ** (deployment.failures - 1), self.max_cooldown
+                )
+            deployment.cooldown_until = max(
+                deployment.cooldown_until, time.monotonic() + cooldown
+            )
+        logger.warning(
+            f"Deployment {deployment.name} failed {deployment.failures} times in a "
+            f"row, cooling down for {cooldown:.1f}s"
+        )
+
+
+# shared by every LLM instance of the process
+deployment_pool = DeploymentPool()
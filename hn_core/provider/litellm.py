@@ -1,11 +1,598 @@
-from typing import List, Optional
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Mapping, Optional, Set
 
+import httpx
+import litellm
 from pydantic import BaseModel
 
-from litellm import completion
+from hn_core.provider.cache import ResponseCache, cache_key
+from hn_core.provider.deployments import Deployment, DeploymentPool, deployment_pool
+from hn_core.utils import metrics
+from hn_core.utils.logger import get_logger
+from litellm import (
+    BadRequestError,
+    RateLimitError,
+    acompletion,
+    completion,
+    completion_cost,
+)
+
+logger = get_logger("hn_provider")
+
+
+class _Bucket:
+    """Requests/tokens budget of a single model.
+
+    Both budgets are token buckets refilled continuously at `limit / 60` per second.
+    Callers reserve capacity up front; a negative level means the capacity is already
+    promised to earlier callers and the new caller has to wait until it refills.
+    """
+
+    def __init__(self, rpm: Optional[float] = None, tpm: Optional[float] = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = rpm or 0.0
+        self.tokens = tpm or 0.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.consecutive_limits = 0
+        self.configured = rpm is not None or tpm is not None
+        self.recent = deque()  # send times of the last minute, used to infer limits
+
+    def refill(self, now: float):
+        elapsed = now - self.updated
+        if self.rpm:
+            self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+        self.updated = now
+        while self.recent and self.recent[0] < now - 60:
+            self.recent.popleft()
+
+
+class RateLimiter:
+    """Process-wide requests-per-minute / tokens-per-minute limiter.
+
+    A single instance is shared by every `LLM` so all agents draw from the same
+    per-model budget. Calls are paced before they are sent instead of every agent
+    backing off on its own after a `RateLimitError`. Limits can be configured
+    explicitly or are learned from the provider's rate limit headers.
+    """
+
+    _duration_re = re.compile(r"([\d.]+)(ms|s|m|h)")
+
+    def __init__(self, infer_limits: bool = True):
+        """
+        Args:
+            infer_limits (bool): Turn the request rate at the first rate limit error
+                                 into the limit of models without known limits. When
+                                 off, rate limit errors only pause the model.
+        """
+        self.infer_limits = infer_limits
+        self._buckets: Dict[str, _Bucket] = {}
+        self._lock = threading.Lock()
+
+    def configure(
+        self,
+        model: str,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        replace: bool = True,
+    ):
+        """Set the requests and tokens per minute budget for `model`.
+
+        With `replace=False` a budget configured earlier is kept.
+        """
+        with self._lock:
+            bucket = self._buckets.get(model)
+            if replace or bucket is None or not bucket.configured:
+                self._buckets[model] = _Bucket(rpm=rpm, tpm=tpm)
+
+    def _bucket(self, model: str) -> _Bucket:
+        bucket = self._buckets.get(model)
+        if bucket is None:
+            bucket = self._buckets[model] = _Bucket()
+        return bucket
+
+    def reserve(self, model: str, tokens: int = 0) -> float:
+        """Reserve one request and `tokens` tokens, returning the seconds to wait"""
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(model)
+            bucket.refill(now)
+
+            wait = max(0.0, bucket.blocked_until - now)
+            if bucket.rpm:
+                bucket.requests -= 1
+                if bucket.requests < 0:
+                    wait = max(wait, -bucket.requests * 60 / bucket.rpm)
+            if bucket.tpm:
+                bucket.tokens -= tokens
+                if bucket.tokens < 0:
+                    wait = max(wait, -bucket.tokens * 60 / bucket.tpm)
+
+            bucket.recent.append(now + wait)
+            return wait
+
+    def acquire(self, model: str, tokens: int = 0) -> float:
+        wait = self.reserve(model, tokens)
+        if wait > 0:
+            _record_wait(model, wait)
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self, model: str, tokens: int = 0) -> float:
+        wait = self.reserve(model, tokens)
+        if wait > 0:
+            _record_wait(model, wait)
+            await asyncio.sleep(wait)
+        return wait
+
+    def record_usage(self, model: str, reserved: int, used: int):
+        """Correct a token reservation once the actual usage is known"""
+        with self._lock:
+            bucket = self._bucket(model)
+            if bucket.tpm:
+                bucket.tokens = min(bucket.tpm, bucket.tokens + reserved - used)
+            bucket.consecutive_limits = 0
+
+    def update_from_headers(self, model: str, headers: Optional[Mapping]):
+        """Adjust the budget of `model` from provider rate limit headers.
+
+        Understands the OpenAI style `x-ratelimit-{limit,remaining}-{requests,tokens}`
+        headers (as well as their `llm_provider-` prefixed litellm variants).
+        Limits are only learned for models that were not configured explicitly.
+        """
+        headers = _normalize_headers(headers)
+        if not headers:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(model)
+            bucket.refill(now)
+
+            if not bucket.configured:
+                limit_requests = _to_float(headers.get("x-ratelimit-limit-requests"))
+                limit_tokens = _to_float(headers.get("x-ratelimit-limit-tokens"))
+                if limit_requests and bucket.rpm is None:
+                    bucket.requests = limit_requests
+                if limit_tokens and bucket.tpm is None:
+                    bucket.tokens = limit_tokens
+                bucket.rpm = limit_requests or bucket.rpm
+                bucket.tpm = limit_tokens or bucket.tpm
+
+            # never hold more budget than the provider says is left
+            remaining_requests = _to_float(
+                headers.get("x-ratelimit-remaining-requests")
+            )
+            remaining_tokens = _to_float(headers.get("x-ratelimit-remaining-tokens"))
+            if bucket.rpm and remaining_requests is not None:
+                bucket.requests = min(bucket.requests, remaining_requests)
+            if bucket.tpm and remaining_tokens is not None:
+                bucket.tokens = min(bucket.tokens, remaining_tokens)
+
+    def penalize(self, model: str, headers: Optional[Mapping] = None) -> float:
+        """Block `model` after a rate limit error.
+
+        The wait comes from `Retry-After` (or the reset headers) when present,
+        otherwise it grows exponentially with consecutive errors. For models with
+        unknown limits the request rate of the last minute becomes the new limit,
+        extrapolated to a minute when fewer than 60 seconds of requests were seen.
+        """
+        headers = _normalize_headers(headers)
+        retry_after = self._retry_after(headers)
+
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._bucket(model)
+            bucket.refill(now)
+            bucket.consecutive_limits += 1
+
+            if retry_after is None:
+                retry_after = min(2**bucket.consecutive_limits, 60)
+            bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+
+            if (
+                self.infer_limits
+                and not bucket.configured
+                and bucket.rpm is None
+                and bucket.recent
+            ):
+                window = min(max(now - bucket.recent[0], 1.0), 60.0)
+                bucket.rpm = max(1.0, len(bucket.recent) * 60 / window * 0.9)
+
+            # drain the budget so waiting callers are spread out once unblocked
+            if bucket.rpm:
+                bucket.requests = min(bucket.requests, 0.0)
+
+        logger.warning(f"Rate limited on {model}, pausing requests for {retry_after}s")
+        return retry_after
+
+    def _retry_after(self, headers: Dict[str, str]) -> Optional[float]:
+        for key in ("retry-after-ms", "retry-after"):
+            value = _to_float(headers.get(key))
+            if value is not None:
+                return value / 1000 if key.endswith("ms") else value
+
+        resets = [
+            self._parse_duration(headers.get(key))
+            for key in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+        ]
+        resets = [r for r in resets if r is not None]
+        return max(resets) if resets else None
+
+    def _parse_duration(self, value: Optional[str]) -> Optional[float]:
+        """Parse durations such as `1s`, `6m0s` or `250ms`"""
+        if value is None:
+            return None
+        plain = _to_float(value)
+        if plain is not None:
+            return plain
+        units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        parts = self._duration_re.findall(value)
+        if not parts:
+            return None
+        return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+def _record_wait(model: str, wait: float):
+    metrics.rate_limit_waits.inc(model=model)
+    metrics.rate_limit_wait_seconds.inc(wait, model=model)
+
+
+def _normalize_headers(headers: Optional[Mapping]) -> Dict[str, str]:
+    if not headers:
+        return {}
+    normalized = {}
+    for key, value in dict(headers).items():
+        key = key.lower()
+        if key.startswith("llm_provider-"):
+            key = key[len("llm_provider-") :]
+        normalized[key] = value
+    return normalized
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _estimate_tokens(messages: List, **kwargs) -> int:
+    """Rough prompt + completion token estimate (~4 characters per token)"""
+    chars = sum(len(str(message.get("content", ""))) for message in messages)
+    return chars // 4 + (kwargs.get("max_tokens") or 0)
+
+
+def _response_headers(res) -> Dict:
+    hidden_params = getattr(res, "_hidden_params", None) or {}
+    return hidden_params.get("additional_headers") or {}
+
+
+def _error_headers(error: Exception) -> Optional[Mapping]:
+    headers = getattr(error, "litellm_response_headers", None)
+    if headers is None and getattr(error, "response", None) is not None:
+        headers = getattr(error.response, "headers", None)
+    return headers
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asks to wait after a rate limit error, if it says so"""
+    return rate_limiter._retry_after(_normalize_headers(_error_headers(error)))
+
+
+def get_usage(res) -> Dict[str, int]:
+    """Token usage of a completion, with prompt tokens split into cached and uncached.
+
+    Responses answered from the `ResponseCache` cost no tokens and report none.
+    """
+    usage = getattr(res, "usage", None)
+    hidden = getattr(res, "_hidden_params", None) or {}
+    if usage is None or hidden.get("cache_hit"):
+        return {
+            "input_tokens": 0,
+            "cached_input_tokens": 0,
+            "uncached_input_tokens": 0,
+            "output_tokens": 0,
+        }
+
+    input_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        # Anthropic style accounting
+        cached = getattr(usage, "cache_read_input_tokens", 0)
+    cached = cached or 0
+
+    return {
+        "input_tokens": input_tokens,
+        "cached_input_tokens": cached,
+        "uncached_input_tokens": max(input_tokens - cached, 0),
+        "output_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
+
+
+# models litellm has no pricing for, looked up only once as failed lookups are noisy
+_unpriced_models = set()
+
+
+def _completion_cost(res) -> float:
+    """Cost of a completion in USD, 0 for models without known pricing"""
+    model = getattr(res, "model", None)
+    if model in _unpriced_models:
+        return 0.0
+    try:
+        return completion_cost(completion_response=res) or 0.0
+    except Exception:
+        _unpriced_models.add(model)
+        return 0.0
+
+
+def needs_cache_control(model: str) -> bool:
+    """Whether the provider of `model` only caches prompt prefixes marked explicitly.
+
+    OpenAI style providers cache long prefixes automatically, Anthropic models need
+    a `cache_control` breakpoint on the prefix.
+    """
+    model = model.lower()
+    return model.startswith("anthropic/") or "claude" in model
+
+
+# shared by every LLM instance of the process
+rate_limiter = RateLimiter()
+
+_setup_lock = threading.Lock()
+_process_ready = False
+_shared_llm: Optional["LLM"] = None
+_shared_llm_lock = threading.Lock()
+
+
+def configure_http_pool(
+    max_connections: int = 200,
+    max_keepalive_connections: int = 100,
+    keepalive_expiry: float = 60.0,
+):
+    """Send the requests of the process through one pooled, keep-alive HTTP client.
+
+    litellm passes `litellm.client_session` to the OpenAI compatible providers, so
+    every agent and deployment reuses warm connections instead of opening new ones.
+    Async requests keep the per event loop clients litellm caches itself, as a
+    client cannot be shared across the event loops of concurrent simulations.
+
+    Args:
+        max_connections (int): Open connections, should cover the worker pool
+        max_keepalive_connections (int): Idle connections kept open
+        keepalive_expiry (float): Seconds an idle connection is kept open
+    """
+    previous = litellm.client_session
+    litellm.client_session = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(600.0, connect=10.0),
+    )
+    if previous is not None:
+        previous.close()
+
+
+def _setup_process():
+    """Configure the HTTP pool and the deployments from `HN_*` variables, once"""
+    global _process_ready
+    with _setup_lock:
+        if _process_ready:
+            return
+        _process_ready = True
+        if litellm.client_session is None:
+            _configure_http_pool_from_env()
+        if os.getenv("HN_DEPLOYMENTS"):
+            deployment_pool.load(os.environ["HN_DEPLOYMENTS"])
+
+
+def _configure_http_pool_from_env():
+    configure_http_pool(
+        max_connections=int(os.getenv("HN_HTTP_MAX_CONNECTIONS", "200")),
+        max_keepalive_connections=int(os.getenv("HN_HTTP_MAX_KEEPALIVE", "100")),
+    )
+
+
+def reset_after_fork():
+    """Give a forked worker process its own HTTP connections and shared client.
+
+    Pooled sockets and their connection state are not fork-safe. The client
+    inherited from the parent and the provider clients litellm cached around it are
+    dropped without closing them, which would shut the parent's connections too.
+    """
+    global _setup_lock, _shared_llm_lock, _shared_llm
+    # another thread of the parent may have held the locks while forking
+    _setup_lock = threading.Lock()
+    _shared_llm_lock = threading.Lock()
+    _shared_llm = None
+    litellm.in_memory_llm_clients_cache.flush_cache()
+    if litellm.client_session is not None:
+        litellm.client_session = None
+        _configure_http_pool_from_env()
+
+
+def get_llm() -> "LLM":
+    """Provider client shared by every agent, classifier and job of the process"""
+    global _shared_llm
+    with _shared_llm_lock:
+        if _shared_llm is None:
+            _shared_llm = LLM()
+        return _shared_llm
+
+
+def configure_limits(
+    model: str,
+    rpm: Optional[float] = None,
+    tpm: Optional[float] = None,
+    limiter: Optional[RateLimiter] = None,
+    deployments: Optional[DeploymentPool] = None,
+):
+    """Set the requests and tokens per minute budget of `model`.
+
+    Requests routed to a deployment are paced by the budget of the deployment, so
+    for a model served by a `DeploymentPool` the budget is split over its
+    deployments by weight. Deployments with their own `rpm`/`tpm` keep those.
+
+    Args:
+        limiter (RateLimiter): Defaults to the process-wide limiter
+        deployments (DeploymentPool): Defaults to the process-wide pool
+    """
+    # deployments of `HN_DEPLOYMENTS` are loaded with the first client
+    _setup_process()
+    limiter = limiter or rate_limiter
+    deployments = deployment_pool if deployments is None else deployments
+    served = deployments.deployments(model)
+    if not served:
+        limiter.configure(model, rpm=rpm, tpm=tpm)
+        return
+
+    total = sum(deployment.weight for deployment in served)
+    for deployment in served:
+        share = deployment.weight / total
+        limiter.configure(
+            deployment.name,
+            rpm=_own_or_share(deployment.rpm, rpm, share),
+            tpm=_own_or_share(deployment.tpm, tpm, share),
+        )
+
+
+def _own_or_share(own: Optional[float], total: Optional[float], share: float):
+    if own is not None:
+        return own
+    return total * share if total is not None else None
+
+
+def _deployment_error(error: Exception) -> bool:
+    """Whether `error` is a fault of the deployment rather than of the request"""
+    return not isinstance(error, BadRequestError)
 
 
 class LLM:
+    def __init__(
+        self,
+        rate_limiter: Optional[RateLimiter] = rate_limiter,
+        cache: Optional[ResponseCache] = None,
+        deployments: Optional[DeploymentPool] = deployment_pool,
+    ):
+        """
+        Args:
+            rate_limiter (RateLimiter): Limiter used to pace requests. Defaults to the
+                                        process-wide limiter, `None` disables pacing.
+            cache (ResponseCache): Optional on-disk cache of completions. Cached responses
+                                   are returned without calling the provider.
+            deployments (DeploymentPool): Deployments requests are balanced over.
+                                          Defaults to the process-wide pool, `None`
+                                          sends every request to the model as is.
+        """
+        _setup_process()
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.deployments = deployments
+
+    def _completion(self, **kwargs):
+        """Send one request to the provider, overridden by clients such as `MockLLM`"""
+        return completion(**kwargs)
+
+    async def _acompletion(self, **kwargs):
+        return await acompletion(**kwargs)
+
+    def _cost(self, res) -> float:
+        return _completion_cost(res)
+
+    def _route(self, model: str, tried: Set[str]) -> Optional[Deployment]:
+        """Deployment serving the next attempt of a request, None to send it as is"""
+        if self.deployments is None or model not in self.deployments:
+            return None
+        deployment = self.deployments.choose(model, exclude=tried)
+        if deployment is None:
+            return None
+        tried.add(deployment.name)
+        if self.rate_limiter is not None and (
+            deployment.rpm is not None or deployment.tpm is not None
+        ):
+            self.rate_limiter.configure(
+                deployment.name, rpm=deployment.rpm, tpm=deployment.tpm, replace=False
+            )
+        return deployment
+
+    def _can_fail_over(
+        self, model: str, deployment: Optional[Deployment], tried: Set[str], error
+    ) -> bool:
+        return (
+            deployment is not None
+            and _deployment_error(error)
+            and len(tried) < len(self.deployments.deployments(model))
+        )
+
+    def _record(
+        self,
+        model: str,
+        deployment: Optional[Deployment],
+        reserved: int,
+        res,
+        latency: float,
+    ):
+        metrics.llm_requests.inc(model=model, status="ok")
+        metrics.llm_latency.observe(latency, model=model)
+        usage = get_usage(res)
+        for kind in ("input", "cached_input", "output"):
+            if usage[f"{kind}_tokens"]:
+                metrics.llm_tokens.inc(usage[f"{kind}_tokens"], model=model, kind=kind)
+        metrics.llm_cost.inc(self._cost(res), model=model)
+
+        key = model
+        if deployment is not None:
+            key = deployment.name
+            metrics.deployment_requests.inc(deployment=key, status="ok")
+            self.deployments.success(deployment)
+
+        if self.rate_limiter is None:
+            return
+        self.rate_limiter.update_from_headers(key, _response_headers(res))
+        usage = getattr(res, "usage", None)
+        if usage is not None and getattr(usage, "total_tokens", None):
+            self.rate_limiter.record_usage(key, reserved, usage.total_tokens)
+
+    def _cached(self, model: str, key: str):
+        cached = self.cache.get(key)
+        if cached is not None:
+            metrics.llm_requests.inc(model=model, status="cache_hit")
+        return cached
+
+    def _failed(
+        self, model: str, error: Exception, deployment: Optional[Deployment] = None
+    ):
+        key = deployment.name if deployment is not None else model
+        cooldown = None
+        if isinstance(error, RateLimitError):
+            status = "rate_limited"
+            if self.rate_limiter is not None:
+                cooldown = self.rate_limiter.penalize(key, _error_headers(error))
+        else:
+            status = "error"
+        metrics.llm_requests.inc(model=model, status=status)
+
+        if deployment is not None:
+            metrics.deployment_requests.inc(deployment=key, status=status)
+            if _deployment_error(error):
+                self.deployments.failure(deployment, cooldown)
+
+    def _raise(self, error: Exception):
+        if isinstance(error, RateLimitError):
+            raise error
+        raise Exception(f"LiteLLM inference failed: {str(error)}")
+
     def generate(
         self,
         model: str,
@@ -13,13 +600,85 @@ class LLM:
         response_format: Optional[BaseModel] = None,
         **kwargs,
     ):
-        try:
-            res = completion(
-                model=model,
-                messages=messages,
-                response_format=response_format,
-                **kwargs,
-            )
-            return res
-        except Exception as e:
-            raise Exception(f"LiteLLM inference failed: {str(e)}")
+        """Send a completion request for `model`.
+
+        Models with deployments in the pool are balanced over them, a request failing
+        on one deployment is retried on the others before the error is raised.
+        """
+        key = None
+        if self.cache is not None:
+            key = cache_key(model, messages, response_format, **kwargs)
+            cached = self._cached(model, key)
+            if cached is not None:
+                return cached
+
+        tokens = _estimate_tokens(messages, **kwargs)
+        tried = set()
+        while True:
+            deployment = self._route(model, tried)
+            params = {"model": model, **kwargs}
+            if deployment is not None:
+                params.update(deployment.completion_params())
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(
+                    deployment.name if deployment is not None else model, tokens
+                )
+            start = time.monotonic()
+            try:
+                res = self._completion(
+                    messages=messages, response_format=response_format, **params
+                )
+                break
+            except Exception as e:
+                self._failed(model, e, deployment)
+                if not self._can_fail_over(model, deployment, tried, e):
+                    self._raise(e)
+                logger.info(f"Failing over {model} from {deployment.name}: {e}")
+
+        self._record(model, deployment, tokens, res, time.monotonic() - start)
+        if key is not None:
+            self.cache.set(key, res)
+        return res
+
+    async def agenerate(
+        self,
+        model: str,
+        messages: List[str],
+        response_format: Optional[BaseModel] = None,
+        **kwargs,
+    ):
+        """Async counterpart of `generate` backed by `litellm.acompletion`"""
+        key = None
+        if self.cache is not None:
+            key = cache_key(model, messages, response_format, **kwargs)
+            cached = self._cached(model, key)
+            if cached is not None:
+                return cached
+
+        tokens = _estimate_tokens(messages, **kwargs)
+        tried = set()
+        while True:
+            deployment = self._route(model, tried)
+            params = {"model": model, **kwargs}
+            if deployment is not None:
+                params.update(deployment.completion_params())
+            if self.rate_limiter is not None:
+                await self.rate_limiter.aacquire(
+                    deployment.name if deployment is not None else model, tokens
+                )
+            start = time.monotonic()
+            try:
+                res = await self._acompletion(
+                    messages=messages, response_format=response_format, **params
+                )
+                break
+            except Exception as e:
+                self._failed(model, e, deployment)
+                if not self._can_fail_over(model, deployment, tried, e):
+                    self._raise(e)
+                logger.info(f"Failing over {model} from {deployment.name}: {e}")
+
+        self._record(model, deployment, tokens, res, time.monotonic() - start)
+        if key is not None:
+            self.cache.set(key, res)
+        return res
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+from hn_core.provider.litellm import LLM, RateLimiter, _estimate_tokens
+from litellm import ModelResponse, RateLimitError
+
+ROLES = [
+    "Software Engineer",
+    "Research Scientist",
+    "Business Analyst",
+    "Product Designer",
+    "Technology Analyst",
+]
+
+# default of `MockLLM(rate_limiter=...)`, a new limiter per client
+_OWN_RATE_LIMITER = object()
+
+_user_id_re = re.compile(r'<user id="([^"]*)">')
+_post_index_re = re.compile(r"<post_(\d+)>")
+
+
+def _format_name(response_format) -> Optional[str]:
+    """Name of a pydantic response format or of its OpenAI json schema param"""
+    if response_format is None:
+        return None
+    if isinstance(response_format, dict):
+        return response_format.get("json_schema", {}).get("name")
+    return getattr(response_format, "__name__", None)
+
+
+def _system_text(messages: List[Dict]) -> str:
+    content = messages[0].get("content", "") if messages else ""
+    if isinstance(content, list):
+        # cache_control blocks
+        return "".join(block.get("text", "") for block in content)
+    return str(content)
+
+
+class MockLLM(LLM):
+    """Local stand-in for the provider, answering every request with a canned response.
+
+    Requests go through the same rate limiting, caching and metrics as `LLM`, only the
+    provider call is replaced. Responses are valid for the response formats of the
+    simulation (`ActionModel`, `PackedActionsModel`, `DecisionModel`, `CommentModel`,
+    `ClassifyModel` and `ClassifyBatchModel`) and report token usage estimated from the prompt, so the
+    simulator can be benchmarked and tested without API calls.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        latency_sigma: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 0.1,
+        upvote_rate: float = 0.5,
+        comment_rate: float = 0.2,
+        categories: Optional[Dict[str, bool]] = None,
+        seed: Optional[int] = None,
+        rate_limiter: Optional[RateLimiter] = _OWN_RATE_LIMITER,
+        **kwargs,
+    ):
+        """
+        Args:
+            latency (float): Median latency of a request in seconds
+            latency_sigma (float): Spread of the log-normal latency distribution,
+                                   0 for a constant latency
+            error_rate (float): Probability that a request fails with an error
+            rate_limit_rate (float): Probability that a request fails with a
+                                     `RateLimitError`
+            retry_after (float): `Retry-After` seconds sent with rate limit errors
+            upvote_rate (float): Probability that an agent upvotes
+            comment_rate (float): Probability that an agent comments
+            categories (dict): Post classification answer. Defaults to no category.
+            seed (int): Seed of the latency, failure and action sampling
+            rate_limiter (RateLimiter): See `LLM`. Defaults to a limiter of this client
+                                        only, so injected rate limits pause requests
+                                        for their `retry_after` without touching the
+                                        budgets of real models. `None` disables
+                                        pacing.
+            kwargs: Passed on to `LLM`, e.g. `cache`
+        """
+        if rate_limiter is _OWN_RATE_LIMITER:
+            # injected rate limits are random, there is no limit to learn
+            rate_limiter = RateLimiter(infer_limits=False)
+        super().__init__(rate_limiter=rate_limiter, **kwargs)
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.upvote_rate = upvote_rate
+        self.comment_rate = comment_rate
+        self.categories = categories or {
+            "gag": False,
+            "politics": False,
+            "dei": False,
+            "tutorial": False,
+        }
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _sample(self) -> Dict:
+        """Latency and outcome of one request"""
+        with self._lock:
+            self.calls += 1
+            latency = self.latency
+            if latency and self.latency_sigma:
+                latency *= self._rng.lognormvariate(0, self.latency_sigma)
+            outcome = self._rng.random()
+            return {
+                "latency": latency,
+                "rate_limited": outcome < self.rate_limit_rate,
+                "error": outcome >= 1 - self.error_rate,
+                "rng": random.Random(self._rng.getrandbits(64)),
+            }
+
+    def _action(self, rng: random.Random) -> Dict:
+        comment = rng.random() < self.comment_rate
+        return {
+            "thoughts": "Mock response",
+            "upvote": rng.random() < self.upvote_rate,
+            "comment": "Mock comment" if comment else "",
+            "role": rng.choice(ROLES),
+        }
+
+    def _content(self, messages: List[Dict], response_format, rng) -> Dict:
+        name = _format_name(response_format)
+        if name == "ActionModel":
+            return self._action(rng)
+        if name == "PackedActionsModel":
+            users = _user_id_re.findall(_system_text(messages))
+            return {
+                "actions": [{"agent_id": user, **self._action(rng)} for user in users]
+            }
+        if name == "DecisionModel":
+            action = self._action(rng)
+            return {
+                "upvote": action["upvote"],
+                "will_comment": bool(action["comment"]),
+                "role": action["role"],
+            }
+        if name == "CommentModel":
+            return {"thoughts": "Mock response", "comment": "Mock comment"}
+        if name == "ClassifyModel":
+            return dict(self.categories)
+        if name == "ClassifyBatchModel":
+            indices = sorted(set(_post_index_re.findall(_system_text(messages))))
+            return {
+                "posts": [{"index": int(index), **self.categories} for index in indices]
+            }
+        raise ValueError(f"MockLLM has no canned response for {name}")
+
+    def _response(self, sample: Dict, model: str, messages: List[Dict], **kwargs):
+        if sample["rate_limited"]:
+            error = RateLimitError("Mock rate limit", llm_provider="mock", model=model)
+            error.litellm_response_headers = {"retry-after": str(self.retry_after)}
+            raise error
+        if sample["error"]:
+            raise RuntimeError("Mock provider error")
+
+        content = json.dumps(
+            self._content(messages, kwargs.get("response_format"), sample["rng"])
+        )
+        prompt_tokens = _estimate_tokens(messages)
+        completion_tokens = len(content) // 4
+        return ModelResponse(
+            model=model,
+            choices=[{"message": {"role": "assistant", "content": content}}],
+            usage={
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        )
+
+    def _cost(self, res) -> float:
+        return 0.0
+
+    def _completion(self, model: str, messages: List[Dict], **kwargs):
+        sample = self._sample()
+        if sample["latency"]:
+            time.sleep(sample["latency"])
+        return self._response(sample, model, messages, **kwargs)
+
+    async def _acompletion(self, model: str, messages: List[Dict], **kwargs):
+        sample = self._sample()
+        if sample["latency"]:
+            await asyncio.sleep(sample["latency"])
+        return self._response(sample, model, messages, **kwargs)
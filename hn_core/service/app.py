@@ -0,0 +1,396 @@
+import json
+import os
+import re
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
+
+from hn_core.provider.litellm import LLM, get_llm
+from hn_core.simulation.environment import STEP_MODES
+from hn_core.simulation.jobs import JobManager, JobQueueFull, SimulationJob
+from hn_core.simulation.run import load_prompts, run
+from hn_core.utils import metrics
+from hn_core.utils.archive import Archive
+from hn_core.utils.logger import get_logger
+
+logger = get_logger("hn_service")
+
+# parameters of `run.run` clients may set, with their types
+JOB_PARAMS = {
+    "title": str,
+    "url": str,
+    "text": str,
+    "model": str,
+    "num_agents": int,
+    "total_time_steps": int,
+    "batch_size": int,
+    "k": (int, float),
+    "engine": str,
+    "concurrency": int,
+    "max_workers": int,
+    "classifier": str,
+    "seed": int,
+    "pack_size": int,
+    "step_mode": str,
+    "decision_model": str,
+}
+# parameters that may be null, `run.run` then applies its own default
+NULLABLE_PARAMS = {
+    "url",
+    "text",
+    "num_agents",
+    "batch_size",
+    "max_workers",
+    "concurrency",
+    "seed",
+    "pack_size",
+    "decision_model",
+}
+POSITIVE_PARAMS = {
+    "num_agents",
+    "total_time_steps",
+    "batch_size",
+    "k",
+    "concurrency",
+    "max_workers",
+    "pack_size",
+}
+PARAM_CHOICES = {
+    "engine": ("thread", "async"),
+    "step_mode": STEP_MODES,
+    "classifier": ("llm", "keyword"),
+}
+
+_job_path_re = re.compile(r"^/jobs/([0-9a-f]+)(/result)?$")
+
+
+class BadRequest(Exception):
+    pass
+
+
+class SimulationService:
+    """ASGI service running simulations as background jobs.
+
+    Endpoints:
+        POST   /jobs              submit a simulation, the body holds `run.run` params
+        GET    /jobs              list jobs
+        GET    /jobs/{id}         status and per step progress of a job
+        GET    /jobs/{id}/result  agent profile and final post state of a done job
+        DELETE /jobs/{id}         cancel a queued or running job
+        GET    /metrics           metrics registry in the Prometheus text format
+        GET    /health
+
+    Persona prompts and the provider client are created once per process and shared
+    by every job, so only the first job for a given number of agents pays for
+    loading the archive.
+    """
+
+    def __init__(
+        self,
+        archive_path: Optional[str] = None,
+        prompt_store_path: Optional[str] = None,
+        llm: Optional[LLM] = None,
+        max_jobs: int = 2,
+        max_queued: int = 16,
+        max_job_workers: int = 10,
+        max_job_concurrency: int = 50,
+        max_job_agent_steps: int = 50_000,
+    ):
+        """
+        Args:
+            archive_path (str): SQLite archive personas are read from, see `run.run`
+            prompt_store_path (str): Prompt store shared by all jobs, see `run.run`
+            llm (LLM): Provider client shared by all jobs, e.g. a `MockLLM` for local
+                       testing. Defaults to the process-wide client.
+            max_jobs (int): Number of simulations run concurrently
+            max_queued (int): Number of jobs waiting for a worker before submissions
+                              are rejected with 429
+            max_job_workers (int): Upper bound of `max_workers` of a single job
+            max_job_concurrency (int): Upper bound of `concurrency` of a single job
+            max_job_agent_steps (int): Upper bound of `num_agents` * `total_time_steps`
+                                       of a single job, which bounds the number of
+                                       provider calls a submission can make
+        """
+        self.archive_path = archive_path
+        self.prompt_store_path = prompt_store_path
+        self.llm = llm or get_llm()
+        self.max_job_workers = max_job_workers
+        self.max_job_concurrency = max_job_concurrency
+        self.max_job_agent_steps = max_job_agent_steps
+        self.jobs = JobManager(
+            max_workers=max_jobs, runner=self._run_job, max_queued=max_queued
+        )
+        self._prompts: Optional[Dict[str, str]] = None
+        self._all_prompts = False
+        self._prompts_lock = threading.Lock()
+
+    def prompts(self, num_agents: Optional[int]) -> Dict[str, str]:
+        """Prompts of the first `num_agents` personas, loaded at most once per size.
+
+        Personas are loaded in archive order, so the largest set loaded so far serves
+        every smaller request.
+        """
+        with self._prompts_lock:
+            cached = self._prompts
+            if cached is None or not (
+                self._all_prompts
+                or (num_agents is not None and num_agents <= len(cached))
+            ):
+                cached = self._prompts = load_prompts(
+                    num_agents=num_agents,
+                    archive_path=self.archive_path,
+                    prompt_store_path=self.prompt_store_path,
+                )
+                self._all_prompts = num_agents is None
+        if num_agents is None or num_agents >= len(cached):
+            return cached
+        user_ids = list(cached)[:num_agents]
+        return {user_id: cached[user_id] for user_id in user_ids}
+
+    def num_personas(self) -> int:
+        """Number of personas a job without `num_agents` simulates"""
+        with self._prompts_lock:
+            if self._all_prompts:
+                return len(self._prompts)
+        if self.archive_path:
+            archive = Archive(self.archive_path)
+            try:
+                return len(archive.users)
+            finally:
+                archive.close()
+        return len(self.prompts(None))
+
+    def _run_job(self, on_step, cancel, **params):
+        return run(
+            **params,
+            archive_path=self.archive_path,
+            prompt_store_path=self.prompt_store_path,
+            prompts=self.prompts(params.get("num_agents")),
+            llm=self.llm,
+            on_step=on_step,
+            cancel=cancel,
+        )
+
+    def _job_params(self, body: Dict) -> Dict:
+        """Validate the body of a submission and apply the per job limits"""
+        if not isinstance(body, dict):
+            raise BadRequest("Expected a JSON object")
+        unknown = set(body) - set(JOB_PARAMS)
+        if unknown:
+            raise BadRequest(f"Unknown parameters: {sorted(unknown)}")
+        for name, value in body.items():
+            if value is None:
+                if name not in NULLABLE_PARAMS:
+                    raise BadRequest(f"{name} must not be null")
+                continue
+            # bool is an int, but never a valid value
+            if not isinstance(value, JOB_PARAMS[name]) or isinstance(value, bool):
+                raise BadRequest(f"Invalid value for {name}: {value!r}")
+            if name in POSITIVE_PARAMS and value <= 0:
+                raise BadRequest(f"{name} must be positive")
+            if name in PARAM_CHOICES and value not in PARAM_CHOICES[name]:
+                raise BadRequest(f"{name} must be one of {list(PARAM_CHOICES[name])}")
+        if not body.get("title"):
+            raise BadRequest("title is required")
+        if body.get("seed") is not None and body["seed"] < 0:
+            raise BadRequest("seed must not be negative")
+
+        params = {
+            "url": None,
+            "text": None,
+            "model": "gpt-4o-mini",
+            "total_time_steps": 10,
+            **body,
+        }
+        num_agents = params.get("num_agents") or self.num_personas()
+        if num_agents * params["total_time_steps"] > self.max_job_agent_steps:
+            raise BadRequest(
+                f"num_agents * total_time_steps must not exceed "
+                f"{self.max_job_agent_steps}"
+            )
+        params["max_workers"] = min(
+            params.get("max_workers") or self.max_job_workers, self.max_job_workers
+        )
+        params["concurrency"] = min(
+            params.get("concurrency") or self.max_job_concurrency,
+            self.max_job_concurrency,
+        )
+        return params
+
+    def _job_result(self, job: SimulationJob) -> Tuple[int, Dict]:
+        if job.status == "done":
+            agent_profile, post = job.result
+            return 200, {"id": job.id, "agent_profile": agent_profile, "post": post}
+        if job.status == "failed":
+            return 500, {"id": job.id, "error": job.error}
+        return 409, {"id": job.id, "error": f"Job is {job.status}"}
+
+    def handle(self, method: str, path: str, body: bytes) -> Tuple[int, object]:
+        """Route one request, returns the status and a JSON payload (or text)"""
+        if path == "/health" and method == "GET":
+            return 200, {"status": "ok"}
+        if path == "/metrics" and method == "GET":
+            return 200, metrics.registry.to_prometheus()
+
+        if path == "/jobs":
+            if method == "GET":
+                return 200, {
+                    "jobs": [
+                        {"id": job.id, "status": job.status} for job in self.jobs.jobs()
+                    ]
+                }
+            if method == "POST":
+                try:
+                    params = self._job_params(json.loads(body or b"null"))
+                except (ValueError, BadRequest) as e:
+                    return 400, {"error": str(e)}
+                try:
+                    job = self.jobs.submit(**params)
+                except JobQueueFull as e:
+                    return 429, {"error": str(e)}
+                return 202, {"id": job.id, "status": job.status}
+            return 405, {"error": "Method not allowed"}
+
+        match = _job_path_re.match(path)
+        if match is None:
+            return 404, {"error": "Not found"}
+        job = self.jobs.get(match.group(1))
+        if job is None:
+            return 404, {"error": "Unknown job"}
+
+        if match.group(2):
+            if method != "GET":
+                return 405, {"error": "Method not allowed"}
+            return self._job_result(job)
+        if method == "GET":
+            return 200, {**job.to_dict(), "params": job.params}
+        if method == "DELETE":
+            job = self.jobs.cancel(job.id)
+            return 202, {"id": job.id, "status": job.status}
+        return 405, {"error": "Method not allowed"}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        status, payload = self.handle(scope["method"], scope["path"], body)
+        if isinstance(payload, str):
+            content_type = b"text/plain; version=0.0.4"
+            content = payload.encode("utf-8")
+        else:
+            content_type = b"application/json"
+            content = json.dumps(payload, default=str).encode("utf-8")
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", content_type),
+                    (b"content-length", str(len(content)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": content})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def close(self):
+        """Cancel every unfinished job and stop the workers"""
+        for job in self.jobs.jobs():
+            self.jobs.cancel(job.id)
+        self.jobs.shutdown(wait=False)
+
+
+def create_app(
+    mock: bool = False,
+    archive_path: Optional[str] = None,
+    synthetic_users: int = 1000,
+    mock_latency: float = 0.05,
+    **kwargs,
+) -> SimulationService:
+    """Build the service, see `SimulationService`.
+
+    Args:
+        mock (bool): Answer every request with a local `MockLLM`. Without an
+                     `archive_path` personas come from a synthetic archive, so the
+                     service runs without data or API keys.
+        synthetic_users (int): Number of users of the synthetic archive
+        mock_latency (float): Median latency of the mock provider in seconds
+        kwargs: Passed on to `SimulationService`
+    """
+    if mock:
+        from hn_core.provider.mock import MockLLM
+        from hn_core.simulation.benchmark import synthetic_archive
+
+        kwargs.setdefault("llm", MockLLM(latency=mock_latency, latency_sigma=0.5))
+        if archive_path is None:
+            archive_path = synthetic_archive(
+                os.path.join(tempfile.mkdtemp(prefix="hn_service_"), "archive.db"),
+                synthetic_users,
+            )
+    return SimulationService(archive_path=archive_path, **kwargs)
+
+
+def app_from_env() -> SimulationService:
+    """Service configured from `HN_*` environment variables, for `uvicorn --factory`"""
+    return create_app(
+        mock=os.getenv("HN_MOCK_LLM", "") not in ("", "0", "false"),
+        archive_path=os.getenv("HN_ARCHIVE_PATH") or None,
+        prompt_store_path=os.getenv("HN_PROMPT_STORE_PATH") or None,
+        max_jobs=int(os.getenv("HN_MAX_JOBS", "2")),
+        max_queued=int(os.getenv("HN_MAX_QUEUED", "16")),
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the simulation HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--archive", help="SQLite archive personas are read from")
+    parser.add_argument("--prompt-store", help="Persistent persona prompt store")
+    parser.add_argument("--max-jobs", type=int, default=2)
+    parser.add_argument("--max-queued", type=int, default=16)
+    parser.add_argument("--max-job-workers", type=int, default=10)
+    parser.add_argument("--max-job-concurrency", type=int, default=50)
+    parser.add_argument("--max-job-agent-steps", type=int, default=50_000)
+    parser.add_argument("--mock", action="store_true", help="Use the mock provider")
+    parser.add_argument("--synthetic-users", type=int, default=1000)
+    parser.add_argument("--mock-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    service = create_app(
+        mock=args.mock,
+        archive_path=args.archive,
+        synthetic_users=args.synthetic_users,
+        mock_latency=args.mock_latency,
+        prompt_store_path=args.prompt_store,
+        max_jobs=args.max_jobs,
+        max_queued=args.max_queued,
+        max_job_workers=args.max_job_workers,
+        max_job_concurrency=args.max_job_concurrency,
+        max_job_agent_steps=args.max_job_agent_steps,
+    )
+    uvicorn.run(service, host=args.host, port=args.port)
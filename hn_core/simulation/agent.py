@@ -1,13 +1,22 @@
+import asyncio
 import json
 import time
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional
 
 from hn_core.prompts import prompt
-from hn_core.provider.litellm import LLM
+from hn_core.provider.litellm import (
+    LLM,
+    get_llm,
+    get_usage,
+    needs_cache_control,
+    retry_after,
+)
+from hn_core.utils import metrics
 from hn_core.utils.logger import get_logger
-from litellm import RateLimitError
+from litellm import ModelResponse, RateLimitError
+from litellm.utils import type_to_response_format_param
 
-from .model import ActionModel
+from .model import ActionModel, CommentModel, DecisionModel
 from .post import Post
 
 logger = get_logger("hn_agent")
@@ -22,6 +31,9 @@ class Agent:
         agent_prompt: str,
         activation_probability: float,
         model_params: Optional[Dict] = None,
+        llm: Optional[LLM] = None,
+        decision_model: Optional[str] = None,
+        decision_model_params: Optional[Dict] = None,
     ):
         """Initialize an Agent instance
 
@@ -30,18 +42,51 @@ class Agent:
             activation_probability (float): The probability that the agent will be active (0-1)
             model (str): The model to use for generating agent responses
             model_params (Dict): Additional parameters for the model
+            llm (LLM): Provider client to use, e.g. one shared with a response cache.
+                       Defaults to the process-wide client.
+            decision_model (str): Enables the two tier cascade. This (small, fast)
+                                  model decides on the upvote, whether to comment and
+                                  the role, `model` is only called to write the
+                                  comment. Packed requests and the batch engine always
+                                  use a single call to `model`.
+            decision_model_params (Dict): Additional parameters for `decision_model`.
+                                          Defaults to `model_params`.
         """
         self.id = id
         self.agent_prompt = agent_prompt
         self.activation_probability = activation_probability
         self.model = model
-        self.model_params = model_params
+        self.model_params = model_params or {}
+        self.decision_model = decision_model
+        self.decision_model_params = (
+            decision_model_params
+            if decision_model_params is not None
+            else self.model_params
+        )
         self.is_active = True
-        self.llm = LLM()
+        self.llm = llm or get_llm()
+        self.max_retries = 3
+        self.max_ratelimit_retries = 10
+        # token usage of the calls made by the last run, summed over retries
+        self.last_usage = get_usage(None)
+        # error of the last request that exhausted its retries
+        self.last_error: Optional[Exception] = None
 
-    def _get_agent_response(self, post: Post) -> Dict:
-        """Generate agent response based on persona and post content"""
+    def _build_messages(
+        self,
+        post: Post,
+        instructions: Optional[str] = None,
+        model: Optional[str] = None,
+    ) -> List[Dict]:
+        """Build the messages of a request.
 
+        The persona is sent as a static system prefix followed by the variable post
+        block, so provider-side prompt caching can reuse the prefix across calls.
+        `instructions` of the cascade tiers are appended to the post block, which
+        keeps the prefix shared by both tiers. `model` is the model the request is
+        sent to, it decides on the format of the prefix and defaults to `model` of
+        the agent.
+        """
         post_data = {
             "post_title": post.title,
             "post_url": post.url,
@@ -54,44 +99,70 @@ class Agent:
             ),
         }
 
-        last_error = None
-        max_retries = 3
-        attempt = 0
-        ratelimit_attempt = 0
-        while attempt < max_retries:
-            try:
-                res = self.llm.generate(
-                    model=self.model,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": self.agent_prompt.format(
-                                **post_data,
-                            ),
-                        }
-                    ],
-                    response_format=ActionModel,
-                    **self.model_params,
-                )
-                action = json.loads(res.choices[0].message.content)
-                return {
-                    "upvote": action["upvote"],
-                    "comment": action["comment"],
-                    "role": action["role"],
+        if needs_cache_control(model or self.model):
+            system = [
+                {
+                    "type": "text",
+                    "text": self.agent_prompt,
+                    "cache_control": {"type": "ephemeral"},
                 }
-            except RateLimitError as e:
-                backoff = min(2**ratelimit_attempt + 40, 60)  # Cap at 60 seconds
-                logger.warning(
-                    f"Rate limit error encountered, retrying after {backoff}s"
-                )
-                time.sleep(backoff)
-                ratelimit_attempt += 1
-                continue
-            except Exception as e:
-                logger.error(f"Unexpected error on attempt {attempt + 1}: {str(e)}")
-                last_error = e
-                attempt += 1
+            ]
+        else:
+            system = self.agent_prompt
+
+        content = prompt.post_prompt.format(**post_data)
+        if instructions:
+            content += instructions
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": content},
+        ]
+
+    def _record_usage(self, res):
+        for key, value in get_usage(res).items():
+            self.last_usage[key] += value
+
+    def _parse_response(self, res) -> Dict:
+        action = json.loads(res.choices[0].message.content)
+        return {
+            "upvote": action["upvote"],
+            "comment": action["comment"],
+            "role": action["role"],
+        }
+
+    def _parse_decision(self, res) -> Dict:
+        decision = json.loads(res.choices[0].message.content)
+        return {
+            "upvote": decision["upvote"],
+            "will_comment": decision["will_comment"],
+            "role": decision["role"],
+        }
+
+    def _parse_comment(self, res) -> str:
+        return json.loads(res.choices[0].message.content)["comment"]
+
+    def _ratelimit_backoff(self, ratelimit_attempt: int, error: Exception) -> float:
+        """Seconds to wait before retrying a rate limited request.
+
+        The shared rate limiter of the client has already paused the model, so the
+        retry waits for it instead of sleeping on its own. Without a limiter the
+        agent waits for `Retry-After`, or backs off exponentially.
+        """
+        if self.llm.rate_limiter is not None:
+            logger.warning(
+                f"Rate limit error encountered, retry {ratelimit_attempt} is paced by the rate limiter"
+            )
+            return 0.0
+        backoff = retry_after(error)
+        if backoff is None:
+            backoff = min(2**ratelimit_attempt + 40, 60)  # Cap at 60 seconds
+        logger.warning(f"Rate limit error encountered, retrying after {backoff}s")
+        return backoff
 
+    def _no_action(
+        self, last_error: Optional[Exception], model: Optional[str] = None
+    ) -> Dict:
+        metrics.agent_failures.inc(model=model or self.model)
         logger.error(
             f"All retry attempts failed. Defaulting to no action. Last error: {str(last_error)}"
         )
@@ -101,6 +172,251 @@ class Agent:
             "role": None,
         }
 
+    def _record_tier(self, tier: str, model: str, start: float, res):
+        metrics.cascade_requests.inc(model=model, tier=tier)
+        metrics.cascade_latency.observe(time.monotonic() - start, tier=tier)
+        if res is None:
+            return
+        usage = get_usage(res)
+        for kind in ("input", "cached_input", "output"):
+            if usage[f"{kind}_tokens"]:
+                metrics.cascade_tokens.inc(
+                    usage[f"{kind}_tokens"], tier=tier, kind=kind
+                )
+
+    def _request(
+        self,
+        messages: List[Dict],
+        response_format,
+        parse: Callable,
+        model: str,
+        model_params: Dict,
+        tier: Optional[str] = None,
+    ):
+        """Generate and parse one response, retrying failed requests.
+
+        Returns None once `max_retries` errors occurred, the last one is kept in
+        `last_error`. Rate limit errors are retried without counting as attempts, up
+        to `max_ratelimit_retries` times.
+        """
+        start = time.monotonic()
+        res = None
+        last_error = None
+        attempt = 0
+        ratelimit_attempt = 0
+        try:
+            while attempt < self.max_retries:
+                try:
+                    res = self.llm.generate(
+                        model=model,
+                        messages=messages,
+                        response_format=response_format,
+                        **model_params,
+                    )
+                    self._record_usage(res)
+                    return parse(res)
+                except RateLimitError as e:
+                    ratelimit_attempt += 1
+                    if ratelimit_attempt > self.max_ratelimit_retries:
+                        last_error = e
+                        break
+                    metrics.agent_retries.inc(model=model, reason="rate_limited")
+                    backoff = self._ratelimit_backoff(ratelimit_attempt, e)
+                    if backoff:
+                        time.sleep(backoff)
+                    continue
+                except Exception as e:
+                    logger.error(f"Unexpected error on attempt {attempt + 1}: {str(e)}")
+                    last_error = e
+                    attempt += 1
+                    if attempt < self.max_retries:
+                        metrics.agent_retries.inc(model=model, reason="error")
+        finally:
+            if tier is not None:
+                self._record_tier(tier, model, start, res)
+
+        self.last_error = last_error
+        return None
+
+    async def _arequest(
+        self,
+        messages: List[Dict],
+        response_format,
+        parse: Callable,
+        model: str,
+        model_params: Dict,
+        tier: Optional[str] = None,
+    ):
+        """Async counterpart of `_request`.
+
+        Retry behaviour is identical, rate limit waits happen on the event loop
+        instead of blocking a thread.
+        """
+        start = time.monotonic()
+        res = None
+        last_error = None
+        attempt = 0
+        ratelimit_attempt = 0
+        try:
+            while attempt < self.max_retries:
+                try:
+                    res = await self.llm.agenerate(
+                        model=model,
+                        messages=messages,
+                        response_format=response_format,
+                        **model_params,
+                    )
+                    self._record_usage(res)
+                    return parse(res)
+                except RateLimitError as e:
+                    ratelimit_attempt += 1
+                    if ratelimit_attempt > self.max_ratelimit_retries:
+                        last_error = e
+                        break
+                    metrics.agent_retries.inc(model=model, reason="rate_limited")
+                    backoff = self._ratelimit_backoff(ratelimit_attempt, e)
+                    if backoff:
+                        await asyncio.sleep(backoff)
+                    continue
+                except Exception as e:
+                    logger.error(f"Unexpected error on attempt {attempt + 1}: {str(e)}")
+                    last_error = e
+                    attempt += 1
+                    if attempt < self.max_retries:
+                        metrics.agent_retries.inc(model=model, reason="error")
+        finally:
+            if tier is not None:
+                self._record_tier(tier, model, start, res)
+
+        self.last_error = last_error
+        return None
+
+    def _cascade_action(self, decision: Dict, comment: Optional[str]) -> Dict:
+        if decision["will_comment"] and comment is None:
+            # the decision stands, only the comment is lost
+            metrics.agent_failures.inc(model=self.model)
+            logger.error(
+                f"Comment generation failed, keeping the decision. Last error: {str(self.last_error)}"
+            )
+        return {
+            "upvote": decision["upvote"],
+            "comment": comment or "",
+            "role": decision["role"],
+        }
+
+    def _get_agent_response(self, post: Post) -> Dict:
+        """Generate agent response based on persona and post content"""
+        self.last_usage = get_usage(None)
+        if self.decision_model is not None:
+            return self._get_cascade_response(post)
+
+        action = self._request(
+            self._build_messages(post),
+            ActionModel,
+            self._parse_response,
+            self.model,
+            self.model_params,
+        )
+        if action is None:
+            return self._no_action(self.last_error)
+        return action
+
+    def _get_cascade_response(self, post: Post) -> Dict:
+        """Decide with `decision_model`, write the comment with `model` if needed"""
+        decision = self._request(
+            self._build_messages(
+                post, prompt.decision_prompt, model=self.decision_model
+            ),
+            DecisionModel,
+            self._parse_decision,
+            self.decision_model,
+            self.decision_model_params,
+            tier="decision",
+        )
+        if decision is None:
+            return self._no_action(self.last_error, self.decision_model)
+
+        comment = None
+        if decision["will_comment"]:
+            comment = self._request(
+                self._build_messages(post, prompt.comment_prompt),
+                CommentModel,
+                self._parse_comment,
+                self.model,
+                self.model_params,
+                tier="comment",
+            )
+        return self._cascade_action(decision, comment)
+
+    async def _aget_agent_response(self, post: Post) -> Dict:
+        """Async counterpart of `_get_agent_response`"""
+        self.last_usage = get_usage(None)
+        if self.decision_model is not None:
+            return await self._aget_cascade_response(post)
+
+        action = await self._arequest(
+            self._build_messages(post),
+            ActionModel,
+            self._parse_response,
+            self.model,
+            self.model_params,
+        )
+        if action is None:
+            return self._no_action(self.last_error)
+        return action
+
+    async def _aget_cascade_response(self, post: Post) -> Dict:
+        """Async counterpart of `_get_cascade_response`"""
+        decision = await self._arequest(
+            self._build_messages(
+                post, prompt.decision_prompt, model=self.decision_model
+            ),
+            DecisionModel,
+            self._parse_decision,
+            self.decision_model,
+            self.decision_model_params,
+            tier="decision",
+        )
+        if decision is None:
+            return self._no_action(self.last_error, self.decision_model)
+
+        comment = None
+        if decision["will_comment"]:
+            comment = await self._arequest(
+                self._build_messages(post, prompt.comment_prompt),
+                CommentModel,
+                self._parse_comment,
+                self.model,
+                self.model_params,
+                tier="comment",
+            )
+        return self._cascade_action(decision, comment)
+
+    def batch_request(self, post: Post, custom_id: str) -> Dict:
+        """Request for the current post in the OpenAI Batch JSONL format"""
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model,
+                "messages": self._build_messages(post),
+                "response_format": type_to_response_format_param(ActionModel),
+                **self.model_params,
+            },
+        }
+
+    def parse_batch_response(self, body: Dict) -> Dict:
+        """Parse the response body of a batch request into an action"""
+        res = ModelResponse(**body)
+        self.last_usage = get_usage(None)
+        self._record_usage(res)
+        return self._parse_response(res)
+
     def run(self, post: Post) -> Dict:
         """Main execution method for the agent"""
         return self._get_agent_response(post)
+
+    async def arun(self, post: Post) -> Dict:
+        """Async execution method for the agent"""
+        return await self._aget_agent_response(post)
@@ -0,0 +1,346 @@
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Sequence
+
+from hn_core.provider.batch import LocalBatchBackend
+from hn_core.provider.mock import MockLLM
+from hn_core.utils import metrics
+from hn_core.utils.archive import convert_archive
+from hn_core.utils.logger import get_logger
+
+from . import run as simulation
+from .classifier import LLMClassifier
+from .environment import Environment
+from .post import Post
+
+logger = get_logger("hn_benchmark")
+
+ENTRIES = ("environment", "run")
+ENGINES = ("thread", "async", "batch")
+
+TITLE = "Show HN: A benchmark for agent based social media simulations"
+URL = "https://example.com/benchmark"
+
+
+def synthetic_archive(
+    path: str, num_users: int, comments_per_user: int = 5, seed: int = 0
+) -> str:
+    """Write a SQLite archive of `num_users` generated users.
+
+    Every user submitted one story and `comments_per_user` comments on the stories
+    of other users, so persona prompts have the size and shape of real ones.
+
+    Returns:
+        str: `path`
+    """
+    rng = random.Random(seed)
+    users_path = path + ".users.jsonl"
+    items_path = path + ".items.jsonl"
+    story_ids = [1 + i * (comments_per_user + 1) for i in range(num_users)]
+
+    with (
+        open(users_path, "w", encoding="utf-8") as users,
+        open(items_path, "w", encoding="utf-8") as items,
+    ):
+        for i, story_id in enumerate(story_ids):
+            user = f"user{i}"
+            submitted = [story_id]
+            items.write(
+                json.dumps(
+                    {
+                        "id": story_id,
+                        "type": "story",
+                        "by": user,
+                        "title": f"Story {story_id} about topic {rng.randrange(100)}",
+                        "url": f"https://example.com/{story_id}",
+                        "time": 1738454550 + story_id,
+                    }
+                )
+                + "\n"
+            )
+            for j in range(comments_per_user):
+                comment_id = story_id + 1 + j
+                submitted.append(comment_id)
+                items.write(
+                    json.dumps(
+                        {
+                            "id": comment_id,
+                            "type": "comment",
+                            "by": user,
+                            "parent": rng.choice(story_ids),
+                            "text": " ".join(
+                                f"word{rng.randrange(1000)}" for _ in range(40)
+                            ),
+                            "time": 1738454550 + comment_id,
+                        }
+                    )
+                    + "\n"
+                )
+            users.write(
+                json.dumps(
+                    {
+                        "id": user,
+                        "karma": rng.randrange(10000),
+                        "about": f"<p>About {user}</p>",
+                        "submitted": submitted,
+                    }
+                )
+                + "\n"
+            )
+
+    convert_archive(users_path, items_path, path)
+    os.remove(users_path)
+    os.remove(items_path)
+    return path
+
+
+def _measure(fn, trace_memory: bool) -> Dict:
+    """Wall time and peak traced memory of `fn()`"""
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        fn()
+    finally:
+        wall_time = time.perf_counter() - start
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] / (1 << 20)
+            tracemalloc.stop()
+    return {"wall_time": wall_time, "peak_memory_mb": peak}
+
+
+def _engine_kwargs(engine: str, max_workers: Optional[int], llm: MockLLM) -> Dict:
+    if engine == "thread":
+        return {"engine": engine, "max_workers": max_workers}
+    if engine == "async":
+        return {"engine": engine, "concurrency": max_workers}
+    return {"engine": engine, "batch_backend": LocalBatchBackend(llm=llm)}
+
+
+def benchmark_case(
+    entry: str,
+    prompts: Dict[str, str],
+    archive_path: str,
+    engine: str = "thread",
+    batch_size: int = 10,
+    max_workers: Optional[int] = 10,
+    total_time_steps: int = 5,
+    repeats: int = 1,
+    seed: int = 0,
+    trace_memory: bool = True,
+    **llm_params,
+) -> Dict:
+    """Time one configuration against a `MockLLM`.
+
+    Args:
+        entry (str): "environment" runs `Environment.run` on agents built from
+                     `prompts`, "run" runs `run.run` end to end, persona loading included
+        prompts (dict): Agent prompt per user id, see `run.load_prompts`
+        archive_path (str): Archive the prompts were loaded from
+        engine (str): "thread", "async" or "batch" (through a `LocalBatchBackend`)
+        max_workers (int): Threads of the thread engine, in-flight requests of the
+                           async engine. Unused by the batch engine.
+        repeats (int): Number of runs, the median wall time is reported
+        trace_memory (bool): Report the peak memory traced by `tracemalloc`, which
+                             slows the run down by a roughly constant factor
+        llm_params: `MockLLM` parameters, e.g. `latency` or `error_rate`
+
+    Returns:
+        dict: Configuration, `wall_time`, `calls`, `calls_per_second`, `actions` and
+              `peak_memory_mb`
+    """
+    if entry not in ENTRIES:
+        raise ValueError(f"Unknown benchmark entry: {entry}")
+
+    wall_times, peaks = [], []
+    for _ in range(repeats):
+        llm = MockLLM(seed=seed, **llm_params)
+        kwargs = _engine_kwargs(engine, max_workers, llm)
+
+        if entry == "environment":
+            post = Post(title=TITLE, url=URL, classifier=LLMClassifier(llm=llm))
+            agents = simulation.build_agents(prompts, model="mock", llm=llm)
+            environment = Environment(
+                total_time_steps=total_time_steps,
+                agents=agents,
+                post=post,
+                k=1.0,
+                seed=seed,
+            )
+            fn = lambda: environment.run(batch_size=batch_size, **kwargs)
+        else:
+            fn = lambda: simulation.run(
+                title=TITLE,
+                url=URL,
+                text=None,
+                model="mock",
+                num_agents=len(prompts),
+                total_time_steps=total_time_steps,
+                batch_size=batch_size,
+                archive_path=archive_path,
+                seed=seed,
+                llm=llm,
+                **kwargs,
+            )
+
+        metrics.registry.reset()
+        measured = _measure(fn, trace_memory)
+        wall_times.append(measured["wall_time"])
+        peaks.append(measured["peak_memory_mb"])
+
+    wall_time = statistics.median(wall_times)
+    return {
+        "entry": entry,
+        "engine": engine,
+        "num_agents": len(prompts),
+        "batch_size": batch_size,
+        "max_workers": max_workers if engine != "batch" else None,
+        "total_time_steps": total_time_steps,
+        "wall_time": wall_time,
+        "calls": llm.calls,
+        "calls_per_second": llm.calls / wall_time if wall_time else None,
+        "actions": int(metrics.agent_actions.value()),
+        "peak_memory_mb": max(peaks) if trace_memory else None,
+    }
+
+
+def sweep(
+    num_agents: Sequence[int] = (100, 500),
+    batch_sizes: Sequence[int] = (10, 50),
+    max_workers: Sequence[int] = (10, 50),
+    engines: Sequence[str] = ("thread", "async"),
+    entries: Sequence[str] = ("environment",),
+    total_time_steps: int = 5,
+    repeats: int = 1,
+    seed: int = 0,
+    archive_path: Optional[str] = None,
+    trace_memory: bool = True,
+    **llm_params,
+) -> List[Dict]:
+    """Benchmark every combination of the given parameters, see `benchmark_case`.
+
+    Args:
+        archive_path (str): Archive to read personas from. Defaults to a synthetic
+                            archive with as many users as the largest `num_agents`.
+
+    Returns:
+        list: One result per configuration
+    """
+    for engine in engines:
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+
+    with tempfile.TemporaryDirectory(prefix="hn_benchmark_") as work_dir:
+        if archive_path is None:
+            archive_path = synthetic_archive(
+                os.path.join(work_dir, "archive.db"), max(num_agents), seed=seed
+            )
+
+        results = []
+        for n in num_agents:
+            prompts = simulation.load_prompts(num_agents=n, archive_path=archive_path)
+            for entry, engine, batch_size, workers in itertools.product(
+                entries, engines, batch_sizes, max_workers
+            ):
+                # the batch engine has no worker pool
+                if engine == "batch" and workers != max_workers[0]:
+                    continue
+                result = benchmark_case(
+                    entry,
+                    prompts,
+                    archive_path,
+                    engine=engine,
+                    batch_size=batch_size,
+                    max_workers=workers,
+                    total_time_steps=total_time_steps,
+                    repeats=repeats,
+                    seed=seed,
+                    trace_memory=trace_memory,
+                    **llm_params,
+                )
+                logger.info(f"Benchmark: {result}")
+                results.append(result)
+    return results
+
+
+def format_results(results: List[Dict]) -> str:
+    """Render benchmark results as a plain text table"""
+    columns = [
+        "entry",
+        "engine",
+        "num_agents",
+        "batch_size",
+        "max_workers",
+        "wall_time",
+        "calls",
+        "calls_per_second",
+        "peak_memory_mb",
+    ]
+    rows = [columns] + [
+        [
+            (
+                f"{result[column]:.2f}"
+                if isinstance(result[column], float)
+                else str(result[column])
+            )
+            for column in columns
+        ]
+        for result in results
+    ]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return "\n".join(
+        "  ".join(value.rjust(width) for value, width in zip(row, widths))
+        for row in rows
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark simulation throughput against a local mock LLM"
+    )
+    parser.add_argument("--agents", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--max-workers", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--engines", nargs="+", default=["thread", "async"])
+    parser.add_argument("--entries", nargs="+", default=["environment"])
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--archive", help="Archive to read personas from")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = sweep(
+        num_agents=args.agents,
+        batch_sizes=args.batch_size,
+        max_workers=args.max_workers,
+        engines=args.engines,
+        entries=args.entries,
+        total_time_steps=args.steps,
+        repeats=args.repeats,
+        seed=args.seed,
+        archive_path=args.archive,
+        trace_memory=not args.no_memory,
+        latency=args.latency,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    )
+    print(format_results(results))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
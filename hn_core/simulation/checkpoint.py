@@ -0,0 +1,231 @@
+import json
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from hn_core.utils.logger import get_logger
+
+if TYPE_CHECKING:
+    from .environment import Environment
+
+logger = get_logger("hn_checkpoint")
+
+
+class Checkpoint:
+    """Append-only JSONL checkpoint of an `Environment` run.
+
+    The file starts with a header (agents, post, run parameters), followed by
+    - `step`: the RNG state at the start of a time step
+    - `batch`: the actions, post history records and comments added by one batch,
+      with the resulting upvotes and score, and the agents activated and seconds
+      spent in the time step so far
+    - `step_end`: the RNG state and step metrics at the end of a time step
+
+    Every record only carries what changed since the previous one, so writing a
+    checkpoint costs the same at every step regardless of the length of the run.
+    """
+
+    def __init__(self, path: str, append: bool = False, fsync: bool = True):
+        """
+        Args:
+            path (str): Checkpoint file
+            append (bool): Continue an existing checkpoint instead of starting a new one
+            fsync (bool): Force every record to disk before the run continues
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.fsync = fsync
+        if append:
+            self._drop_incomplete_record(path)
+        self._file = open(path, "a" if append else "w", encoding="utf-8")
+        self._actions = 0
+        self._history = 0
+        self._comments = 0
+
+    @staticmethod
+    def _drop_incomplete_record(path: str, chunk_size: int = 1 << 16):
+        """Truncate a record cut off by a crash, so appended records stay readable"""
+        with open(path, "rb+") as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                start = max(0, pos - chunk_size)
+                f.seek(start)
+                chunk = f.read(pos - start)
+                newline = chunk.rfind(b"\n")
+                if newline != -1:
+                    pos = start + newline + 1
+                    break
+                pos = start
+            if pos < end:
+                f.truncate(pos)
+
+    def _write(self, record: Dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def mark(self, environment: "Environment"):
+        """Only write what is added to `environment` from now on"""
+        self._actions = len(environment.agent_actions)
+        self._history = len(environment.post.history)
+        self._comments = len(environment.post.comments)
+
+    def write_header(self, environment: "Environment", batch_size: Optional[int]):
+        post = environment.post
+        # classify now, so a resumed run doesn't classify again
+        post.penalty
+        self._write(
+            {
+                "type": "header",
+                "agent_ids": [agent.id for agent in environment.agents],
+                "post": {
+                    "title": post.title,
+                    "url": post.url,
+                    "text": post.text,
+                    "categories": post.categories,
+                },
+                "total_time_steps": environment.total_time_steps,
+                "batch_size": batch_size,
+                "k": environment.k,
+                "metadata": environment.checkpoint_metadata,
+            }
+        )
+        self.mark(environment)
+
+    def write_step(self, time_step: int, rng_state: Dict):
+        self._write({"type": "step", "sim_step": time_step, "rng": rng_state})
+
+    def write_batch(
+        self,
+        environment: "Environment",
+        time_step: int,
+        batch: int,
+        seconds: float,
+    ):
+        post = environment.post
+        self._write(
+            {
+                "type": "batch",
+                "sim_step": time_step,
+                "batch": batch,
+                "actions": environment.agent_actions[self._actions :],
+                "history": post.history[self._history :],
+                "comments": post.comments[self._comments :],
+                "upvotes": int(post.upvotes),
+                "score": float(post.score),
+                "activated": environment.activated,
+                "seconds": seconds,
+            }
+        )
+        self.mark(environment)
+
+    def write_step_end(self, time_step: int, rng_state: Dict, step_metrics: Dict):
+        self._write(
+            {
+                "type": "step_end",
+                "sim_step": time_step,
+                "rng": rng_state,
+                "metrics": step_metrics,
+            }
+        )
+
+    def close(self):
+        self._file.close()
+
+    @staticmethod
+    def read_header(path: str) -> Dict:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.loads(f.readline())
+
+    @staticmethod
+    def load(path: str) -> "CheckpointState":
+        """Read a checkpoint, ignoring a record cut off by a crash"""
+        records = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"Ignoring incomplete record in {path}")
+                    break
+
+        if not records or records[0].get("type") != "header":
+            raise ValueError(f"{path} is not a checkpoint")
+        return CheckpointState(records[0], records[1:])
+
+
+class CheckpointState:
+    """State of a run rebuilt from its checkpoint records"""
+
+    def __init__(self, header: Dict, records: List[Dict]):
+        self.header = header
+        self.batch_size = header["batch_size"]
+        self.actions: List[Dict] = []
+        self.history: List[Dict] = []
+        self.comments: List[str] = []
+        self.upvotes = 1
+        self.score = 0.0
+        self.step_metrics: List[Dict] = []
+        # agents activated and seconds spent in the step the run resumes in
+        self.step_progress = (0, 0.0)
+
+        step_rng: Dict[int, Dict] = {}
+        self.resume_point = (0, 0, None)
+        for record in records:
+            if record["type"] == "step":
+                step_rng[record["sim_step"]] = record["rng"]
+                self.resume_point = (record["sim_step"], 0, record["rng"])
+                self.step_progress = (0, 0.0)
+            elif record["type"] == "batch":
+                self.actions.extend(record["actions"])
+                self.history.extend(record["history"])
+                self.comments.extend(record["comments"])
+                self.upvotes = record["upvotes"]
+                self.score = record["score"]
+                # replay the step's permutation, then continue after this batch
+                step = record["sim_step"]
+                self.resume_point = (step, record["batch"] + 1, step_rng[step])
+                self.step_progress = (
+                    record.get("activated", 0),
+                    record.get("seconds", 0.0),
+                )
+            elif record["type"] == "step_end":
+                self.resume_point = (record["sim_step"] + 1, 0, record["rng"])
+                self.step_progress = (0, 0.0)
+                if "metrics" in record:
+                    self.step_metrics.append(record["metrics"])
+
+    def restore(self, environment: "Environment"):
+        """Apply the checkpointed state to a freshly created environment"""
+        agent_ids = [agent.id for agent in environment.agents]
+        if agent_ids != self.header["agent_ids"]:
+            raise ValueError("The agents differ from the checkpointed run")
+
+        post = environment.post
+        post.categories = self.header["post"]["categories"]
+        post.upvotes = self.upvotes
+        post.score = self.score
+        post.comments = list(self.comments)
+        post.history = [
+            {**record, "new_comments": tuple(record["new_comments"])}
+            for record in self.history
+        ]
+        post._recorded_upvotes = 1 + sum(r["upvotes_delta"] for r in self.history)
+        post._recorded_comments = (
+            self.history[-1]["new_comments"][1] if self.history else 0
+        )
+
+        environment.agent_actions = list(self.actions)
+        acted = {record["agent_id"] for record in self.actions}
+        for i, agent in enumerate(environment.agents):
+            if agent.id in acted:
+                agent.is_active = False
+                environment.active[i] = False
+
+        environment.step_metrics = list(self.step_metrics)
+        environment._resume_point = self.resume_point
+        environment._resume_progress = self.step_progress
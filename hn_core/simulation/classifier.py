@@ -0,0 +1,194 @@
+import hashlib
+import json
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from hn_core.prompts import prompt
+from hn_core.provider.litellm import LLM, get_llm
+from hn_core.utils.logger import get_logger
+
+from .model import ClassifyBatchModel, ClassifyModel
+
+logger = get_logger("hn_classifier")
+
+CATEGORIES = ("gag", "politics", "dei", "tutorial")
+
+
+def content_hash(title: str, text: Optional[str]) -> str:
+    return hashlib.sha256(f"{title}\x00{text or ''}".encode("utf-8")).hexdigest()
+
+
+class Classifier:
+    """Base class of post classifiers.
+
+    Results are memoized process-wide by a hash of the post content, so the same
+    title and text is only classified once per classifier configuration.
+    Subclasses implement `_classify_many`.
+    """
+
+    _memo: Dict[Tuple[str, str], Dict[str, bool]] = {}
+    _memo_lock = threading.Lock()
+
+    @property
+    def memo_namespace(self) -> str:
+        return type(self).__name__
+
+    def classify(self, title: str, text: Optional[str] = None) -> Dict[str, bool]:
+        return self.classify_many([(title, text)])[0]
+
+    def classify_many(
+        self, posts: List[Tuple[str, Optional[str]]]
+    ) -> List[Dict[str, bool]]:
+        """Classify `(title, text)` pairs, only sending memo misses to the backend"""
+        keys = [(self.memo_namespace, content_hash(*post)) for post in posts]
+
+        with self._memo_lock:
+            missing = {}
+            for key, post in zip(keys, posts):
+                if key not in self._memo and key not in missing:
+                    missing[key] = post
+
+        if missing:
+            results = self._classify_many(list(missing.values()))
+            with self._memo_lock:
+                for key, categories in zip(missing, results):
+                    self._memo[key] = categories
+
+        return [dict(self._memo[key]) for key in keys]
+
+    def _classify_many(
+        self, posts: List[Tuple[str, Optional[str]]]
+    ) -> List[Dict[str, bool]]:
+        raise NotImplementedError
+
+
+class KeywordClassifier(Classifier):
+    """Local keyword/regex classifier that needs no network access"""
+
+    patterns = {
+        "gag": r"\b(lol|lmao|joke|jokes|meme|memes|funny|humou?r|parody|satire|prank)\b",
+        "politics": r"\b(politics?|political|election|elections|congress|senate|parliament|democrats?|republicans?|president|minister|government|campaign|voters?|voting|legislation)\b",
+        "dei": r"\b(dei|diversity|inclusion|inclusive|equity|underrepresented|gender gap|affirmative action)\b",
+        "tutorial": r"\b(tutorial|tutorials|how to|how-to|guide|step[- ]by[- ]step|walkthrough|introduction to|beginner'?s|cheat ?sheet|learn [\w+#]+ in)\b",
+    }
+
+    def __init__(self):
+        self._compiled = {
+            category: re.compile(pattern, re.IGNORECASE)
+            for category, pattern in self.patterns.items()
+        }
+
+    def _classify_many(
+        self, posts: List[Tuple[str, Optional[str]]]
+    ) -> List[Dict[str, bool]]:
+        results = []
+        for title, text in posts:
+            content = f"{title}\n{text or ''}"
+            results.append(
+                {
+                    category: bool(pattern.search(content))
+                    for category, pattern in self._compiled.items()
+                }
+            )
+        return results
+
+
+class LLMClassifier(Classifier):
+    """Classifies posts with an LLM.
+
+    Several posts are classified in a single request, posts the model skipped are
+    classified one by one. When the LLM call fails the `fallback` classifier is used.
+    """
+
+    def __init__(
+        self,
+        llm: Optional[LLM] = None,
+        model: str = "gpt-4o-mini",
+        fallback: Optional[Classifier] = None,
+    ):
+        """
+        Args:
+            llm (LLM): Provider client. Defaults to the process-wide client.
+            model (str): Model used for classification
+            fallback (Classifier): Classifier used when the LLM call fails.
+                                   Defaults to `KeywordClassifier`.
+        """
+        self.llm = llm or get_llm()
+        self.model = model
+        self.fallback = fallback or KeywordClassifier()
+
+    @property
+    def memo_namespace(self) -> str:
+        return f"{type(self).__name__}:{self.model}"
+
+    def classify_many(
+        self, posts: List[Tuple[str, Optional[str]]]
+    ) -> List[Dict[str, bool]]:
+        # fallback results are not memoized so a transient failure is retried later
+        try:
+            return super().classify_many(posts)
+        except Exception as e:
+            logger.warning(
+                f"LLM classification failed, using {type(self.fallback).__name__}: {str(e)}"
+            )
+            return self.fallback.classify_many(posts)
+
+    def _classify_many(
+        self, posts: List[Tuple[str, Optional[str]]]
+    ) -> List[Dict[str, bool]]:
+        if len(posts) == 1:
+            return [self._classify_one(*posts[0])]
+        return self._classify_batch(posts)
+
+    def _classify_one(self, title: str, text: Optional[str]) -> Dict[str, bool]:
+        res = self.llm.generate(
+            model=self.model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": prompt.classify.format(title=title, text=text),
+                }
+            ],
+            response_format=ClassifyModel,
+        )
+        categories = json.loads(res.choices[0].message.content)
+        return {category: bool(categories[category]) for category in CATEGORIES}
+
+    def _classify_batch(
+        self, posts: List[Tuple[str, Optional[str]]]
+    ) -> List[Dict[str, bool]]:
+        posts_formatted = "\n".join(
+            f"<post_{i}>\ntitle: {title}\ntext: {text}\n</post_{i}>"
+            for i, (title, text) in enumerate(posts)
+        )
+        res = self.llm.generate(
+            model=self.model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": prompt.classify_batch.format(posts=posts_formatted),
+                }
+            ],
+            response_format=ClassifyBatchModel,
+        )
+        answer = json.loads(res.choices[0].message.content)
+
+        results = {}
+        for categories in answer["posts"]:
+            if not 0 <= categories["index"] < len(posts):
+                continue
+            results[categories["index"]] = {
+                category: bool(categories[category]) for category in CATEGORIES
+            }
+
+        # classify whatever the model skipped on its own
+        missing = [i for i in range(len(posts)) if i not in results]
+        if missing:
+            logger.warning(
+                f"Batch classification skipped {len(missing)} posts, retrying individually"
+            )
+            for i in missing:
+                results[i] = self._classify_one(*posts[i])
+
+        return [results[i] for i in range(len(posts))]
@@ -0,0 +1,260 @@
+import multiprocessing
+import os
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from hn_core.provider.litellm import configure_limits, get_llm, reset_after_fork
+from hn_core.utils.logger import get_logger
+
+from .classifier import KeywordClassifier, LLMClassifier
+from .environment import Environment
+from .post import Post
+from .run import build_agents, load_prompts
+
+logger = get_logger("hn_ensemble")
+
+METRICS = ("upvotes", "comments_count", "score")
+
+# read-only state of the ensemble, inherited by forked workers
+_shared: Dict = {}
+
+
+class EnsembleStats:
+    """Per step statistics of upvotes, comments and score over replicates.
+
+    Replicates are added as they finish, so the bands can be read while the
+    ensemble is still running. Running means use Welford's update; percentiles are
+    exact over the `replicates x steps` values, which are kept in one preallocated
+    array per metric.
+    """
+
+    def __init__(
+        self,
+        replicates: int,
+        total_time_steps: int,
+        percentiles: Sequence[float] = (5, 50, 95),
+    ):
+        self.percentiles = tuple(percentiles)
+        self.count = 0
+        self._values = {
+            metric: np.full((replicates, total_time_steps), np.nan)
+            for metric in METRICS
+        }
+        self._mean = {metric: np.zeros(total_time_steps) for metric in METRICS}
+        self._m2 = {metric: np.zeros(total_time_steps) for metric in METRICS}
+
+    def add(self, trajectory: Dict[str, np.ndarray]):
+        """Add the per step values of one replicate"""
+        self.count += 1
+        for metric in METRICS:
+            values = np.asarray(trajectory[metric], dtype=float)
+            self._values[metric][self.count - 1] = values
+            delta = values - self._mean[metric]
+            self._mean[metric] += delta / self.count
+            self._m2[metric] += delta * (values - self._mean[metric])
+
+    def summary(self) -> List[Dict]:
+        """Mean, standard deviation and percentile bands of every step"""
+        if self.count == 0:
+            return []
+
+        bands = {}
+        for metric in METRICS:
+            values = self._values[metric][: self.count]
+            std = np.sqrt(self._m2[metric] / max(self.count - 1, 1))
+            quantiles = np.percentile(values, self.percentiles, axis=0)
+            bands[metric] = (self._mean[metric], std, quantiles)
+
+        steps = []
+        for step in range(len(self._mean[METRICS[0]])):
+            record = {"sim_step": step}
+            for metric, (mean, std, quantiles) in bands.items():
+                record[metric] = {
+                    "mean": float(mean[step]),
+                    "std": float(std[step]),
+                    **{
+                        f"p{p:g}": float(quantiles[i][step])
+                        for i, p in enumerate(self.percentiles)
+                    },
+                }
+            steps.append(record)
+        return steps
+
+
+def replicate_seeds(seed: Optional[int], replicates: int) -> List[int]:
+    """Independent seeds for every replicate, derived from one ensemble seed"""
+    children = np.random.SeedSequence(seed).spawn(replicates)
+    return [int(child.generate_state(1)[0]) for child in children]
+
+
+def _trajectory(post: Post, total_time_steps: int) -> Dict[str, np.ndarray]:
+    """Post state at the end of every time step"""
+    trajectory = {metric: np.zeros(total_time_steps) for metric in METRICS}
+    for state in post.states():
+        step = state["sim_step"]
+        for metric in METRICS:
+            trajectory[metric][step] = state[metric]
+    return trajectory
+
+
+def _init_worker(shared: Optional[Dict]):
+    # forked workers must not share the parent's pooled HTTP connections
+    reset_after_fork()
+    if shared is not None:
+        _shared.update(shared)
+    config = _shared["config"]
+    if config["rpm"] is not None or config["tpm"] is not None:
+        configure_limits(config["model"], rpm=config["rpm"], tpm=config["tpm"])
+
+
+def _run_replicate(seed: int) -> Dict:
+    """Run one replicate on the shared prompts and post classification"""
+    config = _shared["config"]
+    llm = get_llm()
+
+    post = Post(
+        title=config["title"],
+        url=config["url"],
+        text=config["text"],
+        classifier=KeywordClassifier(),
+    )
+    post.categories = _shared["categories"]
+
+    agents = build_agents(_shared["prompts"], model=config["model"], llm=llm)
+    environment = Environment(
+        total_time_steps=config["total_time_steps"],
+        agents=agents,
+        post=post,
+        k=config["k"],
+        seed=seed,
+    )
+    environment.run(
+        max_workers=config["max_workers"],
+        batch_size=config["batch_size"],
+        engine=config["engine"],
+        concurrency=config["concurrency"],
+    )
+
+    return {
+        "seed": seed,
+        "trajectory": _trajectory(post, config["total_time_steps"]),
+        "token_usage": environment.token_usage(),
+    }
+
+
+def run_ensemble(
+    title: str,
+    url: str,
+    text: str,
+    model: str,
+    replicates: int = 20,
+    num_agents: Optional[int] = None,
+    total_time_steps: int = 10,
+    batch_size: Optional[int] = 10,
+    k: float = 1.0,
+    engine: str = "thread",
+    max_workers: int = 10,
+    concurrency: int = 100,
+    processes: Optional[int] = None,
+    seed: Optional[int] = None,
+    percentiles: Sequence[float] = (5, 50, 95),
+    rpm: Optional[float] = None,
+    tpm: Optional[float] = None,
+    classifier: str = "llm",
+    archive_path: Optional[str] = None,
+    prompt_store_path: Optional[str] = None,
+    on_replicate: Optional[Callable[[int, EnsembleStats], None]] = None,
+) -> Dict:
+    """Run `replicates` independent simulations of the same post in a process pool.
+
+    Personas are loaded and their prompts compiled once in the parent process, and
+    the post is classified once. Workers are forked, so they share this state
+    copy-on-write instead of reloading the archive; where fork is unavailable the
+    state is sent to each worker once on start up.
+
+    Args:
+        replicates (int): Number of simulations
+        processes (int, optional): Size of the process pool. Defaults to the CPU count,
+            capped at `replicates`.
+        seed (int, optional): Ensemble seed, every replicate gets a seed derived from it
+        percentiles (list): Percentiles reported for every step
+        rpm (float, optional): Requests per minute allowed for the whole ensemble, split
+            evenly over the processes. `tpm` likewise.
+        on_replicate (callable, optional): Called with the number of finished replicates
+            and the statistics so far, every time a replicate finishes.
+
+        The remaining arguments are the same as for `run.run`.
+
+    Returns:
+        dict: `{"metadata", "replicates", "seeds", "token_usage", "steps"}` where each
+              step holds mean, std and percentiles of upvotes, comments and score.
+    """
+    processes = min(processes or os.cpu_count() or 1, replicates)
+
+    if classifier == "keyword":
+        post_classifier = KeywordClassifier()
+    else:
+        post_classifier = LLMClassifier(llm=get_llm())
+    categories = post_classifier.classify(title, text)
+
+    shared = {
+        "prompts": load_prompts(
+            num_agents=num_agents,
+            archive_path=archive_path,
+            prompt_store_path=prompt_store_path,
+        ),
+        "categories": categories,
+        "config": {
+            "title": title,
+            "url": url,
+            "text": text,
+            "model": model,
+            "total_time_steps": total_time_steps,
+            "batch_size": batch_size,
+            "k": k,
+            "engine": engine,
+            "max_workers": max_workers,
+            "concurrency": concurrency,
+            "rpm": rpm / processes if rpm is not None else None,
+            "tpm": tpm / processes if tpm is not None else None,
+        },
+    }
+
+    seeds = replicate_seeds(seed, replicates)
+    stats = EnsembleStats(replicates, total_time_steps, percentiles)
+    token_usage: Dict[str, int] = {}
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+        _shared.update(shared)
+        initargs = (None,)
+    else:
+        context = multiprocessing.get_context("spawn")
+        initargs = (shared,)
+
+    logger.info(
+        f"Running {replicates} replicates with {len(shared['prompts'])} agents "
+        f"on {processes} processes..."
+    )
+    try:
+        with context.Pool(
+            processes, initializer=_init_worker, initargs=initargs
+        ) as pool:
+            for result in pool.imap_unordered(_run_replicate, seeds):
+                stats.add(result["trajectory"])
+                for key, value in result["token_usage"].items():
+                    token_usage[key] = token_usage.get(key, 0) + value
+                logger.info(f"Finished replicate {stats.count}/{replicates}")
+                if on_replicate is not None:
+                    on_replicate(stats.count, stats)
+    finally:
+        _shared.clear()
+
+    return {
+        "metadata": {"post_title": title, "post_url": url, "post_text": text},
+        "replicates": replicates,
+        "seeds": seeds,
+        "token_usage": token_usage,
+        "steps": stats.summary(),
+    }
@@ -1,17 +1,30 @@
+import asyncio
 import math
-import random
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
-from typing import List
+from typing import Callable, Dict, Iterator, List, Tuple
 
-from hn_core.provider.litellm import LLM
+import numpy as np
+
+from hn_core.provider.batch import BatchBackend, LocalBatchBackend
+from hn_core.utils import metrics
 from hn_core.utils.logger import get_logger
+from hn_core.utils.results import ResultsWriter, post_record
 
 from .agent import Agent
-from .model import ClassifyModel
+from .checkpoint import Checkpoint
+from .packing import AgentPack
 from .post import Post
 
 logger = get_logger("hn_environment")
 
+STEP_MODES = ("immediate", "synchronous")
+
+
+class SimulationCancelled(Exception):
+    """Raised by a run whose `Environment.cancel_event` was set"""
+
 
 class Environment:
     def __init__(
@@ -20,6 +33,7 @@ class Environment:
         agents: List[Agent],
         post: Post,
         k: float,
+        seed: int | None = None,
     ):
         """Initialize the environment.
 
@@ -29,6 +43,7 @@ class Environment:
             post (Post): A Post object representing the content being interacted with
             k (float): The steepness parameter for the sigmoid function that modifies agent
                        activation probability based on post score.
+            seed (int): Seed of the random generator used for agent ordering and activation
         """
         self.total_time_steps = total_time_steps
         self.agents = agents
@@ -37,35 +52,379 @@ class Environment:
         self.agent_actions = []
         self.activated = None
 
-    def run(self, max_workers: int = 10, batch_size: int | None = None):
-        """Run the simulation with sequential or parallel agent interactions."""
+        # activation state of every agent, indexed like `self.agents`
+        self.rng = np.random.default_rng(seed)
+        self.base_probability = np.array(
+            [agent.activation_probability for agent in agents], dtype=float
+        )
+        self.active = np.array([agent.is_active for agent in agents], dtype=bool)
 
-        if batch_size is None:
-            batch_size = len(self.agents)
+        self.checkpoint: Checkpoint | None = None
+        self.checkpoint_metadata: Dict = {}
+        self.results: ResultsWriter | None = None
+        self._released_usage: Dict[str, int] = {}
+        # actions streamed to `results` and dropped from `agent_actions`
+        self.released_actions = 0
+        self.step_metrics: List[Dict] = []
+        # process metrics when the run started, see `ResultsWriter.write_metrics`
+        self.metrics_baseline: Dict | None = None
+        self.step_mode = "immediate"
+        # called with `_step_progress` after every time step, e.g. to update a UI
+        self.on_step: Callable[[Dict], None] | None = None
+        # stops the run before the next batch once set, see `SimulationCancelled`
+        self.cancel_event: threading.Event | None = None
+        self._resume_point = None
+        self._resume_progress = (0, 0.0)
+        # live process metrics are updated by the run, replays turn this off
+        self.record_metrics = True
 
-        for time_step in range(self.total_time_steps):
-            logger.info(f"Processing time step {time_step}")
-            random.shuffle(self.agents)
+    def run(
+        self,
+        max_workers: int = 10,
+        batch_size: int | None = None,
+        engine: str = "thread",
+        concurrency: int = 100,
+        batch_backend: BatchBackend | None = None,
+        pack_size: int | None = None,
+        checkpoint_path: str | None = None,
+        results: ResultsWriter | None = None,
+        step_mode: str = "immediate",
+    ):
+        """Run the simulation with sequential or parallel agent interactions.
 
-            self.activated = 0
-            # Process agents in batches
-            for i in range(0, len(self.agents), batch_size):
-                batch = self.agents[i : i + batch_size]
+        Args:
+            max_workers (int): Number of worker threads used by the thread engine
+            batch_size (int): Number of agents processed before the post state is recorded.
+                              Defaults to all agents. Ignored by the batch engine.
+            engine (str): Execution engine, one of
+                          - "thread": a thread pool blocking on `LLM.generate`
+                          - "async": asyncio driving `LLM.agenerate`
+                          - "batch": the requests of all agents activated in a time
+                            step are sent as one offline batch job through
+                            `batch_backend`. Activation is drawn once per step, as
+                            every job can take hours to complete.
+            concurrency (int): Maximum number of in-flight LLM requests for the async engine
+            batch_backend (BatchBackend): Backend of the batch engine. Defaults to
+                                          `LocalBatchBackend`.
+            pack_size (int): Number of agents evaluated per LLM request by the thread and
+                             async engines, see `AgentPack`. Packing is disabled by
+                             default and ignored by the batch engine.
+            checkpoint_path (str): Append-only file the state is checkpointed to after
+                                   every batch, see `resume`
+            results (ResultsWriter): Sink the actions and post history are streamed to
+                                     after every batch. Streamed actions are released
+                                     from `agent_actions` to keep memory bounded.
+            step_mode (str): How actions are applied to the post, one of
+                             - "immediate": every worker applies its action as soon
+                               as it is done, later agents of a batch may see it
+                             - "synchronous": workers only return actions, which are
+                               applied in batch order once the whole batch is done,
+                               with one score update per batch. Every agent of a
+                               batch sees the post as it was at the start of the
+                               batch, and results do not depend on thread timing.
+        """
+        if engine == "async":
+            return asyncio.run(
+                self.arun(
+                    batch_size=batch_size,
+                    concurrency=concurrency,
+                    pack_size=pack_size,
+                    checkpoint_path=checkpoint_path,
+                    results=results,
+                    step_mode=step_mode,
+                )
+            )
+
+        if engine not in ("thread", "batch"):
+            raise ValueError(f"Unknown engine: {engine}")
+        if engine == "batch" and batch_size is not None:
+            logger.info(
+                "The batch engine sends one job per time step, batch_size ignored"
+            )
+            batch_size = None
+        self.metrics_baseline = metrics.registry.snapshot()
+        self._set_step_mode(step_mode)
+        self._open_checkpoint(checkpoint_path, batch_size)
+        self._open_results(results)
+
+        if engine == "thread":
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
 
-                # Process each agent in parallel
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                def dispatch(batch: List[Agent], time_step: int):
+                    if self.step_mode == "synchronous":
+                        actions = self._evaluate_batch(executor, batch, pack_size)
+                        self._apply_actions(batch, actions, time_step)
+                        return
                     # force immediate execution and proper error propagation
+                    if pack_size and pack_size > 1:
+                        list(
+                            executor.map(
+                                lambda pack: self._process_pack(pack, time_step),
+                                self._packs(batch, pack_size),
+                            )
+                        )
+                        return
                     list(
                         executor.map(
                             lambda agent: self._process_agent(agent, time_step), batch
                         )
                     )
-                self.post.update_step_state(time_step)
 
+                self._run_steps(batch_size, dispatch)
+
+        elif engine == "batch":
+            backend = batch_backend or LocalBatchBackend()
+            self._run_steps(
+                batch_size,
+                lambda batch, time_step: self._process_batch_job(
+                    batch, time_step, backend
+                ),
+            )
+
+    def run_inline(self, batch_size: int | None = None):
+        """Run the simulation on the calling thread, one agent after the other.
+
+        Meant for agents that answer without I/O, such as replays, for which a thread
+        pool or an event loop would only add overhead.
+        """
+        self._run_steps(
+            batch_size,
+            lambda batch, time_step: [
+                self._process_agent(agent, time_step) for agent in batch
+            ],
+        )
+
+    def _run_steps(
+        self,
+        batch_size: int | None,
+        dispatch: Callable[[List[Agent], int], None],
+    ):
+        """Drive all time steps, handing every non-empty batch to `dispatch`"""
+        for batch, time_step in self._schedule(batch_size):
+            dispatch(batch, time_step)
+
+    async def arun(
+        self,
+        batch_size: int | None = None,
+        concurrency: int = 100,
+        pack_size: int | None = None,
+        checkpoint_path: str | None = None,
+        results: ResultsWriter | None = None,
+        step_mode: str = "immediate",
+    ):
+        """Run the simulation on a single event loop.
+
+        Time steps and batches are processed exactly as in `run`, but every agent of a
+        batch is awaited concurrently, with at most `concurrency` LLM requests in flight.
+        With `pack_size` > 1 the agents of a batch are evaluated in packs instead.
+        """
+        self.metrics_baseline = metrics.registry.snapshot()
+        self._set_step_mode(step_mode)
+        self._open_checkpoint(checkpoint_path, batch_size)
+        self._open_results(results)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        for batch, time_step in self._schedule(batch_size):
+            if self.step_mode == "synchronous":
+                actions = await self._aevaluate_batch(batch, pack_size, semaphore)
+                self._apply_actions(batch, actions, time_step)
+            elif pack_size and pack_size > 1:
+                await asyncio.gather(
+                    *(
+                        self._aprocess_pack(pack, time_step, semaphore)
+                        for pack in self._packs(batch, pack_size)
+                    )
+                )
+            else:
+                await asyncio.gather(
+                    *(
+                        self._aprocess_agent(agent, time_step, semaphore)
+                        for agent in batch
+                    )
+                )
+
+    def _schedule(self, batch_size: int | None) -> Iterator[Tuple[List[Agent], int]]:
+        """Yield every non-empty batch with its time step.
+
+        The post state is recorded (and checkpointed) when the consumer asks for the
+        next batch, i.e. after the previous batch has been processed. A resumed run
+        starts at the batch after the last checkpointed one.
+        """
+        if batch_size is None:
+            batch_size = len(self.agents) or 1
+
+        first_step, first_batch, rng_state = self._resume_point or (0, 0, None)
+        self._resume_point = None
+
+        try:
+            yield from self._schedule_steps(
+                batch_size, first_step, first_batch, rng_state
+            )
+        finally:
+            if self.checkpoint is not None:
+                self.checkpoint.close()
+                self.checkpoint = None
+            if self.results is not None:
+                self.results.flush()
+                self.results = None
+
+    def _schedule_steps(
+        self, batch_size: int, first_step: int, first_batch: int, rng_state
+    ) -> Iterator[Tuple[List[Agent], int]]:
+        for time_step in range(first_step, self.total_time_steps):
+            logger.info(f"Processing time step {time_step}")
+            started = time.monotonic()
+
+            self.activated = 0
+            if time_step == first_step and rng_state is not None:
+                self.rng.bit_generator.state = rng_state
+            if time_step == first_step and first_batch > 0:
+                # the step was interrupted, count what its checkpointed batches did
+                self.activated, seconds = self._resume_progress
+                started -= seconds
+            if self.checkpoint is not None and first_batch == 0:
+                self.checkpoint.write_step(time_step, self.rng.bit_generator.state)
+            self._start_step(time_step)
+
+            batches = self._activated_batches(batch_size, start_batch=first_batch)
+            for index, batch in enumerate(batches, start=first_batch):
+                if self.cancel_event is not None and self.cancel_event.is_set():
+                    raise SimulationCancelled(
+                        f"Cancelled at time step {time_step}, batch {index}"
+                    )
+                if batch:
+                    yield batch, time_step
+                self._record_state(time_step)
+                if self.checkpoint is not None:
+                    self.checkpoint.write_batch(
+                        self, time_step, index, time.monotonic() - started
+                    )
+                if self.results is not None:
+                    self._write_results()
+            first_batch = 0
+
+            self._end_step(time_step)
+            self._record_step_metrics(time_step, time.monotonic() - started)
+            if self.checkpoint is not None:
+                self.checkpoint.write_step_end(
+                    time_step, self.rng.bit_generator.state, self.step_metrics[-1]
+                )
+            if self.results is not None:
+                self.results.flush()
+            if self.on_step is not None:
+                self.on_step(self._step_progress())
             logger.info(f"Activated agents: {self.activated} at time_step: {time_step}")
 
-    def _process_agent(self, agent: Agent, time_step: int):
-        """Process a single agent's interaction with the post.
+    def resume(self, checkpoint_path: str, **kwargs):
+        """Restore the state checkpointed to `checkpoint_path` and continue the run.
+
+        The environment must be created with the same agents and post as the
+        checkpointed run. Batches that were not checkpointed are run again, later
+        checkpoints are appended to the same file. `kwargs` are passed on to `run`;
+        `batch_size` defaults to the checkpointed one.
+        """
+        state = Checkpoint.load(checkpoint_path)
+        state.restore(self)
+        kwargs.setdefault("batch_size", state.batch_size)
+        logger.info(
+            f"Resuming from {checkpoint_path} at time step {self._resume_point[0]}, "
+            f"batch {self._resume_point[1]}"
+        )
+        return self.run(checkpoint_path=checkpoint_path, **kwargs)
+
+    def _set_step_mode(self, step_mode: str):
+        if step_mode not in STEP_MODES:
+            raise ValueError(f"Unknown step mode: {step_mode}")
+        self.step_mode = step_mode
+
+    def _open_checkpoint(self, path: str | None, batch_size: int | None):
+        if path is None:
+            return
+        if self._resume_point is not None:
+            self.checkpoint = Checkpoint(path, append=True)
+            self.checkpoint.mark(self)
+        else:
+            self.checkpoint = Checkpoint(path)
+            self.checkpoint.write_header(self, batch_size)
+
+    def _record_step_metrics(self, time_step: int, seconds: float):
+        throughput = self.activated / seconds if seconds > 0 else 0.0
+        self.step_metrics.append(
+            {
+                "sim_step": time_step,
+                "activated": self.activated,
+                "seconds": seconds,
+                "actions_per_second": throughput,
+            }
+        )
+        if self.record_metrics:
+            metrics.step_activated.observe(self.activated)
+            metrics.step_seconds.observe(seconds)
+
+    def _count_actions(self, count: int = 1):
+        if self.record_metrics:
+            metrics.agent_actions.inc(count)
+
+    def _step_progress(self) -> Dict:
+        """Metrics and post state at the end of the last time step"""
+        return {
+            **self.step_metrics[-1],
+            "upvotes": int(self.post.upvotes),
+            "comments_count": len(self.post.comments),
+            "score": float(self.post.score),
+        }
+
+    def _open_results(self, results: ResultsWriter | None):
+        self.results = results
+        self._results_history = 0
+        self._results_upvotes = 1
+        if results is not None:
+            results.write_metadata(
+                {
+                    "post_title": self.post.title,
+                    "post_url": self.post.url,
+                    "post_text": self.post.text,
+                }
+            )
+
+    def _write_results(self):
+        """Stream the actions and post records added since the last call"""
+        self.results.write_actions(self.agent_actions)
+        for delta in self.post.history[self._results_history :]:
+            self._results_upvotes += delta["upvotes_delta"]
+            self.results.write_post(
+                post_record(self.post, delta, self._results_upvotes)
+            )
+        self._results_history = len(self.post.history)
+
+        for record in self.agent_actions:
+            for key, value in record.get("usage", {}).items():
+                self._released_usage[key] = self._released_usage.get(key, 0) + value
+        self.released_actions += len(self.agent_actions)
+        self.agent_actions = []
+        if self.checkpoint is not None:
+            self.checkpoint.mark(self)
+
+    def _start_step(self, time_step: int):
+        """Hook called before the batches of a time step are drawn"""
+
+    def _record_state(self, time_step: int):
+        """Record the post state after a batch"""
+        self.post.update_step_state(time_step)
+
+    def _end_step(self, time_step: int):
+        """Hook called after the last batch of a time step"""
+
+    def token_usage(self) -> Dict[str, int]:
+        """Token usage summed over every recorded agent action"""
+        total = dict(self._released_usage)
+        for record in self.agent_actions:
+            for key, value in record.get("usage", {}).items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+    def _score_modifier(self) -> float:
+        """Sigmoid modifier applied to every agent's activation probability.
 
         The activation probability is determined by the base_probabilty * modifier
         where modifier is a sigmoid function with parameter k.
@@ -81,17 +440,209 @@ class Environment:
         - High scores gets rewarded with high activation probability
         - The effect is smooth and bounded between 0 and the original probabilit
         """
-        # sigmoid function to reward/penalize probabilty based on the score
-        score_modifier = 1 / (1 + math.exp(-self.post.score / self.k))
-        final_probability = agent.activation_probability * score_modifier
+        return 1 / (1 + math.exp(-self.post.score / self.k))
 
-        if agent.is_active and final_probability >= random.random():
-            self.activated += 1
-            action = agent.run(self.post)
+    def _activated_batches(
+        self, batch_size: int, start_batch: int = 0
+    ) -> Iterator[List[Agent]]:
+        """Yield the activated agents of each batch of one time step.
 
-            self.agent_actions.append(
-                {"sim_step": time_step, "agent_id": agent.id, "actions": action}
+        Agents are ordered by a random permutation and split into batches of
+        `batch_size`. Activation is drawn for all agents at once and compared against
+        the probabilities at the start of each batch, so the post score reached by
+        previous batches is taken into account. Batches without any activated agent
+        are yielded as empty lists; runs of them are skipped with one vectorized check
+        instead of a Python loop over their agents. Activated agents are deactivated.
+        A resumed step starts at `start_batch`.
+        """
+        n = len(self.agents)
+        order = self.rng.permutation(n)
+        draws = self.rng.random(n)
+        num_batches = math.ceil(n / batch_size)
+
+        batch = start_batch
+        while batch < num_batches:
+            start = batch * batch_size
+            remaining = order[start:]
+            probability = self.base_probability[remaining] * self._score_modifier()
+            hits = np.flatnonzero(
+                self.active[remaining] & (draws[start:] <= probability)
             )
 
-            self.post.update(action=action, current_time=time_step)
+            if hits.size == 0:
+                for _ in range(batch, num_batches):
+                    yield []
+                return
+
+            # batches before the first activated agent are empty
+            hit_batch = batch + int(hits[0]) // batch_size
+            for _ in range(batch, hit_batch):
+                yield []
+
+            end = (hit_batch + 1) * batch_size - start
+            activated = remaining[hits[hits < end]]
+            self.active[activated] = False
+            yield [self.agents[i] for i in activated]
+            batch = hit_batch + 1
+
+    def _apply_action(self, agent: Agent, action: Dict, time_step: int):
+        """Record an agent's action and apply it to the post"""
+        self.agent_actions.append(
+            {
+                "sim_step": time_step,
+                "agent_id": agent.id,
+                "actions": action,
+                "usage": dict(agent.last_usage),
+            }
+        )
+
+        self.post.update(action=action, current_time=time_step)
+        agent.is_active = False
+        self._count_actions()
+
+    def _apply_actions(
+        self, batch: List[Agent], actions: Dict[str, Dict], time_step: int
+    ):
+        """Reduce of the synchronous step mode.
+
+        Records the actions of a whole batch in batch order and applies them to the
+        post with a single score update. Runs on the driving thread only.
+        """
+        self.activated += len(batch)
+        for agent in batch:
+            self.agent_actions.append(
+                {
+                    "sim_step": time_step,
+                    "agent_id": agent.id,
+                    "actions": actions[agent.id],
+                    "usage": dict(agent.last_usage),
+                }
+            )
             agent.is_active = False
+
+        self.post.apply_actions([actions[agent.id] for agent in batch], time_step)
+        self._count_actions(len(batch))
+
+    def _evaluate_agent(self, agent: Agent) -> Dict:
+        """Action of an activated agent, without changing any shared state"""
+        return agent.run(self.post)
+
+    async def _aevaluate_agent(
+        self, agent: Agent, semaphore: asyncio.Semaphore
+    ) -> Dict:
+        async with semaphore:
+            return await agent.arun(self.post)
+
+    def _evaluate_batch(
+        self, executor: ThreadPoolExecutor, batch: List[Agent], pack_size: int | None
+    ) -> Dict[str, Dict]:
+        """Actions of every agent of a batch, computed on `executor`"""
+        if pack_size and pack_size > 1:
+            actions = {}
+            for pack_actions in executor.map(
+                lambda pack: AgentPack(pack).run(self.post),
+                self._packs(batch, pack_size),
+            ):
+                actions.update(pack_actions)
+            return actions
+        return dict(
+            zip(
+                [agent.id for agent in batch],
+                executor.map(self._evaluate_agent, batch),
+            )
+        )
+
+    async def _aevaluate_batch(
+        self,
+        batch: List[Agent],
+        pack_size: int | None,
+        semaphore: asyncio.Semaphore,
+    ) -> Dict[str, Dict]:
+        """Async counterpart of `_evaluate_batch`"""
+        if pack_size and pack_size > 1:
+
+            async def evaluate_pack(pack: List[Agent]) -> Dict[str, Dict]:
+                async with semaphore:
+                    return await AgentPack(pack).arun(self.post)
+
+            actions = {}
+            for pack_actions in await asyncio.gather(
+                *(evaluate_pack(pack) for pack in self._packs(batch, pack_size))
+            ):
+                actions.update(pack_actions)
+            return actions
+        results = await asyncio.gather(
+            *(self._aevaluate_agent(agent, semaphore) for agent in batch)
+        )
+        return dict(zip([agent.id for agent in batch], results))
+
+    def _process_agent(self, agent: Agent, time_step: int):
+        """Process a single activated agent's interaction with the post."""
+        self.activated += 1
+        action = self._evaluate_agent(agent)
+        self._apply_action(agent, action, time_step)
+
+    async def _aprocess_agent(
+        self, agent: Agent, time_step: int, semaphore: asyncio.Semaphore
+    ):
+        """Async counterpart of `_process_agent`, bounded by `semaphore`."""
+        self.activated += 1
+        action = await self._aevaluate_agent(agent, semaphore)
+        self._apply_action(agent, action, time_step)
+
+    @staticmethod
+    def _packs(batch: List[Agent], pack_size: int) -> List[List[Agent]]:
+        return [batch[i : i + pack_size] for i in range(0, len(batch), pack_size)]
+
+    def _process_pack(self, pack: List[Agent], time_step: int):
+        """Process several activated agents with one packed LLM request"""
+        self.activated += len(pack)
+        actions = AgentPack(pack).run(self.post)
+        for agent in pack:
+            self._apply_action(agent, actions[agent.id], time_step)
+
+    async def _aprocess_pack(
+        self, pack: List[Agent], time_step: int, semaphore: asyncio.Semaphore
+    ):
+        """Async counterpart of `_process_pack`, bounded by `semaphore`."""
+        self.activated += len(pack)
+        async with semaphore:
+            actions = await AgentPack(pack).arun(self.post)
+        for agent in pack:
+            self._apply_action(agent, actions[agent.id], time_step)
+
+    def _process_batch_job(
+        self, batch: List[Agent], time_step: int, backend: BatchBackend
+    ):
+        """Process the activated agents of a time step as one offline batch job.
+
+        Every agent sees the post as it was at the start of the step. Agents whose
+        request failed or returned an unusable answer fall back to a direct call.
+        """
+        synchronous = self.step_mode == "synchronous"
+        if not synchronous:
+            self.activated += len(batch)
+        requests = [
+            agent.batch_request(self.post, f"{time_step}-{agent.id}") for agent in batch
+        ]
+        results = backend.run(requests)
+
+        actions = {}
+        for agent in batch:
+            body = results.get(f"{time_step}-{agent.id}")
+            action = None
+            if body is not None:
+                try:
+                    action = agent.parse_batch_response(body)
+                except Exception as e:
+                    logger.warning(
+                        f"Invalid batch response for agent {agent.id}: {str(e)}"
+                    )
+            if action is None:
+                action = agent.run(self.post)
+            if synchronous:
+                actions[agent.id] = action
+            else:
+                self._apply_action(agent, action, time_step)
+        if synchronous:
+            self._apply_actions(batch, actions, time_step)
@@ -0,0 +1,306 @@
+import heapq
+import math
+import threading
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from hn_core.utils.logger import get_logger
+
+from .agent import Agent
+from .environment import Environment
+from .post import Post
+
+logger = get_logger("hn_front_page")
+
+
+class RankingIndex:
+    """Indexed max-heap of post scores.
+
+    Every key keeps its position in the heap, so changing the score of one post is
+    a single sift in O(log n) instead of re-sorting all posts. Ties are broken by
+    insertion order, which keeps rankings deterministic.
+    """
+
+    def __init__(self):
+        self._heap: List[int] = []
+        self._pos: Dict[int, int] = {}
+        self._priority: Dict[int, Tuple[float, int]] = {}
+        self._order = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._pos
+
+    def score(self, key: int) -> float:
+        return self._priority[key][0]
+
+    def update(self, key: int, score: float):
+        """Insert `key` or change its score"""
+        if key in self._pos:
+            old = self._priority[key]
+            self._priority[key] = (score, old[1])
+            if self._priority[key] > old:
+                self._sift_up(self._pos[key])
+            else:
+                self._sift_down(self._pos[key])
+            return
+
+        self._priority[key] = (score, -self._order)
+        self._order += 1
+        self._heap.append(key)
+        self._pos[key] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def remove(self, key: int):
+        i = self._pos.pop(key)
+        del self._priority[key]
+        last = self._heap.pop()
+        if i < len(self._heap):
+            self._heap[i] = last
+            self._pos[last] = i
+            self._sift_up(i)
+            self._sift_down(self._pos[last])
+
+    def rebuild(self, scores: Dict[int, float]):
+        """Replace the scores of many keys at once in O(n)"""
+        for key, score in scores.items():
+            if key in self._priority:
+                self._priority[key] = (score, self._priority[key][1])
+            else:
+                self._priority[key] = (score, -self._order)
+                self._order += 1
+                self._pos[key] = len(self._heap)
+                self._heap.append(key)
+
+        for i in reversed(range(len(self._heap) // 2)):
+            self._sift_down(i)
+
+    def top(self, n: int) -> List[int]:
+        """The `n` highest ranked keys in order, in O(n log n)"""
+        result = []
+        frontier = [(self._neg(0), 0)] if self._heap else []
+        while frontier and len(result) < n:
+            _, i = heapq.heappop(frontier)
+            result.append(self._heap[i])
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self._heap):
+                    heapq.heappush(frontier, (self._neg(child), child))
+        return result
+
+    def _neg(self, i: int) -> Tuple[float, int]:
+        score, order = self._priority[self._heap[i]]
+        return (-score, -order)
+
+    def _higher(self, i: int, j: int) -> bool:
+        return self._priority[self._heap[i]] > self._priority[self._heap[j]]
+
+    def _swap(self, i: int, j: int):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._pos[heap[i]] = i
+        self._pos[heap[j]] = j
+
+    def _sift_up(self, i: int):
+        while i > 0:
+            parent = (i - 1) // 2
+            if not self._higher(i, parent):
+                return
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i: int):
+        n = len(self._heap)
+        while True:
+            best = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and self._higher(child, best):
+                    best = child
+            if best == i:
+                return
+            self._swap(i, best)
+            i = best
+
+
+class FrontPageEnvironment(Environment):
+    """Environment with many posts competing for the front page.
+
+    At the start of every time step the posts that are live (submitted at or before
+    the step) are rescored and the ranking is rebuilt. Each activated agent then
+    looks at the current top `top_n` posts and picks one with a rank biased
+    probability of `1 / (rank + 1) ** attention`. Every action rescores only the
+    affected post in the ranking index. Post history is recorded once per time step
+    for every live post.
+    """
+
+    def __init__(
+        self,
+        total_time_steps: int,
+        agents: List[Agent],
+        posts: List[Post],
+        k: float,
+        top_n: int = 30,
+        attention: float = 1.0,
+        seed: int | None = None,
+    ):
+        """Initialize the environment.
+
+        Args:
+            total_time_steps (int): The total number of time steps to simulate (in hours)
+            agents (list): List of Agent objects that can interact with the posts
+            posts (list): Posts competing for the front page, see `Post.posted_at`
+            k (float): The steepness parameter for the sigmoid function that modifies agent
+                       activation probability based on the front page score.
+            top_n (int): Number of posts shown on the front page
+            attention (float): How strongly agents prefer higher ranked posts. 0 picks
+                               uniformly from the front page.
+            seed (int): Seed of the random generator used for agent ordering, activation
+                        and post selection
+        """
+        super().__init__(total_time_steps, agents, None, k, seed=seed)
+        self.posts = posts
+        self.top_n = top_n
+        self.attention = attention
+        self.ranking = RankingIndex()
+        self._front_page: List[int] = []
+        self._assigned: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        # classify every post up front with batched classifier calls
+        pending: Dict[int, List[Post]] = {}
+        for post in posts:
+            if post.categories is None:
+                pending.setdefault(id(post.classifier), []).append(post)
+        for group in pending.values():
+            Post.classify_all(group, group[0].classifier)
+
+    def run(
+        self,
+        max_workers: int = 10,
+        batch_size: int | None = None,
+        engine: str = "thread",
+        concurrency: int = 100,
+        step_mode: str = "immediate",
+    ):
+        """Run the simulation with the thread or async engine, see `Environment.run`"""
+        if engine not in ("thread", "async"):
+            raise ValueError(f"Unsupported engine for the front page: {engine}")
+        return super().run(
+            max_workers=max_workers,
+            batch_size=batch_size,
+            engine=engine,
+            concurrency=concurrency,
+            step_mode=step_mode,
+        )
+
+    def front_page(self) -> List[Post]:
+        """Posts currently on the front page, highest ranked first"""
+        return [self.posts[i] for i in self.ranking.top(self.top_n)]
+
+    def _start_step(self, time_step: int):
+        # scores decay with time, so every live post is rescored once per step
+        scores = {}
+        for i, post in enumerate(self.posts):
+            if post.posted_at <= time_step:
+                post.score = post._calculate_score(time_step, post.penalty)
+                scores[i] = post.score
+        self.ranking.rebuild(scores)
+
+    def _record_state(self, time_step: int):
+        """Post history is recorded per time step, see `_end_step`"""
+
+    def _end_step(self, time_step: int):
+        for post in self.posts:
+            if post.posted_at <= time_step:
+                post.update_step_state(time_step)
+
+    def _step_progress(self) -> Dict:
+        return {
+            **self.step_metrics[-1],
+            "front_page": [
+                {
+                    "post_id": i,
+                    "title": self.posts[i].title,
+                    "score": self.ranking.score(i),
+                }
+                for i in self.ranking.top(self.top_n)
+            ],
+        }
+
+    def _score_modifier(self) -> float:
+        """Sigmoid modifier of the mean score of the front page, see `Environment`"""
+        self._front_page = self.ranking.top(self.top_n)
+        if not self._front_page:
+            return 0.0
+        mean = sum(self.ranking.score(i) for i in self._front_page) / len(
+            self._front_page
+        )
+        return 1 / (1 + math.exp(-mean / self.k))
+
+    def _activated_batches(
+        self, batch_size: int, start_batch: int = 0
+    ) -> Iterator[List[Agent]]:
+        """Assign every activated agent a post of the front page, see `Environment`"""
+        for batch in super()._activated_batches(batch_size, start_batch):
+            if batch and self._front_page:
+                weights = 1 / np.arange(1, len(self._front_page) + 1) ** self.attention
+                picks = self.rng.choice(
+                    len(self._front_page), size=len(batch), p=weights / weights.sum()
+                )
+                for agent, pick in zip(batch, picks):
+                    self._assigned[agent.id] = self._front_page[pick]
+            yield batch
+
+    def _apply_action(self, agent: Agent, action: Dict, time_step: int):
+        """Record an agent's action and rescore the post it acted on"""
+        post_id = self._assigned.pop(agent.id)
+        post = self.posts[post_id]
+        with self._lock:
+            self.agent_actions.append(
+                {
+                    "sim_step": time_step,
+                    "agent_id": agent.id,
+                    "post_id": post_id,
+                    "actions": action,
+                    "usage": dict(agent.last_usage),
+                }
+            )
+            post.update(action=action, current_time=time_step)
+            self.ranking.update(post_id, post.score)
+        agent.is_active = False
+        self._count_actions()
+
+    def _apply_actions(
+        self, batch: List[Agent], actions: Dict[str, Dict], time_step: int
+    ):
+        """Record the actions of a batch and rescore every post acted on once"""
+        self.activated += len(batch)
+        per_post: Dict[int, List[Dict]] = {}
+        for agent in batch:
+            post_id = self._assigned.pop(agent.id)
+            self.agent_actions.append(
+                {
+                    "sim_step": time_step,
+                    "agent_id": agent.id,
+                    "post_id": post_id,
+                    "actions": actions[agent.id],
+                    "usage": dict(agent.last_usage),
+                }
+            )
+            per_post.setdefault(post_id, []).append(actions[agent.id])
+            agent.is_active = False
+
+        for post_id, post_actions in per_post.items():
+            post = self.posts[post_id]
+            post.apply_actions(post_actions, time_step)
+            self.ranking.update(post_id, post.score)
+        self._count_actions(len(batch))
+
+    def _evaluate_agent(self, agent: Agent) -> Dict:
+        return agent.run(self.posts[self._assigned[agent.id]])
+
+    async def _aevaluate_agent(self, agent: Agent, semaphore) -> Dict:
+        async with semaphore:
+            return await agent.arun(self.posts[self._assigned[agent.id]])
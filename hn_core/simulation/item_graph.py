@@ -0,0 +1,95 @@
+from typing import Dict, List, Mapping, Optional
+
+
+class ItemGraph:
+    """Int-keyed index over the parent links of HackerNews items.
+
+    Items are indexed the first time they are reached, so only the part of the
+    archive referenced by personas is ever read. Root resolution is iterative and
+    compresses every walked path, which makes repeated lookups within the same
+    thread O(1) and avoids Python's recursion limit on deep threads.
+    """
+
+    def __init__(self, items: Mapping):
+        """
+        Args:
+            items (Mapping): Items keyed by their string id, e.g. the HN archive dict
+        """
+        self.items = items
+        self.parent: Dict[int, Optional[int]] = {}
+        self.type: Dict[int, Optional[str]] = {}
+        self.root: Dict[int, Optional[int]] = {}
+        self.direct_reply: Dict[int, bool] = {}
+
+    def build(self):
+        """Eagerly index every item of the archive"""
+        for item_id in self.items:
+            self._index(int(item_id))
+        for item_id in list(self.parent):
+            self.get_root(item_id)
+            self.is_direct_reply(item_id)
+
+    def _index(self, item_id: int) -> bool:
+        """Record parent and type of `item_id`, returns False if the item is unknown"""
+        if item_id in self.type:
+            return item_id in self.parent
+
+        item = self.items.get(str(item_id))
+        if not item:
+            self.type[item_id] = None
+            return False
+
+        self.type[item_id] = item.get("type")
+        parent = item.get("parent")
+        self.parent[item_id] = int(parent) if parent is not None else None
+        return True
+
+    def __contains__(self, item_id) -> bool:
+        return self._index(int(item_id))
+
+    def get(self, item_id: int) -> Optional[Dict]:
+        return self.items.get(str(item_id))
+
+    def get_root(self, item_id: int) -> Optional[int]:
+        """Id of the item at the top of the parent chain of `item_id`.
+
+        Returns None when the chain runs into an item missing from the archive.
+        """
+        item_id = int(item_id)
+        path: List[int] = []
+        node = item_id
+        while True:
+            if node in self.root:
+                root = self.root[node]
+                break
+            if not self._index(node):
+                root = None
+                self.root[node] = None
+                break
+            parent = self.parent[node]
+            if parent is None:
+                root = node
+                break
+            path.append(node)
+            node = parent
+
+        # path compression
+        self.root[node] = root
+        for visited in path:
+            self.root[visited] = root
+        return root
+
+    def is_direct_reply(self, item_id: int) -> bool:
+        """Whether `item_id` replies directly to a non-comment item (e.g. a story)"""
+        item_id = int(item_id)
+        if item_id in self.direct_reply:
+            return self.direct_reply[item_id]
+
+        parent = self.parent.get(item_id) if self._index(item_id) else None
+        direct = (
+            parent is not None
+            and self._index(parent)
+            and self.type[parent] != "comment"
+        )
+        self.direct_reply[item_id] = direct
+        return direct
@@ -0,0 +1,153 @@
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from hn_core.utils.logger import get_logger
+
+from .environment import SimulationCancelled
+from .run import run
+
+logger = get_logger("hn_jobs")
+
+
+class JobQueueFull(Exception):
+    """Raised by `JobManager.submit` when the queue holds `max_queued` jobs"""
+
+
+class SimulationJob:
+    """One simulation submitted to a `JobManager`.
+
+    `status` moves from "queued" to "running" and then to "done", "failed" or
+    "cancelled". `progress` receives the `Environment._step_progress` record of
+    every finished time step while the simulation runs, so callers can poll it for
+    live updates.
+    """
+
+    def __init__(self, params: Dict):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = "queued"
+        self.progress: List[Dict] = []
+        self.result = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.future: Optional[Future] = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    def _on_step(self, progress: Dict):
+        self.progress.append(progress)
+
+    def _run(self, runner: Callable):
+        if self.cancel_event.is_set():
+            self.status = "cancelled"
+            self.finished_at = time.time()
+            return
+        self.status = "running"
+        try:
+            self.result = runner(
+                **self.params, on_step=self._on_step, cancel=self.cancel_event
+            )
+            self.status = "done"
+        except SimulationCancelled:
+            logger.info(f"Simulation job {self.id} cancelled")
+            self.status = "cancelled"
+        except Exception as e:
+            logger.exception(f"Simulation job {self.id} failed")
+            self.error = str(e)
+            self.status = "failed"
+        finally:
+            self.finished_at = time.time()
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": list(self.progress),
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """Runs simulations in the background on a shared thread pool.
+
+    A single manager is meant to be shared by every user of a server, so at most
+    `max_workers` simulations run at once and later submissions wait in line.
+    Cancellation is cooperative: queued jobs never start, running jobs stop before
+    their next batch.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        runner: Callable = run,
+        max_queued: Optional[int] = None,
+        max_finished: int = 1000,
+    ):
+        """
+        Args:
+            max_workers (int): Number of simulations run concurrently
+            runner (callable): Function running one simulation. Defaults to `run.run`;
+                               it is called with the job parameters, `on_step` and
+                               `cancel`.
+            max_queued (int): Number of jobs allowed to wait for a worker before
+                              `submit` raises `JobQueueFull`. Defaults to unbounded.
+            max_finished (int): Number of finished jobs kept for `get`, the oldest
+                                ones are forgotten first
+        """
+        self.runner = runner
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hn_job"
+        )
+        self._jobs: Dict[str, SimulationJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, **params) -> SimulationJob:
+        """Queue a simulation, `params` are passed on to the runner"""
+        job = SimulationJob(params)
+        with self._lock:
+            if self.max_queued is not None:
+                queued = sum(1 for j in self._jobs.values() if j.status == "queued")
+                if queued >= self.max_queued:
+                    raise JobQueueFull(f"{queued} simulation jobs are already queued")
+            self._prune()
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(job._run, self.runner)
+        logger.info(f"Submitted simulation job {job.id}")
+        return job
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.finished]
+        for job in finished[: max(len(finished) - self.max_finished + 1, 0)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id: str) -> Optional[SimulationJob]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[SimulationJob]:
+        """Request the cancellation of a job, returns None for unknown jobs"""
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return job
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+        return job
+
+    def jobs(self) -> List[SimulationJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
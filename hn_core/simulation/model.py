@@ -1,19 +1,32 @@
-from typing import Literal
+from typing import List, Literal
 
 from pydantic import BaseModel
 
+Role = Literal[
+    "Software Engineer",
+    "Research Scientist",
+    "Business Analyst",
+    "Product Designer",
+    "Technology Analyst",
+]
+
 
 class ActionModel(BaseModel):
     thoughts: str
     upvote: bool
     comment: str
-    role: Literal[
-        "Software Engineer",
-        "Research Scientist",
-        "Business Analyst",
-        "Product Designer",
-        "Technology Analyst",
-    ]
+    role: Role
+
+
+class DecisionModel(BaseModel):
+    upvote: bool
+    will_comment: bool
+    role: Role
+
+
+class CommentModel(BaseModel):
+    thoughts: str
+    comment: str
 
 
 class ClassifyModel(BaseModel):
@@ -21,3 +34,19 @@ class ClassifyModel(BaseModel):
     politics: bool
     dei: bool
     tutorial: bool
+
+
+class IndexedClassifyModel(ClassifyModel):
+    index: int
+
+
+class ClassifyBatchModel(BaseModel):
+    posts: List[IndexedClassifyModel]
+
+
+class PackedActionModel(ActionModel):
+    agent_id: str
+
+
+class PackedActionsModel(BaseModel):
+    actions: List[PackedActionModel]
@@ -0,0 +1,154 @@
+import asyncio
+import json
+from typing import Dict, List, Tuple
+
+from pydantic import ValidationError
+
+from hn_core.prompts import prompt
+from hn_core.provider.litellm import get_usage
+from hn_core.utils.logger import get_logger
+
+from .agent import Agent
+from .model import PackedActionModel, PackedActionsModel
+from .post import Post
+
+logger = get_logger("hn_packing")
+
+
+class AgentPack:
+    """Evaluates several agents with a single LLM request.
+
+    All personas share one request with the post and comments block, and the model
+    answers with one action per agent. Each answer is validated on its own; agents
+    whose answer is missing, duplicated or invalid fall back to their own request.
+    The request is made with the model, parameters, client and retries of the first
+    agent.
+    """
+
+    def __init__(self, agents: List[Agent]):
+        if not agents:
+            raise ValueError("AgentPack needs at least one agent")
+        self.agents = agents
+        self.lead = agents[0]
+
+    def _build_messages(self, post: Post) -> List[Dict]:
+        users = "\n".join(
+            f'<user id="{agent.id}">\n{agent.agent_prompt}\n</user>'
+            for agent in self.agents
+        )
+        # the post block is identical to the single agent request
+        post_message = self.lead._build_messages(post)[-1]
+        return [
+            {
+                "role": "system",
+                "content": prompt.packed_prompt.replace("{{USERS}}", users),
+            },
+            post_message,
+        ]
+
+    def _parse_response(self, res) -> Dict[str, Dict]:
+        """Map agent id to action for every valid, unambiguous answer"""
+        try:
+            answer = json.loads(res.choices[0].message.content)
+            entries = answer["actions"]
+        except (TypeError, KeyError, ValueError) as e:
+            logger.warning(f"Malformed packed response: {str(e)}")
+            return {}
+
+        expected = {agent.id for agent in self.agents}
+        actions, seen = {}, set()
+        for entry in entries:
+            try:
+                action = PackedActionModel.model_validate(entry)
+            except ValidationError as e:
+                logger.warning(f"Invalid packed action: {str(e)}")
+                continue
+            if action.agent_id not in expected:
+                continue
+            if action.agent_id in seen:
+                # conflicting answers for the same agent, trust neither
+                actions.pop(action.agent_id, None)
+                continue
+            seen.add(action.agent_id)
+            actions[action.agent_id] = {
+                "upvote": action.upvote,
+                "comment": action.comment,
+                "role": action.role,
+            }
+        return actions
+
+    def _split_usage(self, res) -> Dict[str, Dict[str, int]]:
+        """Attribute the usage of the packed request evenly to its agents"""
+        total = get_usage(res)
+        n = len(self.agents)
+        return {
+            agent.id: {
+                key: value // n + (value % n if i == 0 else 0)
+                for key, value in total.items()
+            }
+            for i, agent in enumerate(self.agents)
+        }
+
+    def _record_usage(self, shares: Dict[str, Dict[str, int]], fallback: List[Agent]):
+        """Set each agent's usage to its share, plus its own request if it fell back"""
+        fallback_ids = {agent.id for agent in fallback}
+        for agent in self.agents:
+            usage = shares.get(agent.id, get_usage(None))
+            if agent.id in fallback_ids:
+                usage = {key: usage[key] + agent.last_usage[key] for key in usage}
+            agent.last_usage = usage
+
+    def _parse_answer(self, res) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+        return self._split_usage(res), self._parse_response(res)
+
+    def _no_actions(self) -> Dict[str, Dict]:
+        """No action for every agent once the packed request exhausted its retries"""
+        actions = {
+            agent.id: agent._no_action(self.lead.last_error, model=self.lead.model)
+            for agent in self.agents
+        }
+        self._record_usage({}, [])
+        return actions
+
+    def run(self, post: Post) -> Dict[str, Dict]:
+        """Return the action of every agent of the pack, keyed by agent id.
+
+        Failed requests are retried as a whole through the lead agent, which waits
+        for rate limits instead of multiplying the traffic by the pack size. Only
+        agents without a valid answer fall back to their own request.
+        """
+        answer = self.lead._request(
+            self._build_messages(post),
+            PackedActionsModel,
+            self._parse_answer,
+            self.lead.model,
+            self.lead.model_params,
+        )
+        if answer is None:
+            return self._no_actions()
+        shares, actions = answer
+
+        fallback = [agent for agent in self.agents if agent.id not in actions]
+        for agent in fallback:
+            actions[agent.id] = agent.run(post)
+        self._record_usage(shares, fallback)
+        return actions
+
+    async def arun(self, post: Post) -> Dict[str, Dict]:
+        """Async counterpart of `run`"""
+        answer = await self.lead._arequest(
+            self._build_messages(post),
+            PackedActionsModel,
+            self._parse_answer,
+            self.lead.model,
+            self.lead.model_params,
+        )
+        if answer is None:
+            return self._no_actions()
+        shares, actions = answer
+
+        fallback = [agent for agent in self.agents if agent.id not in actions]
+        results = await asyncio.gather(*(agent.arun(post) for agent in fallback))
+        actions.update({agent.id: action for agent, action in zip(fallback, results)})
+        self._record_usage(shares, fallback)
+        return actions
@@ -1,16 +1,20 @@
 import warnings
+from collections.abc import Mapping
 
 from bs4 import MarkupResemblesLocatorWarning
 from markdownify import markdownify as md
 
+from .item_graph import ItemGraph
+
 warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
 
 
 class Persona:
-    def __init__(self, users: dict, items: dict, template: str):
+    def __init__(self, users: Mapping, items: Mapping, template: str):
         self.users = users
         self.items = items
         self.template = template
+        self.graph = ItemGraph(items)
 
     def get_prompt(self, user_id: str):
         user_data = self._get_user_data(user_id)
@@ -24,39 +28,36 @@ class Persona:
     def _get_user_data(self, user_id):
         user = self.users[user_id].copy()  # Create a copy to avoid modifying original
 
+        # archives read on demand can load all submitted items in one query
+        if hasattr(self.items, "prefetch"):
+            self.items.prefetch(user["submitted"])
+
         # Replace submitted list with items and their root stories
         processed_items = []
         for item_id in user["submitted"]:
-            item_id_str = str(item_id)
-            if item_id_str in self.items:
-                item = self.items[item_id_str]
-                if item.get("type") == "comment":
-                    root_story = self.get_root_story(item_id)
-                    # Check if parent is a story or another comment
-                    parent_item = self.items.get(str(item.get("parent")))
-                    is_direct_reply = (
-                        parent_item and parent_item.get("type") != "comment"
+            if item_id not in self.graph:
+                continue
+            item = self.graph.get(item_id)
+            if item.get("type") == "comment":
+                root_id = self.graph.get_root(item_id)
+                if root_id is not None:
+                    processed_items.append(
+                        {
+                            "comment": item,
+                            "root_story": self.graph.get(root_id),
+                            # Check if parent is a story or another comment
+                            "is_direct_reply": self.graph.is_direct_reply(item_id),
+                        }
                     )
-
-                    if root_story:
-                        processed_items.append(
-                            {
-                                "comment": item,
-                                "root_story": root_story,
-                                "is_direct_reply": is_direct_reply,
-                            }
-                        )
-                else:
-                    processed_items.append(item)
+            else:
+                processed_items.append(item)
 
         user["submitted"] = processed_items
         return user
 
     def get_root_story(self, item_id):
-        item = self.items.get(str(item_id))
-        if not item or "parent" not in item:
-            return item
-        return self.get_root_story(item["parent"])
+        root_id = self.graph.get_root(item_id)
+        return self.graph.get(root_id) if root_id is not None else None
 
     def _basic_metrics(self, user_data):
         return {
@@ -1,15 +1,35 @@
-import json
+import threading
 from datetime import datetime
-from typing import Dict
+from typing import Dict, Iterator, List
 
-from hn_core.prompts import prompt
-from hn_core.provider.litellm import LLM
+from hn_core.utils.logger import get_logger
 
-from .model import ClassifyModel
+from .classifier import Classifier, LLMClassifier
+
+logger = get_logger("hn_post")
+
+# multipliers applied by `Post._calculate_penalty`
+DEFAULT_PENALTIES = {
+    "no_url": 0.4,
+    "gag": 0.1,
+    "politics": 0.1,
+    "dei": 0.1,
+    "tutorial": 0.1,
+}
 
 
 class Post:
-    def __init__(self, title: str, url: str | None = None, text: str | None = None):
+    def __init__(
+        self,
+        title: str,
+        url: str | None = None,
+        text: str | None = None,
+        classifier: Classifier | None = None,
+        posted_at: int = 0,
+        gravity: float = 1.8,
+        points_exponent: float = 0.8,
+        penalties: Dict[str, float] | None = None,
+    ):
         """Initialize a new Post instance representing a Hacker News-style submission.
 
         This constructor creates a new post with both static and dynamic attributes.
@@ -20,34 +40,97 @@ class Post:
             title (str): The headline or title of the post
             url (str): The URL that the post links to (optional, can be empty)
             text (str): The self-post text content (optional, can be empty)
+            classifier (Classifier): Classifier used for the post penalty (optional).
+                                     Defaults to an `LLMClassifier`.
+            posted_at (int): Time step at which the post was submitted. Defaults to 0.
+            gravity (float): Exponent of the age of the post in the score
+            points_exponent (float): Exponent of the points in the score
+            penalties (dict): Overrides of the `DEFAULT_PENALTIES` multipliers
         """
         # Static attributes
         self.title = title
         self.url = url
         self.text = text
+        self.classifier = classifier or LLMClassifier()
+        self.posted_at = posted_at
+        self.gravity = gravity
+        self.points_exponent = points_exponent
+        self.penalties = {**DEFAULT_PENALTIES, **(penalties or {})}
 
         # Dynamic attributes that depend on interaction_stats
         self.upvotes = 1  # Always start with 1 upvote (from submitter)
         self.comments = []
         self.score = 0
-        self.penalty = None
+        self.categories = None
+        self._penalty = None
+        self._penalty_lock = threading.Lock()
 
-        # History to track changes
+        # History to track changes, stored as per-record deltas
         self.history = []
-
-        # Calculate penalty at initialization
-        self._calculate_penalty()
+        self._recorded_upvotes = self.upvotes
+        self._recorded_comments = 0
+
+    @property
+    def penalty(self) -> float:
+        """Post specific penalty, calculated lazily on first scoring"""
+        if self._penalty is None:
+            with self._penalty_lock:
+                if self._penalty is None:
+                    self._calculate_penalty()
+        return self._penalty
+
+    @staticmethod
+    def classify_all(posts: List["Post"], classifier: Classifier):
+        """Classify many posts with a single batched classifier call"""
+        results = classifier.classify_many([(post.title, post.text) for post in posts])
+        for post, categories in zip(posts, results):
+            post.categories = categories
 
     def update_step_state(self, current_time: datetime):
-        """Record the current state to history."""
+        """Record the changes since the previous record to history.
+
+        Only the range of new comment indices and the upvote delta are stored, so
+        history grows with the number of records rather than records x comments.
+        Use `state_at` or `states` to rebuild full states.
+        """
+        comments_count = len(self.comments)
+        upvotes = int(self.upvotes)
         state = {
             "sim_step": current_time,
-            "upvotes": int(self.upvotes),
-            "comments_count": len(self.comments),
-            "comments": list(self.comments),  # Make a copy to prevent mutation
+            "new_comments": (self._recorded_comments, comments_count),
+            "upvotes_delta": upvotes - self._recorded_upvotes,
             "score": float(self.score),  # Ensure score is stored as float
         }
         self.history.append(state)
+        self._recorded_upvotes = upvotes
+        self._recorded_comments = comments_count
+
+    def states(self) -> Iterator[Dict]:
+        """Iterate the full state of every history record"""
+        upvotes = 1
+        for delta in self.history:
+            upvotes += delta["upvotes_delta"]
+            end = delta["new_comments"][1]
+            yield {
+                "sim_step": delta["sim_step"],
+                "upvotes": upvotes,
+                "comments_count": end,
+                "comments": self.comments[:end],
+                "score": delta["score"],
+            }
+
+    def state_at(self, index: int) -> Dict:
+        """Rebuild the full state of the post at history record `index`"""
+        delta = self.history[index]
+        index = index % len(self.history)
+        end = delta["new_comments"][1]
+        return {
+            "sim_step": delta["sim_step"],
+            "upvotes": 1 + sum(d["upvotes_delta"] for d in self.history[: index + 1]),
+            "comments_count": end,
+            "comments": self.comments[:end],
+            "score": delta["score"],
+        }
 
     def _calculate_penalty(self):
         """calculate post specific penalty"""
@@ -55,48 +138,39 @@ class Post:
 
         # no url penalty
         if not self.url:
-            modifier *= 0.4
+            modifier *= self.penalties["no_url"]
 
         ## lightweight penalty definition not clear
         # if not self.text:
         #     modifier *= 0.17
 
-        llm = LLM()
-        res = llm.generate(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": prompt.classify.format(title=self.title, text=self.text),
-                }
-            ],
-            response_format=ClassifyModel,
-        )
-
-        categories = json.loads(res.choices[0].message.content)
+        if self.categories is None:
+            self.categories = self.classifier.classify(self.title, self.text)
+        categories = self.categories
 
-        print(f"category: {categories}")
+        logger.info(f"category: {categories}")
 
         if categories["gag"]:
-            modifier *= 0.1
+            modifier *= self.penalties["gag"]
 
         if categories["politics"]:
-            modifier *= 0.1
+            modifier *= self.penalties["politics"]
 
         if categories["dei"]:
-            modifier *= 0.1
+            modifier *= self.penalties["dei"]
 
         if categories["tutorial"]:
-            modifier *= 0.1
+            modifier *= self.penalties["tutorial"]
 
-        self.penalty = modifier
+        self._penalty = modifier
 
     def _calculate_score(self, current_time: int, penalty: float):
         """
-        score = ((P-1)**0.8 / (T+2)**1.8) * M
+        score = ((P-1)**E / (T+2)**G) * M
 
         P = points (upvotes)
         T = time since submission (in hours)
+        E = Points exponent, defaults to 0.8
         G = Gravity, defaults to 1.8
         M = Various penalty factor
 
@@ -108,9 +182,12 @@ class Post:
             penalty *= (self.upvotes / len(self.comments)) ** 3
 
         points = self.upvotes
-        time_since_posted = current_time
+        time_since_posted = current_time - self.posted_at
 
-        score = ((points - 1) ** 0.8 / ((time_since_posted + 2) ** 1.8)) * penalty
+        score = (
+            (points - 1) ** self.points_exponent
+            / ((time_since_posted + 2) ** self.gravity)
+        ) * penalty
 
         return score
 
@@ -121,15 +198,27 @@ class Post:
             action (dict): In the format {"upvote": upvote, "comment": comment}
             current_time (int): The current timestep
         """
+        self.apply_actions([action], current_time)
+
+    def apply_actions(self, actions: List[Dict], current_time: int):
+        """Apply many agent actions at once, in order, and rescore the post once.
 
-        # Check for upvote action
-        if action.get("upvote"):
-            self.upvotes += 1
+        The score only depends on the final upvotes and comments, so the result is
+        the same as calling `update` for every action.
 
-        # Check for comment action
-        comment_text = action.get("comment")
-        if comment_text:
-            self.comments.append(comment_text)
+        Args:
+            actions (list): Actions in the format of `update`
+            current_time (int): The current timestep
+        """
+        for action in actions:
+            # Check for upvote action
+            if action.get("upvote"):
+                self.upvotes += 1
+
+            # Check for comment action
+            comment_text = action.get("comment")
+            if comment_text:
+                self.comments.append(comment_text)
 
         # Update score
         self.score = self._calculate_score(
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List
+
+from hn_core.utils.logger import get_logger
+
+from .persona import Persona
+
+logger = get_logger("hn_prompt_store")
+
+# SQLite limits the number of bound parameters per statement
+_CHUNK_SIZE = 900
+
+
+def template_hash(template: str) -> str:
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()
+
+
+def archive_version(*paths: str) -> str:
+    """Cheap version of the persona archive derived from file names, sizes and mtimes"""
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(
+            f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+        )
+    return digest.hexdigest()
+
+
+class PromptStore:
+    """Persistent store of compiled persona prompts backed by SQLite.
+
+    Prompts are keyed by user id and the hash of the prompt template, and tagged
+    with the version of the archive they were compiled from. Entries compiled from
+    another archive version are considered stale and rebuilt on the next request.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS prompts (
+                user_id TEXT NOT NULL,
+                template_hash TEXT NOT NULL,
+                archive_version TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                PRIMARY KEY (user_id, template_hash)
+            )
+            """)
+        self._conn.commit()
+
+    def get_many(
+        self, user_ids: Iterable[str], template: str, version: str
+    ) -> Dict[str, str]:
+        """Bulk read the fresh prompts of `user_ids`, stale or missing ids are omitted"""
+        user_ids = list(user_ids)
+        key = template_hash(template)
+        prompts = {}
+        with self._lock:
+            for i in range(0, len(user_ids), _CHUNK_SIZE):
+                chunk = user_ids[i : i + _CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT user_id, prompt FROM prompts WHERE template_hash = ? "
+                    f"AND archive_version = ? AND user_id IN ({placeholders})",
+                    (key, version, *chunk),
+                )
+                prompts.update(rows)
+        return prompts
+
+    def build(self, persona: Persona, user_ids: Iterable[str], version: str) -> int:
+        """Compile and store the prompts of `user_ids` that are missing or stale.
+
+        Returns:
+            int: The number of prompts that were (re)compiled
+        """
+        user_ids = list(user_ids)
+        fresh = self.get_many(user_ids, persona.template, version)
+        return len(self._compile(persona, user_ids, version, fresh))
+
+    def get_prompts(
+        self, persona: Persona, user_ids: Iterable[str], version: str
+    ) -> Dict[str, str]:
+        """Return the prompts of `user_ids`, compiling the missing ones first"""
+        user_ids = list(user_ids)
+        prompts = self.get_many(user_ids, persona.template, version)
+        prompts.update(self._compile(persona, user_ids, version, prompts))
+        return prompts
+
+    def _compile(
+        self,
+        persona: Persona,
+        user_ids: List[str],
+        version: str,
+        fresh: Dict[str, str],
+    ) -> Dict[str, str]:
+        missing = [user_id for user_id in user_ids if user_id not in fresh]
+        if not missing:
+            return {}
+
+        logger.info(f"Compiling {len(missing)} persona prompts...")
+        key = template_hash(persona.template)
+        compiled = {}
+        rows: List = []
+        for user_id in missing:
+            compiled[user_id] = persona.get_prompt(user_id)
+            rows.append((user_id, key, version, compiled[user_id]))
+            if len(rows) >= _CHUNK_SIZE:
+                self._write(rows)
+                rows = []
+        if rows:
+            self._write(rows)
+
+        return compiled
+
+    def _write(self, rows: List):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO prompts (user_id, template_hash, archive_version, prompt) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,255 @@
+import itertools
+import json
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from hn_core.provider.litellm import get_usage
+from hn_core.utils.logger import get_logger
+from hn_core.utils.results import read_results
+
+from .classifier import KeywordClassifier
+from .ensemble import replicate_seeds
+from .environment import Environment
+from .post import Post
+
+logger = get_logger("hn_replay")
+
+
+class DecisionStore:
+    """Recorded agent decisions of a simulation, keyed by agent id.
+
+    Built from `Environment.agent_actions` or a results file, together with the post
+    and its categories, so replays need neither the LLM nor the classifier. Stored as JSONL
+    with one metadata line followed by one decision per line.
+    """
+
+    def __init__(self, metadata: Dict, decisions: Dict[str, Dict]):
+        self.metadata = metadata
+        self.decisions = decisions
+
+    @classmethod
+    def from_environment(cls, environment: Environment) -> "DecisionStore":
+        if environment.released_actions:
+            raise ValueError(
+                f"{environment.released_actions} actions were streamed to the results "
+                f"file and released, use `DecisionStore.from_results`"
+            )
+        post = environment.post
+        metadata = {
+            "post_title": post.title,
+            "post_url": post.url,
+            "post_text": post.text,
+            "categories": post.categories,
+            "agent_ids": [agent.id for agent in environment.agents],
+        }
+        decisions = {
+            record["agent_id"]: record["actions"]
+            for record in environment.agent_actions
+        }
+        return cls(metadata, decisions)
+
+    @classmethod
+    def from_results(
+        cls,
+        path: str,
+        agent_ids: Optional[List[str]] = None,
+        categories: Optional[Dict] = None,
+    ) -> "DecisionStore":
+        """Build the store from a results file, see `hn_core.utils.results`.
+
+        Args:
+            path (str): Results file written by `run.run(results_path=...)` or
+                        `utils.save_simulation_results`
+            agent_ids (list): Every agent of the recorded run, e.g. the keys of
+                              `run.load_prompts`. Results only hold the agents that
+                              were activated, which is the default.
+            categories (dict): Categories of the post. Results do not record them,
+                               by default the post is classified with
+                               `KeywordClassifier`.
+        """
+        metadata, decisions = {}, {}
+        for record in read_results(path, types=["metadata", "action"]):
+            if record["type"] == "metadata":
+                metadata = record
+            else:
+                decisions[record["agent_id"]] = record["actions"]
+
+        if categories is None:
+            categories = KeywordClassifier().classify(
+                metadata.get("post_title"), metadata.get("post_text")
+            )
+        metadata = {
+            "post_title": metadata.get("post_title"),
+            "post_url": metadata.get("post_url"),
+            "post_text": metadata.get("post_text"),
+            "categories": categories,
+            "agent_ids": list(agent_ids) if agent_ids is not None else list(decisions),
+        }
+        return cls(metadata, decisions)
+
+    @classmethod
+    def load(cls, path: str) -> "DecisionStore":
+        with open(path, "r", encoding="utf-8") as f:
+            metadata = json.loads(f.readline())["metadata"]
+            decisions = {}
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    decisions[record["agent_id"]] = record["actions"]
+        return cls(metadata, decisions)
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"metadata": self.metadata}, ensure_ascii=False) + "\n")
+            for agent_id, action in self.decisions.items():
+                f.write(
+                    json.dumps(
+                        {"agent_id": agent_id, "actions": action}, ensure_ascii=False
+                    )
+                    + "\n"
+                )
+
+    def __len__(self) -> int:
+        return len(self.decisions)
+
+    def __contains__(self, agent_id: str) -> bool:
+        return agent_id in self.decisions
+
+    def post(self, **params) -> Post:
+        """Recreate the recorded post, `params` are passed on to `Post`"""
+        post = Post(
+            title=self.metadata["post_title"],
+            url=self.metadata["post_url"],
+            text=self.metadata["post_text"],
+            classifier=KeywordClassifier(),
+            **params,
+        )
+        post.categories = self.metadata["categories"]
+        return post
+
+    def agents(
+        self,
+        activation_probability: float = 0.7,
+        missing: str = "none",
+        seed: Optional[int] = None,
+    ) -> List["ReplayAgent"]:
+        """Replay agents for every agent of the recorded run.
+
+        Agents that were never activated in the recorded run have no decision. With
+        `missing="none"` they take no action when activated, with `missing="sample"`
+        they reuse the decision of a random recorded agent.
+        """
+        if missing not in ("none", "sample"):
+            raise ValueError(f"Unknown missing decision policy: {missing}")
+
+        recorded = list(self.decisions.values())
+        rng = np.random.default_rng(seed)
+        agents = []
+        for agent_id in self.metadata["agent_ids"]:
+            decision = self.decisions.get(agent_id)
+            if decision is None and missing == "sample" and recorded:
+                decision = recorded[rng.integers(len(recorded))]
+            agents.append(ReplayAgent(agent_id, decision, activation_probability))
+        return agents
+
+
+class ReplayAgent:
+    """Stand-in for `Agent` that returns a recorded decision instead of calling an LLM.
+
+    The decision does not depend on the state of the post when the agent is
+    activated, which is the assumption that makes replays cheap.
+    """
+
+    def __init__(
+        self, id: str, decision: Optional[Dict], activation_probability: float
+    ):
+        self.id = id
+        self.decision = decision
+        self.activation_probability = activation_probability
+        self.is_active = True
+        self.last_usage = get_usage(None)
+
+    def run(self, post: Post) -> Dict:
+        if self.decision is None:
+            return {"upvote": False, "comment": None, "role": None}
+        return dict(self.decision)
+
+    async def arun(self, post: Post) -> Dict:
+        return self.run(post)
+
+
+def replay(
+    store: DecisionStore,
+    total_time_steps: int = 10,
+    batch_size: Optional[int] = 10,
+    k: float = 1.0,
+    activation_probability: float = 0.7,
+    gravity: float = 1.8,
+    points_exponent: float = 0.8,
+    penalties: Optional[Dict[str, float]] = None,
+    missing: str = "none",
+    seed: Optional[int] = None,
+) -> Environment:
+    """Re-run activation and scoring on recorded decisions, without any LLM call.
+
+    Returns:
+        Environment: The finished environment, see `utils.build_simulation_results`
+    """
+    agents = store.agents(activation_probability, missing=missing, seed=seed)
+    post = store.post(
+        gravity=gravity, points_exponent=points_exponent, penalties=penalties
+    )
+    environment = Environment(
+        total_time_steps=total_time_steps, agents=agents, post=post, k=k, seed=seed
+    )
+    # replayed decisions are not live agent actions
+    environment.record_metrics = False
+    environment.run_inline(batch_size)
+    return environment
+
+
+def sweep(
+    store: DecisionStore,
+    grid: Dict[str, Iterable],
+    replicates: int = 1,
+    seed: Optional[int] = None,
+    **params,
+) -> List[Dict]:
+    """Replay every combination of the parameters in `grid`.
+
+    Args:
+        store (DecisionStore): Recorded decisions
+        grid (dict): Values per `replay` parameter, e.g. `{"k": [0.5, 1.0], "gravity": [1.5, 1.8]}`
+        replicates (int): Replays per combination, with different seeds
+        seed (int): Seed the replicate seeds are derived from
+        params: Fixed `replay` parameters
+
+    Returns:
+        list: One `{"params", "seed", "upvotes", "comments_count", "score", "activated"}`
+              record per replay
+    """
+    names = list(grid)
+    seeds = replicate_seeds(seed, replicates)
+
+    results = []
+    for values in itertools.product(*(grid[name] for name in names)):
+        combination = dict(zip(names, values))
+        for replicate_seed in seeds:
+            environment = replay(
+                store, **{**params, **combination}, seed=replicate_seed
+            )
+            post = environment.post
+            results.append(
+                {
+                    "params": combination,
+                    "seed": replicate_seed,
+                    "upvotes": post.upvotes,
+                    "comments_count": len(post.comments),
+                    "score": float(post.score),
+                    "activated": len(environment.agent_actions),
+                }
+            )
+
+    logger.info(f"Replayed {len(results)} simulations")
+    return results
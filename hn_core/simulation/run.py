@@ -1,25 +1,113 @@
 import json
 import os
+import threading
 from collections import defaultdict
 from dataclasses import dataclass
-from typing import Optional
+from typing import Callable, Dict, List, Optional
 
 from dotenv import load_dotenv
 
 from hn_core.prompts.prompt import agent_prompt
+from hn_core.provider.batch import BatchBackend, OpenAIBatchBackend
+from hn_core.provider.cache import ResponseCache
+from hn_core.provider.litellm import LLM, configure_limits, get_llm
 from hn_core.simulation.persona import Persona
-from hn_core.utils import utils
+from hn_core.utils import metrics, utils
+from hn_core.utils.archive import Archive
 from hn_core.utils.logger import get_logger
+from hn_core.utils.results import ResultsWriter, read_results
 
 from .agent import Agent
+from .checkpoint import Checkpoint
+from .classifier import KeywordClassifier, LLMClassifier
 from .environment import Environment
 from .post import Post
+from .prompt_store import PromptStore, archive_version
 
 logger = get_logger("hn_main")
 
 load_dotenv()
 
 
+def load_prompts(
+    num_agents: Optional[int] = None,
+    archive_path: Optional[str] = None,
+    prompt_store_path: Optional[str] = None,
+) -> Dict[str, str]:
+    """Load the personas and compile their agent prompts.
+
+    Args:
+        num_agents (int, optional): Number of personas to load. Defaults to all.
+        archive_path (str, optional): SQLite archive, see `run`
+        prompt_store_path (str, optional): Prompt store, see `run`
+
+    Returns:
+        dict: Agent prompt per user id, in archive order
+    """
+    logger.info(f"Loading personas...")
+    archive = Archive(archive_path) if archive_path else None
+    try:
+        if archive is not None:
+            users, items, version = archive.users, archive.items, archive.version
+            user_ids = archive.user_ids(limit=num_agents)
+        else:
+            hn_archive_path = os.path.join(
+                os.path.dirname(os.path.dirname(__file__)), "..", "data/"
+            )
+            users_path = os.path.join(hn_archive_path, "users_trunc.json")
+            items_path = os.path.join(hn_archive_path, "items_trunc.json")
+            users = json.load(open(users_path))
+            items = json.load(open(items_path))
+            version = archive_version(users_path, items_path)
+
+            user_ids = list(users.keys())
+            if num_agents is not None:
+                user_ids = user_ids[:num_agents]
+
+        if num_agents is not None:
+            logger.info(f"Using {num_agents} users for simulation")
+        else:
+            logger.info(f"Using all available {len(user_ids)} users for simulation")
+
+        logger.info("Generating agents with personas...")
+        persona = Persona(users, items, agent_prompt)
+        if prompt_store_path:
+            store = PromptStore(prompt_store_path)
+            prompts = store.get_prompts(persona, user_ids, version)
+            store.close()
+        else:
+            prompts = {user_id: persona.get_prompt(user_id) for user_id in user_ids}
+    finally:
+        # prompts are compiled, personas are not read from the archive anymore
+        if archive is not None:
+            archive.close()
+
+    return {user_id: prompts[user_id] for user_id in user_ids}
+
+
+def build_agents(
+    prompts: Dict[str, str],
+    model: str,
+    llm: LLM,
+    decision_model: Optional[str] = None,
+) -> List[Agent]:
+    """Create one agent per persona prompt, see `Agent` for `decision_model`"""
+    agents = []
+    for user_id, prompt in prompts.items():
+        agent = Agent(
+            id=user_id,
+            provider="litellm",
+            model=model,
+            agent_prompt=prompt,
+            activation_probability=0.7,
+            model_params={"temperature": 1.0},
+            llm=llm,
+            decision_model=decision_model,
+        )
+        agents.append(agent)
+    return agents
+
+
 def run(
     title: str,
     url: str,
@@ -29,6 +117,27 @@ def run(
     total_time_steps: Optional[int] = 10,
     batch_size: Optional[int] = 10,
     k: Optional[float] = 1.0,
+    engine: Optional[str] = "thread",
+    concurrency: Optional[int] = 100,
+    max_workers: Optional[int] = 10,
+    rpm: Optional[float] = None,
+    tpm: Optional[float] = None,
+    cache_path: Optional[str] = None,
+    classifier: Optional[str] = "llm",
+    prompt_store_path: Optional[str] = None,
+    archive_path: Optional[str] = None,
+    seed: Optional[int] = None,
+    batch_backend: Optional[BatchBackend] = None,
+    pack_size: Optional[int] = None,
+    checkpoint_path: Optional[str] = None,
+    resume_run: bool = False,
+    results_path: Optional[str] = None,
+    llm: Optional[LLM] = None,
+    step_mode: Optional[str] = "immediate",
+    prompts: Optional[Dict[str, str]] = None,
+    on_step: Optional[Callable[[Dict], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    decision_model: Optional[str] = None,
 ):
     """Runs a simulation of agent interactions on a Hacker News-style post.
 
@@ -48,46 +157,107 @@ def run(
         k (float, optional): Steepness parameter for the sigmoid function that modifies agent
             activation probability based on post score. Higher values make the probability
             change more sharply around the threshold. Defaults to 0.1.
+        engine (str, optional): Execution engine, "thread", "async" or "batch". The async
+            engine keeps all requests of a batch in flight from a single thread, the batch
+            engine sends the requests of each time step as one offline batch job and ignores
+            `batch_size`. Defaults to "thread".
+        concurrency (int, optional): Maximum number of in-flight LLM requests when using the
+            async engine. Defaults to 100.
+        max_workers (int, optional): Number of threads used by the thread engine.
+            Defaults to 10.
+        rpm (float, optional): Requests per minute allowed for `model`. When neither `rpm`
+            nor `tpm` is given the limits are learned from the provider's rate limit headers.
+            For a model served by deployments (`HN_DEPLOYMENTS`) the budget is split over
+            them by weight, see `configure_limits`.
+        tpm (float, optional): Tokens per minute allowed for `model`.
+        cache_path (str, optional): Path of an on-disk response cache. When set, identical
+            requests (including the post classification) are answered from the cache
+            instead of the provider. Defaults to None (no caching).
+        classifier (str, optional): Post classifier used for the ranking penalty, "llm" or
+            "keyword" (local regex rules, no network). Defaults to "llm".
+        prompt_store_path (str, optional): Path of a persistent persona prompt store. Prompts
+            are compiled once per user, template and archive version and bulk read afterwards.
+            Defaults to None (prompts are compiled on every run).
+        archive_path (str, optional): Path of a SQLite archive created with
+            `hn_core.utils.archive.convert_archive`. Users and items are then read on demand
+            instead of loading the JSON archive. Defaults to None (JSON files in `data/`).
+        seed (int, optional): Seed for agent ordering and activation sampling. Defaults to None.
+        batch_backend (BatchBackend, optional): Backend used by the batch engine. Defaults to
+            the OpenAI Batch API.
+        pack_size (int, optional): Number of personas evaluated per LLM request by the thread
+            and async engines. Defaults to None (one request per agent).
+        checkpoint_path (str, optional): File the run is checkpointed to after every batch.
+            Use `resume` to continue a crashed run. Defaults to None.
+        resume_run (bool, optional): Continue the run checkpointed to `checkpoint_path`
+            instead of starting a new one. Defaults to False.
+        results_path (str, optional): JSONL file the actions and post history are streamed
+            to while the simulation runs, gzip/zstd compressed for a `.gz`/`.zst` path.
+            Defaults to None (results are kept in memory).
+        llm (LLM, optional): Provider client shared by the classifier and the agents,
+            e.g. a `hn_core.provider.mock.MockLLM`. Defaults to the process-wide client
+            of `get_llm`, or to a new `LLM` using the response cache of `cache_path`.
+        step_mode (str, optional): "immediate" applies every action as soon as its agent
+            is done, "synchronous" applies the actions of a batch at once in batch order,
+            which makes results independent of thread timing. Defaults to "immediate".
+        prompts (dict, optional): Agent prompt per user id, e.g. loaded once with
+            `load_prompts` and shared by many runs. Defaults to loading `num_agents`
+            personas from `archive_path`.
+        on_step (callable, optional): Called with the step metrics and post state
+            (upvotes, comments_count, score) after every time step.
+        cancel (threading.Event, optional): Once set, the simulation stops before its
+            next batch and raises `SimulationCancelled`. Checkpoints and streamed
+            results written so far are kept.
+        decision_model (str, optional): Small, fast model that decides on the upvote,
+            whether to comment and the role; `model` is then only called to write the
+            comments. Defaults to None (one call to `model` per activation).
     """
+    run_config = {
+        "title": title,
+        "url": url,
+        "text": text,
+        "model": model,
+        "num_agents": num_agents,
+        "total_time_steps": total_time_steps,
+        "batch_size": batch_size,
+        "k": k,
+        "engine": engine,
+        "concurrency": concurrency,
+        "max_workers": max_workers,
+        "classifier": classifier,
+        "prompt_store_path": prompt_store_path,
+        "archive_path": archive_path,
+        "seed": seed,
+        "pack_size": pack_size,
+        "step_mode": step_mode,
+        "decision_model": decision_model,
+    }
+
+    if rpm is not None or tpm is not None:
+        configure_limits(model, rpm=rpm, tpm=tpm)
+
+    cache = ResponseCache(cache_path) if cache_path else None
+    if llm is None:
+        llm = LLM(cache=cache) if cache is not None else get_llm()
 
     # Create post
+    if classifier == "keyword":
+        post_classifier = KeywordClassifier()
+    else:
+        post_classifier = LLMClassifier(llm=llm)
     post = Post(
         title=title,
         url=url,
         text=text,
+        classifier=post_classifier,
     )
 
-    # Load personas
-    logger.info(f"Loading personas...")
-    hn_archive_path = os.path.join(
-        os.path.dirname(os.path.dirname(__file__)), "..", "data/"
-    )
-    users = json.load(open(hn_archive_path + "/users_trunc.json"))
-    items = json.load(open(hn_archive_path + "/items_trunc.json"))
-
-    user_ids = list(users.keys())
-    if num_agents is not None:
-        logger.info(f"Using {num_agents} users for simulation")
-        user_ids = user_ids[:num_agents]
-    else:
-        logger.info(f"Using all available {len(users)} users for simulation")
-
-    # Create agents
-    logger.info("Generating agents with personas...")
-    agents = []
-
-    persona = Persona(users, items, agent_prompt)
-    for user_id in user_ids:
-        prompt = persona.get_prompt(user_id)
-        agent = Agent(
-            id=user_id,
-            provider="litellm",
-            model=model,
-            agent_prompt=prompt,
-            activation_probability=0.7,
-            model_params={"temperature": 1.0},
+    if prompts is None:
+        prompts = load_prompts(
+            num_agents=num_agents,
+            archive_path=archive_path,
+            prompt_store_path=prompt_store_path,
         )
-        agents.append(agent)
+    agents = build_agents(prompts, model=model, llm=llm, decision_model=decision_model)
 
     # Run the environment
     logger.info(f"Starting simulation with {len(agents)} agents...")
@@ -96,12 +266,60 @@ def run(
         agents=agents,
         post=post,
         k=k,
+        seed=seed,
+    )
+    environment.checkpoint_metadata = {"run": run_config}
+    environment.on_step = on_step
+    environment.cancel_event = cancel
+    if engine == "batch" and batch_backend is None:
+        batch_backend = OpenAIBatchBackend()
+    results = ResultsWriter(results_path) if results_path else None
+    run_kwargs = dict(
+        batch_size=batch_size,
+        engine=engine,
+        concurrency=concurrency,
+        max_workers=max_workers,
+        batch_backend=batch_backend,
+        pack_size=pack_size,
+        results=results,
+        step_mode=step_mode,
     )
-    environment.run(batch_size=batch_size)
+    try:
+        if resume_run:
+            environment.resume(checkpoint_path, **run_kwargs)
+        else:
+            environment.run(checkpoint_path=checkpoint_path, **run_kwargs)
+    finally:
+        if results is not None:
+            results.write_metrics(
+                environment.step_metrics, since=environment.metrics_baseline
+            )
+            results.close()
+        if cache is not None:
+            logger.info(f"Response cache: {cache.stats()}")
+            cache.close()
+
+    logger.info(f"Token usage: {environment.token_usage()}")
+    logger.debug(f"Metrics:\n{metrics.registry.to_prometheus()}")
 
     # build simulation result
-    actions, post_history = utils.build_simulation_results(environment=environment)
+    if results is not None:
+        actions = read_results(results_path, types=["action"])
+    else:
+        actions, post_history = utils.build_simulation_results(environment=environment)
     # build agent role
     agent_profile = utils.build_agent_profile(actions=actions)
 
-    return agent_profile, post_history[-1]
+    return agent_profile, utils.final_post_state(environment)
+
+
+def resume(checkpoint_path: str, **kwargs):
+    """Continue a simulation started by `run` with a `checkpoint_path`.
+
+    The run is rebuilt with the arguments recorded in the checkpoint, `kwargs`
+    override them (e.g. `rpm`, `cache_path` or `batch_backend`, which are not
+    recorded).
+    """
+    config = Checkpoint.read_header(checkpoint_path)["metadata"]["run"]
+    config.update(kwargs)
+    return run(**config, checkpoint_path=checkpoint_path, resume_run=True)
@@ -0,0 +1,120 @@
+from typing import Dict, Sequence
+
+import numpy as np
+
+from hn_core.utils.export import load_table
+
+CURVE_METRICS = ("upvotes", "comments_count", "score")
+
+
+def role_breakdown(actions: Dict[str, np.ndarray]) -> Dict[str, Dict]:
+    """Actions, upvotes and comments per role over any number of runs.
+
+    Args:
+        actions (dict): Columns of the actions table, see `export.load_table`
+    """
+    if not actions or len(actions["role"]) == 0:
+        return {}
+
+    roles, index = np.unique(actions["role"], return_inverse=True)
+    count = np.bincount(index, minlength=len(roles))
+    upvotes = np.bincount(index, weights=actions["upvote"], minlength=len(roles))
+    comments = np.bincount(
+        index, weights=actions["comment"] != "", minlength=len(roles)
+    )
+
+    # actions without a role (failed requests) are reported under None
+    return {
+        (str(role) or None): {
+            "actions": int(count[i]),
+            "upvotes": int(upvotes[i]),
+            "comments_count": int(comments[i]),
+            "upvote_rate": float(upvotes[i] / count[i]),
+            "comment_rate": float(comments[i] / count[i]),
+        }
+        for i, role in enumerate(roles)
+    }
+
+
+def step_curves(post: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Upvotes, comments and score at the end of every step of every run.
+
+    Returns:
+        dict: `run_ids` (R), `steps` (S) and one R x S array per metric. Steps without
+              a record carry the previous value forward, steps before the first record
+              of a run are NaN.
+    """
+    run_ids, run_index = np.unique(post["run_id"], return_inverse=True)
+    steps, step_index = np.unique(post["sim_step"], return_inverse=True)
+
+    # last record of every (run, step) group
+    order = np.lexsort((post["record"], step_index, run_index))
+    key = run_index[order] * len(steps) + step_index[order]
+    last = order[np.append(key[1:] != key[:-1], True)]
+
+    curves = {"run_ids": run_ids, "steps": steps}
+    filled = np.zeros((len(run_ids), len(steps)), dtype=bool)
+    filled[run_index[last], step_index[last]] = True
+    # index of the latest filled step, for forward filling
+    source = np.maximum.accumulate(np.where(filled, np.arange(len(steps)), -1), axis=1)
+    rows = np.arange(len(run_ids))[:, None]
+
+    for metric in CURVE_METRICS:
+        values = np.full((len(run_ids), len(steps)), np.nan)
+        values[run_index[last], step_index[last]] = post[metric][last]
+        values = values[rows, np.maximum(source, 0)]
+        values[source < 0] = np.nan
+        curves[metric] = values
+    return curves
+
+
+def curve_bands(
+    curves: Dict[str, np.ndarray], percentiles: Sequence[float] = (5, 50, 95)
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """Mean and percentile bands over runs of every metric of `step_curves`"""
+    bands = {}
+    for metric in CURVE_METRICS:
+        values = curves[metric]
+        bands[metric] = {
+            "mean": np.nanmean(values, axis=0),
+            **{
+                f"p{p:g}": band
+                for p, band in zip(
+                    percentiles, np.nanpercentile(values, percentiles, axis=0)
+                )
+            },
+        }
+    return bands
+
+
+def time_to_peak(post: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Step and value of the highest score of every run, the earliest one on ties"""
+    run_ids, run_index = np.unique(post["run_id"], return_inverse=True)
+    order = np.lexsort((-post["record"], post["score"], run_index))
+    peak = order[np.append(run_index[order][1:] != run_index[order][:-1], True)]
+    return {
+        "run_ids": run_ids,
+        "peak_step": post["sim_step"][peak],
+        "peak_score": post["score"][peak],
+    }
+
+
+def summarize(directory: str, percentiles: Sequence[float] = (5, 50, 95)) -> Dict:
+    """Role breakdown, curve bands and time to peak of every run in `directory`"""
+    actions = load_table(
+        directory, "actions", columns=["run_id", "upvote", "comment", "role"]
+    )
+    post = load_table(directory, "post")
+    if not post:
+        return {"runs": 0}
+
+    peaks = time_to_peak(post)
+    return {
+        "runs": len(peaks["run_ids"]),
+        "roles": role_breakdown(actions),
+        "curves": curve_bands(step_curves(post), percentiles),
+        "time_to_peak": {
+            "mean": float(np.mean(peaks["peak_step"])),
+            "median": float(np.median(peaks["peak_step"])),
+        },
+    }
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from hn_core.utils.logger import get_logger
+
+logger = get_logger("hn_archive")
+
+# SQLite limits the number of bound parameters per statement
+_CHUNK_SIZE = 900
+
+
+def iter_json_object(
+    path: str, chunk_size: int = 1 << 20
+) -> Iterator[Tuple[str, Dict]]:
+    """Stream the `(key, value)` pairs of a top-level JSON object.
+
+    Only one record is decoded at a time, so converting the multi GB archive does
+    not require loading it into memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        def skip(chars: str):
+            nonlocal pos
+            while True:
+                while pos < len(buffer) and buffer[pos] in chars:
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    return
+                fill()
+
+        def decode():
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    # a number may be cut off at the end of the buffer
+                    if end < len(buffer) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        fill()
+        skip(" \t\r\n")
+        if buffer[pos : pos + 1] != "{":
+            raise ValueError(f"{path} does not contain a JSON object")
+        pos += 1
+
+        while True:
+            skip(" \t\r\n,")
+            if buffer[pos : pos + 1] == "}" or (eof and pos >= len(buffer)):
+                return
+            key = decode()
+            skip(" \t\r\n:")
+            yield key, decode()
+
+
+def iter_records(path: str) -> Iterator[Tuple[str, Dict]]:
+    """Iterate `(id, record)` pairs of a `.json` object or a `.jsonl` file"""
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield str(record["id"]), record
+    else:
+        yield from iter_json_object(path)
+
+
+def convert_archive(
+    users_path: str, items_path: str, db_path: str, batch_size: int = 10000
+) -> str:
+    """Convert the JSON users/items archive into a single SQLite file.
+
+    Args:
+        users_path (str): Users keyed by user id (`.json`) or one user per line (`.jsonl`)
+        items_path (str): Items keyed by item id (`.json`) or one item per line (`.jsonl`)
+        db_path (str): Output archive file
+        batch_size (int): Number of records inserted per transaction
+
+    Returns:
+        str: The version of the archive, derived from the content of the source files
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    conn.execute("CREATE TABLE users (id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+    conn.execute("CREATE TABLE items (id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+
+    digest = hashlib.sha256()
+    for table, path in (("users", users_path), ("items", items_path)):
+        logger.info(f"Converting {path} into {db_path}:{table}...")
+        rows: List[Tuple[str, str]] = []
+        count = 0
+        for key, record in iter_records(path):
+            data = json.dumps(record, separators=(",", ":"), ensure_ascii=False)
+            digest.update(key.encode("utf-8"))
+            digest.update(data.encode("utf-8"))
+            rows.append((key, data))
+            if len(rows) >= batch_size:
+                conn.executemany(f"INSERT INTO {table} VALUES (?, ?)", rows)
+                count += len(rows)
+                rows = []
+        conn.executemany(f"INSERT INTO {table} VALUES (?, ?)", rows)
+        count += len(rows)
+        conn.commit()
+        logger.info(f"Wrote {count} {table}")
+
+    version = digest.hexdigest()
+    conn.execute("INSERT INTO meta VALUES ('version', ?)", (version,))
+    conn.commit()
+    conn.close()
+    return version
+
+
+class ArchiveMapping(Mapping):
+    """Read-only, dict-like view over one table of the SQLite archive.
+
+    Records are fetched and decoded on access, with a bounded LRU of recently
+    used records, so only users and items that are actually referenced are read.
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        lock: threading.Lock,
+        table: str,
+        cache_size: int = 100_000,
+    ):
+        self._conn = conn
+        self._lock = lock
+        self._table = table
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_size = cache_size
+        self._len: Optional[int] = None
+
+    def _remember(self, key: str, value: Optional[Dict]):
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def _fetch(self, key: str) -> Optional[Dict]:
+        key = str(key)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            row = self._conn.execute(
+                f"SELECT data FROM {self._table} WHERE id = ?", (key,)
+            ).fetchone()
+            value = json.loads(row[0]) if row else None
+            self._remember(key, value)
+            return value
+
+    def __getitem__(self, key) -> Dict:
+        value = self._fetch(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._fetch(key)
+        return default if value is None else value
+
+    def __contains__(self, key) -> bool:
+        return self._fetch(key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            ids = [
+                row[0]
+                for row in self._conn.execute(
+                    f"SELECT id FROM {self._table} ORDER BY rowid"
+                )
+            ]
+        return iter(ids)
+
+    def __len__(self) -> int:
+        if self._len is None:
+            with self._lock:
+                self._len = self._conn.execute(
+                    f"SELECT COUNT(*) FROM {self._table}"
+                ).fetchone()[0]
+        return self._len
+
+    def prefetch(self, keys: Iterable):
+        """Load many records with a few bulk queries"""
+        keys = [str(key) for key in keys]
+        with self._lock:
+            keys = [key for key in keys if key not in self._cache]
+            for i in range(0, len(keys), _CHUNK_SIZE):
+                chunk = keys[i : i + _CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                found = dict(
+                    self._conn.execute(
+                        f"SELECT id, data FROM {self._table} WHERE id IN ({placeholders})",
+                        chunk,
+                    )
+                )
+                for key in chunk:
+                    data = found.get(key)
+                    self._remember(key, json.loads(data) if data else None)
+
+
+class Archive:
+    """HackerNews users/items archive stored in a SQLite file.
+
+    `users` and `items` behave like the dicts loaded from the JSON archive and can
+    be passed to `Persona` directly.
+    """
+
+    def __init__(self, path: str, cache_size: int = 100_000):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Archive '{path}' not found")
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            f"file:{path}?mode=ro", uri=True, check_same_thread=False
+        )
+        self.users = ArchiveMapping(self._conn, self._lock, "users", cache_size)
+        self.items = ArchiveMapping(self._conn, self._lock, "items", cache_size)
+
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = 'version'"
+        ).fetchone()
+        self.version = row[0] if row else ""
+
+    def user_ids(self, limit: Optional[int] = None) -> List[str]:
+        query = "SELECT id FROM users ORDER BY rowid"
+        params: Tuple = ()
+        if limit is not None:
+            query += " LIMIT ?"
+            params = (limit,)
+        with self._lock:
+            return [row[0] for row in self._conn.execute(query, params)]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert the JSON HackerNews archive into a SQLite archive"
+    )
+    parser.add_argument("users", help="users .json/.jsonl file")
+    parser.add_argument("items", help="items .json/.jsonl file")
+    parser.add_argument("output", help="output .db file")
+    args = parser.parse_args()
+
+    convert_archive(args.users, args.items, args.output)
@@ -0,0 +1,195 @@
+import glob
+import os
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from hn_core.utils.logger import get_logger
+from hn_core.utils.results import read_results
+from hn_core.utils.utils import build_simulation_results
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = get_logger("hn_export")
+
+TABLES = ("actions", "post")
+
+
+def actions_columns(actions: Iterable[Dict], run_id: str) -> Dict[str, np.ndarray]:
+    """Columns of the agent actions of one run.
+
+    Missing comments and roles are stored as empty strings.
+    """
+    sim_step, agent_id, upvote, comment, role = [], [], [], [], []
+    input_tokens, output_tokens = [], []
+    for record in actions:
+        action = record["actions"]
+        usage = record.get("usage", {})
+        sim_step.append(record["sim_step"])
+        agent_id.append(str(record["agent_id"]))
+        upvote.append(bool(action.get("upvote")))
+        comment.append(action.get("comment") or "")
+        role.append(action.get("role") or "")
+        input_tokens.append(usage.get("input_tokens", 0))
+        output_tokens.append(usage.get("output_tokens", 0))
+
+    return {
+        "run_id": np.full(len(sim_step), run_id),
+        "sim_step": np.array(sim_step, dtype=np.int32),
+        "agent_id": np.array(agent_id, dtype=str),
+        "upvote": np.array(upvote, dtype=bool),
+        "comment": np.array(comment, dtype=str),
+        "role": np.array(role, dtype=str),
+        "input_tokens": np.array(input_tokens, dtype=np.int64),
+        "output_tokens": np.array(output_tokens, dtype=np.int64),
+    }
+
+
+def post_columns(history: Iterable[Dict], run_id: str) -> Dict[str, np.ndarray]:
+    """Columns of the post history of one run, one row per history record"""
+    sim_step, upvotes, comments_count, score = [], [], [], []
+    for record in history:
+        sim_step.append(record["sim_step"])
+        upvotes.append(record["upvotes"])
+        comments_count.append(record["comments_count"])
+        score.append(record["score"])
+
+    return {
+        "run_id": np.full(len(sim_step), run_id),
+        "record": np.arange(len(sim_step), dtype=np.int32),
+        "sim_step": np.array(sim_step, dtype=np.int32),
+        "upvotes": np.array(upvotes, dtype=np.int64),
+        "comments_count": np.array(comments_count, dtype=np.int64),
+        "score": np.array(score, dtype=np.float64),
+    }
+
+
+def _resolve_format(format: str) -> str:
+    if format == "auto":
+        return "parquet" if pa is not None else "npz"
+    if format == "parquet" and pa is None:
+        raise ImportError("parquet export requires the `pyarrow` package")
+    if format not in ("parquet", "npz"):
+        raise ValueError(f"Unknown export format: {format}")
+    return format
+
+
+def export_results(
+    directory: str,
+    actions: Iterable[Dict],
+    history: Iterable[Dict],
+    run_id: Optional[str] = None,
+    format: str = "auto",
+) -> str:
+    """Write the actions and post history of one run as columnar files.
+
+    Layout of `directory`, one file per run and table:
+        parquet: actions/<run_id>.parquet, post/<run_id>.parquet
+        npz:     actions/<run_id>.npz, post/<run_id>.npz
+
+    Args:
+        directory (str): Dataset directory shared by many runs
+        actions (list): `Environment.agent_actions` records
+        history (list): Post history records, see `utils.build_simulation_results`
+        run_id (str): Identifier of the run. Defaults to a random id.
+        format (str): "parquet", "npz", or "auto" (parquet if pyarrow is installed)
+
+    Returns:
+        str: The run id
+    """
+    format = _resolve_format(format)
+    run_id = run_id or uuid.uuid4().hex
+    tables = {
+        "actions": actions_columns(actions, run_id),
+        "post": post_columns(history, run_id),
+    }
+
+    for table, columns in tables.items():
+        os.makedirs(os.path.join(directory, table), exist_ok=True)
+        path = os.path.join(directory, table, f"{run_id}.{format}")
+        if format == "parquet":
+            pq.write_table(pa.table(columns), path)
+        else:
+            np.savez_compressed(path, **columns)
+
+    logger.info(f"Exported run {run_id} to {directory}")
+    return run_id
+
+
+def export_environment(
+    environment, directory: str, run_id: Optional[str] = None, format: str = "auto"
+) -> str:
+    """Export a finished `Environment`, see `export_results`"""
+    actions, post_history = build_simulation_results(environment)
+    return export_results(
+        directory, actions, post_history["history"], run_id=run_id, format=format
+    )
+
+
+def export_results_file(
+    path: str, directory: str, run_id: Optional[str] = None, format: str = "auto"
+) -> str:
+    """Export a JSONL results file written by `ResultsWriter`, see `export_results`.
+
+    `run_id` defaults to the directory and the file name without its extensions,
+    e.g. "20250201_120000_results" for `20250201_120000/results.jsonl.gz`, so results
+    files of one directory as well as the `results.jsonl` files of different
+    `save_simulation_results` runs get distinct ids.
+    """
+    return export_results(
+        directory,
+        read_results(path, types=["action"]),
+        read_results(path, types=["post"]),
+        run_id=run_id or _default_run_id(path),
+        format=format,
+    )
+
+
+def _default_run_id(path: str) -> str:
+    path = os.path.abspath(path)
+    name = os.path.basename(path)
+    for extension in (".gz", ".zst", ".jsonl"):
+        if name.endswith(extension):
+            name = name[: -len(extension)]
+    return f"{os.path.basename(os.path.dirname(path))}_{name}"
+
+
+def load_table(
+    directory: str, table: str, columns: Optional[List[str]] = None
+) -> Dict[str, np.ndarray]:
+    """Load one table of every run in `directory` as concatenated columns.
+
+    Args:
+        directory (str): Dataset directory written by `export_results`
+        table (str): "actions" or "post"
+        columns (list): Only load these columns. Defaults to all.
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table: {table}")
+
+    parts: List[Dict[str, np.ndarray]] = []
+    for path in sorted(glob.glob(os.path.join(directory, table, "*"))):
+        if path.endswith(".parquet"):
+            if pq is None:
+                raise ImportError("reading parquet files requires `pyarrow`")
+            data = pq.read_table(path, columns=columns)
+            parts.append(
+                {
+                    name: np.asarray(data.column(name).to_numpy(zero_copy_only=False))
+                    for name in data.column_names
+                }
+            )
+        elif path.endswith(".npz"):
+            with np.load(path) as data:
+                names = columns or list(data.keys())
+                parts.append({name: data[name] for name in names})
+
+    if not parts:
+        return {}
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
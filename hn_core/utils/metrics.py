@@ -0,0 +1,355 @@
+import bisect
+import math
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# seconds, from fast cache hits to slow reasoning calls
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_key(labelnames: Sequence[str], labels: Dict[str, str]) -> Tuple:
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {list(labelnames)}, got {list(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Sequence[str], key: Tuple, **extra) -> str:
+    pairs = list(zip(labelnames, key)) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, object] = {}
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+    def snapshot(self) -> Dict[Tuple, object]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set"""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def to_prometheus(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                )
+        return lines
+
+    def summary(self, since: Optional[Dict[Tuple, object]] = None) -> List[Dict]:
+        """Values per label set, the increase since the `since` snapshot if given"""
+        with self._lock:
+            values = sorted(self._values.items())
+        if since is not None:
+            values = [
+                (key, value - since.get(key, 0))
+                for key, value in values
+                if value != since.get(key, 0)
+            ]
+        return [
+            {**dict(zip(self.labelnames, key)), "value": value} for key, value in values
+        ]
+
+
+class Gauge(Counter):
+    """Value per label set that can go up and down"""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def summary(self, since: Optional[Dict[Tuple, object]] = None) -> List[Dict]:
+        """Current values, gauges are never reported as a difference"""
+        return super().summary()
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets per label set"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {
+                    "counts": [0] * (len(self.buckets) + 1),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            state["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _quantile(self, state: Dict, q: float) -> Optional[float]:
+        """Quantile estimated by interpolating within the bucket that holds it"""
+        if state["count"] == 0:
+            return None
+        rank = q * state["count"]
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, state["counts"]):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+    def to_prometheus(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), state["counts"]):
+                    cumulative += count
+                    labels = _format_labels(
+                        self.labelnames, key, le=_format_value(bound)
+                    )
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+                lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+    def snapshot(self) -> Dict[Tuple, object]:
+        with self._lock:
+            return {
+                key: {**state, "counts": list(state["counts"])}
+                for key, state in self._values.items()
+            }
+
+    def summary(self, since: Optional[Dict[Tuple, object]] = None) -> List[Dict]:
+        """Statistics per label set, since the `since` snapshot if given"""
+        states = sorted(self.snapshot().items())
+        if since is not None:
+            states = [
+                (key, _subtract(state, since[key]) if key in since else state)
+                for key, state in states
+            ]
+            states = [(key, state) for key, state in states if state["count"]]
+        return [
+            {
+                **dict(zip(self.labelnames, key)),
+                "count": state["count"],
+                "sum": state["sum"],
+                "mean": state["sum"] / state["count"] if state["count"] else None,
+                "p50": self._quantile(state, 0.5),
+                "p95": self._quantile(state, 0.95),
+                "p99": self._quantile(state, 0.99),
+            }
+            for key, state in states
+        ]
+
+
+def _subtract(state: Dict, baseline: Dict) -> Dict:
+    return {
+        "counts": [a - b for a, b in zip(state["counts"], baseline["counts"])],
+        "sum": state["sum"] - baseline["sum"],
+        "count": state["count"] - baseline["count"],
+    }
+
+
+class MetricsRegistry:
+    """In-process collection of metrics.
+
+    Metrics are created on first use and shared by name, so instrumented modules
+    can ask for the same metric independently. Export with `to_prometheus` (text
+    exposition format) or `summary` (JSON serializable dict).
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, labelnames: Sequence[str], **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif type(metric) is not cls:
+                raise ValueError(f"Metric {name} is a {metric.type}")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def to_prometheus(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.to_prometheus())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Current values of every metric, to report a later `summary` against"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def summary(self, since: Optional[Dict[str, Dict]] = None) -> Dict[str, Dict]:
+        """Values of every metric.
+
+        Args:
+            since (dict): A `snapshot`. Counters and histograms then only report
+                          what was recorded after it, gauges their current value.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: {
+                "type": metric.type,
+                "values": metric.summary(
+                    None if since is None else since.get(metric.name, {})
+                ),
+            }
+            for metric in metrics
+        }
+
+    def reset(self):
+        """Clear the values of every metric, e.g. between simulations"""
+        with self._lock:
+            for metric in self._metrics.values():
+                with metric._lock:
+                    metric._values.clear()
+
+
+# shared by every instrumented module of the process
+registry = MetricsRegistry()
+
+llm_requests = registry.counter(
+    "hn_llm_requests_total",
+    "LLM requests by model and outcome (ok, error, rate_limited, cache_hit)",
+    ["model", "status"],
+)
+llm_latency = registry.histogram(
+    "hn_llm_request_seconds", "Latency of LLM requests sent to the provider", ["model"]
+)
+llm_tokens = registry.counter(
+    "hn_llm_tokens_total",
+    "Tokens by model and kind (input, cached_input, output)",
+    ["model", "kind"],
+)
+llm_cost = registry.counter(
+    "hn_llm_cost_usd_total", "Estimated cost of LLM requests in USD", ["model"]
+)
+deployment_requests = registry.counter(
+    "hn_deployment_requests_total",
+    "LLM requests by deployment and outcome (ok, error, rate_limited)",
+    ["deployment", "status"],
+)
+rate_limit_waits = registry.counter(
+    "hn_rate_limit_waits_total", "Requests delayed by the rate limiter", ["model"]
+)
+rate_limit_wait_seconds = registry.counter(
+    "hn_rate_limit_wait_seconds_total",
+    "Time requests spent waiting for the rate limiter",
+    ["model"],
+)
+agent_retries = registry.counter(
+    "hn_agent_retries_total",
+    "Agent request retries by reason (error, rate_limited)",
+    ["model", "reason"],
+)
+agent_failures = registry.counter(
+    "hn_agent_failures_total",
+    "Agents that defaulted to no action after exhausting retries",
+    ["model"],
+)
+# histograms rather than last-step gauges, so concurrent runs add up instead of
+# overwriting each other. Throughput is the rate of `hn_agent_actions_total`.
+step_activated = registry.histogram(
+    "hn_step_activated_agents",
+    "Agents activated per time step",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+step_seconds = registry.histogram(
+    "hn_step_seconds",
+    "Wall time of time steps in seconds",
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+cascade_requests = registry.counter(
+    "hn_cascade_requests_total",
+    "Requests of cascade agents by tier (decision, comment) and model",
+    ["tier", "model"],
+)
+cascade_latency = registry.histogram(
+    "hn_cascade_request_seconds",
+    "Latency of cascade agent tiers, retries included",
+    ["tier"],
+)
+cascade_tokens = registry.counter(
+    "hn_cascade_tokens_total",
+    "Tokens of cascade agent tiers by kind (input, cached_input, output)",
+    ["tier", "kind"],
+)
+agent_actions = registry.counter(
+    "hn_agent_actions_total", "Agent actions applied to the post"
+)
@@ -0,0 +1,193 @@
+import gzip
+import io
+import json
+import zlib
+from typing import IO, Dict, Iterable, Iterator, List, Optional
+
+from hn_core.utils.logger import get_logger
+from hn_core.utils.metrics import registry
+
+logger = get_logger("hn_results")
+
+
+def _compression(path: str, compression: Optional[str]) -> Optional[str]:
+    """Compression of `path`, inferred from the file extension if not given"""
+    if compression is not None:
+        if compression not in ("gzip", "zstd"):
+            raise ValueError(f"Unknown compression: {compression}")
+        return compression
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            "zstd compression requires the `zstandard` package (pip install zstandard)"
+        )
+    return zstandard
+
+
+def post_record(post, delta: Dict, upvotes: int) -> Dict:
+    """Post history record with the texts of the comments added since the previous one"""
+    start, end = delta["new_comments"]
+    return {
+        "sim_step": delta["sim_step"],
+        "upvotes": upvotes,
+        "upvotes_delta": delta["upvotes_delta"],
+        "comments_count": end,
+        "new_comments": post.comments[start:end],
+        "score": delta["score"],
+    }
+
+
+class ResultsWriter:
+    """Buffered, append-only JSONL sink for simulation results.
+
+    Every line is one record with a `type`:
+    - `metadata`: the post title, url and text
+    - `action`: one `Environment.agent_actions` entry
+    - `post`: one post history record, see `post_record`
+    - `metrics`: the metrics summary of the run, see `write_metrics`
+
+    Records are buffered in memory up to `buffer_size` characters. `flush` writes
+    them out (and flushes the compressor), so complete records can be read with
+    `read_results` while the simulation is still running.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        compression: Optional[str] = None,
+        buffer_size: int = 1 << 20,
+    ):
+        """
+        Args:
+            path (str): Output file
+            compression (str): "gzip" or "zstd", inferred from a `.gz`/`.zst` extension
+                               by default
+            buffer_size (int): Number of characters buffered before they are written
+        """
+        self.path = path
+        self.compression = _compression(path, compression)
+        self.buffer_size = buffer_size
+        self._buffer: List[str] = []
+        self._buffered = 0
+
+        self._raw = open(path, "wb")
+        if self.compression == "gzip":
+            self._stream: IO[bytes] = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        elif self.compression == "zstd":
+            self._stream = _zstandard().ZstdCompressor().stream_writer(self._raw)
+        else:
+            self._stream = self._raw
+
+    def __enter__(self) -> "ResultsWriter":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        self._buffer.append(line)
+        self._buffered += len(line)
+        if self._buffered >= self.buffer_size:
+            self._write_buffer()
+
+    def write_metadata(self, metadata: Dict):
+        self.write({"type": "metadata", **metadata})
+
+    def write_actions(self, actions: Iterable[Dict]):
+        for action in actions:
+            self.write({"type": "action", **action})
+
+    def write_post(self, record: Dict):
+        self.write({"type": "post", **record})
+
+    def write_metrics(self, step_metrics: List[Dict], since: Optional[Dict] = None):
+        """Per step activation/throughput and the metrics registry.
+
+        Args:
+            step_metrics (list): `Environment.step_metrics`
+            since (dict): Registry snapshot taken when the run started, usually
+                          `Environment.metrics_baseline`. Counters and histograms then
+                          hold what was recorded during the run instead of since the
+                          process started. The registry is process-wide, so runs
+                          overlapping in the same process are still included.
+        """
+        self.write(
+            {
+                "type": "metrics",
+                "steps": step_metrics,
+                "registry": registry.summary(since=since),
+            }
+        )
+
+    def _write_buffer(self):
+        if self._buffer:
+            self._stream.write("".join(self._buffer).encode("utf-8"))
+            self._buffer = []
+            self._buffered = 0
+
+    def flush(self):
+        """Write buffered records, so readers see every record written so far"""
+        self._write_buffer()
+        if self.compression == "gzip":
+            self._stream.flush(zlib.Z_SYNC_FLUSH)
+        elif self.compression == "zstd":
+            self._stream.flush(_zstandard().FLUSH_BLOCK)
+        self._raw.flush()
+
+    def close(self):
+        if self._raw.closed:
+            return
+        self._write_buffer()
+        if self._stream is not self._raw:
+            self._stream.close()
+        self._raw.close()
+
+
+def _open(path: str, compression: Optional[str]) -> IO[str]:
+    compression = _compression(path, compression)
+    if compression == "gzip":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if compression == "zstd":
+        reader = _zstandard().ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def read_results(
+    path: str,
+    types: Optional[Iterable[str]] = None,
+    compression: Optional[str] = None,
+) -> Iterator[Dict]:
+    """Stream the records of a results file.
+
+    Args:
+        path (str): File written by `ResultsWriter`
+        types (list): Only yield records of these types, e.g. `["action"]`
+        compression (str): See `ResultsWriter`
+
+    A record that is still being written (the file of a running simulation) ends
+    the stream.
+    """
+    types = set(types) if types is not None else None
+    with _open(path, compression) as f:
+        try:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    return
+                if types is None or record.get("type") in types:
+                    yield record
+        except EOFError:
+            # compressed stream of a running simulation
+            return
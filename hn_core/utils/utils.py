@@ -2,9 +2,10 @@ import datetime
 import json
 import os
 from collections import defaultdict
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from hn_core.simulation.environment import Environment
+from hn_core.utils.results import ResultsWriter, post_record
 
 
 def handler(obj):
@@ -17,31 +18,69 @@ def handler(obj):
     raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
 
 
-def build_simulation_results(environment: Environment) -> tuple[List, List]:
-    metadata = {
+def _post_metadata(environment: Environment) -> Dict:
+    return {
         "post_title": environment.post.title,
         "post_url": environment.post.url,
         "post_text": environment.post.text,
     }
 
-    # Create post history records
-    post_history = []
-    for state in environment.post.history:
-        record = {
-            "sim_step": state["sim_step"],
-            **metadata,
-            "upvotes": state["upvotes"],
-            "comments_count": state["comments_count"],
-            "comments": state["comments"],
-            "score": state["score"],
-        }
-        post_history.append(record)
 
+def build_simulation_results(environment: Environment) -> tuple[List, Dict]:
+    """Build agent actions and the compact post history of a simulation.
+
+    Post history is returned as `{"metadata": {...}, "history": [...]}` where each
+    history record only carries the comments added since the previous record.
+    Use `expand_post_history` to rebuild full per-record states.
+    """
+    post = environment.post
+
+    history = []
+    upvotes = 1
+    for delta in post.history:
+        upvotes += delta["upvotes_delta"]
+        history.append(post_record(post, delta, upvotes))
+
+    post_history = {"metadata": _post_metadata(environment), "history": history}
     return environment.agent_actions, post_history
 
 
-def save_simulation_results(environment: Environment):
-    """Save simulation results to JSON files in a timestamped Results directory.
+def expand_post_history(post_history: Dict) -> List[Dict]:
+    """Rebuild the full state of every record of a compact post history"""
+    records = []
+    comments = []
+    for record in post_history["history"]:
+        comments.extend(record["new_comments"])
+        records.append(
+            {
+                "sim_step": record["sim_step"],
+                **post_history["metadata"],
+                "upvotes": record["upvotes"],
+                "comments_count": record["comments_count"],
+                "comments": list(comments),
+                "score": record["score"],
+            }
+        )
+    return records
+
+
+def final_post_state(environment: Environment) -> Dict:
+    """Full state of the post at the end of the simulation"""
+    state = environment.post.state_at(-1)
+    return {
+        "sim_step": state["sim_step"],
+        **_post_metadata(environment),
+        "upvotes": state["upvotes"],
+        "comments_count": state["comments_count"],
+        "comments": state["comments"],
+        "score": state["score"],
+    }
+
+
+def save_simulation_results(
+    environment: Environment, compression: Optional[str] = None
+) -> str:
+    """Save simulation results to a JSONL file in a timestamped Results directory.
 
     This function preserves the state and outcomes of a Hacker News post simulation by saving:
     1. Agent Actions: A chronological record of all agent interactions and behaviors
@@ -50,20 +89,27 @@ def save_simulation_results(environment: Environment):
     The results are saved in a directory structure:
         ./results/
             └── YYYYMMDD_HHMMSS/
-                ├── agent_actions.json
-                └── post_history.json
+                └── results.jsonl (.gz / .zst when compressed)
 
     Args:
         environment (Environment): The simulation environment containing:
             - agent_actions: List of all agent interactions during simulation
             - post: The simulated HN post object with its complete history
-        timestamp (datetime.datetime): Timestamp used to create a unique directory name
+        compression (str): "gzip" or "zstd", uncompressed by default
+
+    The file holds one record per line, see `hn_core.utils.results.ResultsWriter`:
+        - metadata: title, URL and text of the post, stored once
+        - action: one agent behavior
+        - post: performance metrics per simulation step (upvotes, comments, score),
+          where each record only lists the comments added since the previous one
+        - metrics: LLM latency, token, cost, retry and throughput metrics
 
-    The saved files contain:
-        agent_actions.json: Chronological record of agent behaviors and interactions
-        post_history.json: Time series data for the post, including:
-            - Metadata (title, URL, text)
-            - Performance metrics per simulation step (upvotes, comments, score)
+    Use `hn_core.utils.results.read_results` to stream the records back. Runs that
+    stream their results while running (`Environment.run(results=...)`) don't need
+    this function.
+
+    Returns:
+        str: Path of the results file
     """
     results_dir = "hn_core/results"
     os.makedirs(results_dir, exist_ok=True)
@@ -76,15 +122,18 @@ def save_simulation_results(environment: Environment):
 
     agent_actions, post_history = build_simulation_results(environment=environment)
 
-    # Save agent actions
-    actions_filepath = os.path.join(simulation_dir, "agent_actions.json")
-    with open(actions_filepath, "w") as f:
-        json.dump(agent_actions, f, indent=2, default=handler)
-
-    # Save post history
-    post_filepath = os.path.join(simulation_dir, "post_history.json")
-    with open(post_filepath, "w") as f:
-        json.dump(post_history, f, indent=2, default=handler)
+    extension = {None: "", "gzip": ".gz", "zstd": ".zst"}[compression]
+    results_filepath = os.path.join(simulation_dir, f"results.jsonl{extension}")
+    with ResultsWriter(results_filepath, compression=compression) as results:
+        results.write_metadata(post_history["metadata"])
+        results.write_actions(agent_actions)
+        for record in post_history["history"]:
+            results.write_post(record)
+        results.write_metrics(
+            environment.step_metrics, since=environment.metrics_baseline
+        )
+
+    return results_filepath
 
 
 def build_agent_profile(actions: Dict):